@@ -0,0 +1,246 @@
+import logging
+import queue
+import sqlite3
+import struct
+import threading
+import argparse
+from chess_logic import ChessGame
+from protocol import pack_move, unpack_move
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    white TEXT NOT NULL,
+    black TEXT NOT NULL,
+    result TEXT,
+    winner TEXT,
+    started_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    move_count INTEGER NOT NULL,
+    white_points INTEGER NOT NULL,
+    black_points INTEGER NOT NULL,
+    moves BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_white ON games (white, started_at);
+CREATE INDEX IF NOT EXISTS games_black ON games (black, started_at);
+CREATE INDEX IF NOT EXISTS games_started_at ON games (started_at);
+CREATE INDEX IF NOT EXISTS games_result ON games (result, started_at);
+
+-- Every position reached in an archived game, clustered by Zobrist key so
+-- all games through a position sit next to each other on disk
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER NOT NULL,
+    game_id INTEGER NOT NULL,
+    ply INTEGER NOT NULL,
+    PRIMARY KEY (key, game_id, ply)
+) WITHOUT ROWID;
+"""
+
+COLUMNS = ('id', 'white', 'black', 'result', 'winner', 'started_at', 'duration',
+           'move_count', 'white_points', 'black_points')
+
+INSERT_GAME = """
+INSERT INTO games (white, black, result, winner, started_at, duration, move_count, white_points, black_points, moves)
+VALUES (:white, :black, :result, :winner, :started_at, :duration, :move_count, :white_points, :black_points, :moves)
+"""
+
+INSERT_POSITION = 'INSERT INTO positions (key, game_id, ply) VALUES (?, ?, ?)'
+
+FIND_POSITION = """
+SELECT games.id, games.white, games.black, games.result, games.winner, games.started_at, positions.ply
+FROM positions JOIN games ON games.id = positions.game_id
+WHERE positions.key = ? ORDER BY positions.game_id DESC LIMIT ?
+"""
+
+# Both halves walk their player index newest first and stop at the limit, so
+# the cost depends on the limit, not on how many games the player has
+PLAYER_HISTORY = f"""
+SELECT * FROM (SELECT {', '.join(COLUMNS)} FROM games WHERE white = :player AND started_at < :before
+               ORDER BY started_at DESC LIMIT :limit)
+UNION ALL
+SELECT * FROM (SELECT {', '.join(COLUMNS)} FROM games WHERE black = :player AND started_at < :before
+               ORDER BY started_at DESC LIMIT :limit)
+ORDER BY started_at DESC LIMIT :limit
+"""
+
+
+def pack_moves(move_history):
+    """Pack a ChessGame move history into two bytes per move."""
+    return b''.join(
+        struct.pack('>H', pack_move(move['from'], move['to'], move.get('promotion')))
+        for move in move_history
+    )
+
+
+def unpack_moves(data):
+    return [unpack_move(packed)[:2] for (packed,) in struct.iter_unpack('>H', data)]
+
+
+def to_signed64(key):
+    # SQLite integers are signed, Zobrist keys use the full unsigned 64 bits
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def position_keys(moves):
+    """Signed Zobrist key of the position after each move of a packed move list."""
+    game = ChessGame()
+    keys = []
+    for from_pos, to_pos in unpack_moves(moves):
+        game.apply_recorded_move(from_pos, to_pos)
+        keys.append(to_signed64(game.get_position_hash()))
+    return keys
+
+
+class GameArchive:
+    def __init__(self, path, batch_size=500, index_positions=True):
+        self.path = path
+        self.batch_size = batch_size  # Most games written per transaction
+        self.index_positions = index_positions
+        self.pending = queue.SimpleQueue()
+        self.thread = None
+        
+        # Readers each get their own connection, WAL lets them run alongside
+        # the writer
+        self.readers = threading.local()
+        
+        # Statistics
+        self.games_written = 0
+        self.transactions = 0
+        
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+    
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        if self.thread is not None:
+            self.pending.put(None)
+            self.thread.join()
+            self.thread = None
+    
+    def archive_game(self, record):
+        """Queue a finished game for writing, never blocks on the database."""
+        self.pending.put(record)
+    
+    def run(self):
+        # The writer's connection lives and dies on this thread
+        connection = self.connect()
+        stopping = False
+        
+        while not stopping:
+            # Whatever piled up while the last transaction was committing
+            # goes into the next one
+            batch = [self.pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+            
+            if not batch:
+                continue
+            
+            try:
+                with connection:
+                    for record in batch:
+                        game_id = connection.execute(INSERT_GAME, record).lastrowid
+                        if self.index_positions:
+                            # Replaying the moves happens here too, never on the game loop
+                            connection.executemany(INSERT_POSITION, (
+                                (key, game_id, ply) for ply, key in enumerate(position_keys(record['moves']), 1)
+                            ))
+                self.games_written += len(batch)
+                self.transactions += 1
+            except sqlite3.Error as e:
+                log.error("Error writing game archive: %s", e)
+        
+        connection.close()
+    
+    def reader(self):
+        connection = getattr(self.readers, 'connection', None)
+        if connection is None:
+            connection = self.readers.connection = self.connect()
+        return connection
+    
+    def player_history(self, username, limit=20, before=None):
+        """Most recent games of a player, newest first.
+        
+        Pass the started_at of the last game seen as before to page further back.
+        """
+        rows = self.reader().execute(PLAYER_HISTORY, {
+            'player': username,
+            'before': before if before is not None else float('inf'),
+            'limit': limit
+        }).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+    
+    def get_moves(self, game_id):
+        row = self.reader().execute('SELECT moves FROM games WHERE id = ?', (game_id,)).fetchone()
+        return unpack_moves(row[0]) if row else None
+    
+    def find_position(self, position_hash, limit=50):
+        """Archived games that reached a position, newest first, with the ply it was reached at."""
+        rows = self.reader().execute(FIND_POSITION, (to_signed64(position_hash), limit)).fetchall()
+        return [
+            dict(zip(('id', 'white', 'black', 'result', 'winner', 'started_at', 'ply'), row))
+            for row in rows
+        ]
+    
+    def rebuild_position_index(self, chunk_size=1000000):
+        """Recompute the position index of the whole archive.
+        
+        Rows are sorted by key before inserting so each chunk lands in the
+        clustered index mostly in order. Run it while the server is stopped.
+        """
+        connection = self.connect()
+        with connection:
+            connection.execute('DELETE FROM positions')
+        
+        # Games are streamed through a second connection while the first writes
+        scan = self.connect()
+        rows = []
+        total = 0
+        for game_id, moves in scan.execute('SELECT id, moves FROM games'):
+            rows.extend((key, game_id, ply) for ply, key in enumerate(position_keys(moves), 1))
+            if len(rows) >= chunk_size:
+                total += self.bulk_load_positions(connection, rows)
+                rows = []
+        total += self.bulk_load_positions(connection, rows)
+        
+        scan.close()
+        connection.close()
+        return total
+    
+    def bulk_load_positions(self, connection, rows):
+        rows.sort()
+        with connection:
+            connection.executemany(INSERT_POSITION, rows)
+        return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Chess game archive maintenance')
+    parser.add_argument('path', help='Archive database')
+    parser.add_argument('--rebuild-positions', action='store_true',
+                        help='Recompute the position index from the archived games')
+    args = parser.parse_args()
+    
+    if args.rebuild_positions:
+        archive = GameArchive(args.path)
+        print(f"Indexed {archive.rebuild_position_index()} positions")
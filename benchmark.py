@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from bot_client import BotStats, run_bots
+from protocol import FORMAT_JSON, WIRE_FORMATS
+from chess_logging import setup_logging, LOG_LEVELS
+
+log = logging.getLogger('benchmark')
+
+# Fixed scenarios so runs can be compared with each other, e.g. in CI.
+# Anything given on the command line overrides the scenario's value. A
+# spawned server also gets the scenario's server_args, ahead of --server-args.
+SCENARIOS = {
+    'smoke': {'bots': 20, 'processes': 1, 'games': 1, 'max_moves': 20, 'think_time': 0.0, 'ramp_up': 0.0},
+    # Players paired across workers are handed off to the one hosting their game
+    'smoke-workers': {'bots': 20, 'processes': 1, 'games': 2, 'max_moves': 20, 'think_time': 0.0, 'ramp_up': 0.0,
+                      'server_args': '--workers 3'},
+    'load': {'bots': 1000, 'processes': 4, 'games': 2, 'max_moves': 40, 'think_time': 0.05, 'ramp_up': 10.0},
+    'burst': {'bots': 2000, 'processes': 8, 'games': 1, 'max_moves': 10, 'think_time': 0.0, 'ramp_up': 0.0},
+    'soak': {'bots': 200, 'processes': 2, 'games': 20, 'max_moves': 60, 'think_time': 0.2, 'ramp_up': 5.0}
+}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Play many bot games against a server and report how it held up')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='smoke',
+                        help='Preset load to run (default: smoke)')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Server hostname or IP address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5555,
+                        help='Server port (default: 5555)')
+    parser.add_argument('--bots', type=int,
+                        help='Number of bots, rounded up to an even number')
+    parser.add_argument('--processes', type=int,
+                        help='Bot processes, each running its share of the bots on one event loop')
+    parser.add_argument('--games', type=int,
+                        help='Games each bot plays')
+    parser.add_argument('--max-moves', type=int,
+                        help='Plies after which a bot resigns')
+    parser.add_argument('--think-time', type=float,
+                        help='Seconds a bot waits before each move')
+    parser.add_argument('--ramp-up', type=float,
+                        help='Seconds over which the bots connect')
+    parser.add_argument('--protocol', choices=WIRE_FORMATS, default=FORMAT_JSON,
+                        help='Wire format the bots ask for (default: json)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Base seed for the bots\' move choices (default: 0)')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='Give up on bots still playing after this many seconds (default: 300)')
+    parser.add_argument('--spawn-server', action='store_true',
+                        help='Start server.py on --port for the run and stop it afterwards')
+    parser.add_argument('--server-args', default='',
+                        help='Extra arguments for the spawned server, e.g. "--workers 4"')
+    parser.add_argument('--server-pid', type=int,
+                        help='Sample CPU and memory of an already running server')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the report as JSON to this file')
+    parser.add_argument('--max-p99-ms', type=float,
+                        help='Exit with status 1 if p99 move round trip is above this')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO',
+                        help='Least severe log messages to show (default: INFO)')
+    return parser.parse_args()
+
+
+class ProcessSampler:
+    """Samples CPU time and resident memory of a process from /proc."""
+    
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.peak_rss = 0
+        self.stopping = threading.Event()
+        self.thread = None
+        self.started_cpu = None
+        self.started_at = None
+        self.cpu_seconds = 0.0
+        self.elapsed = 0.0
+    
+    def cpu_time(self):
+        with open(f'/proc/{self.pid}/stat') as stat:
+            # Fields after the ')' closing the command name, utime and stime are 14 and 15
+            fields = stat.read().rpartition(')')[2].split()
+        return (int(fields[11]) + int(fields[12])) / self.clock_ticks
+    
+    def rss(self):
+        with open(f'/proc/{self.pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return 0
+    
+    def start(self):
+        self.started_cpu = self.cpu_time()
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.peak_rss = max(self.peak_rss, self.rss())
+            except OSError:
+                return
+    
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        try:
+            self.peak_rss = max(self.peak_rss, self.rss())
+            self.cpu_seconds = self.cpu_time() - self.started_cpu
+        except OSError:
+            pass
+        self.elapsed = time.monotonic() - self.started_at
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bot_process(host, port, count, games, seed, name_prefix, options, timeout, log_level):
+    # Runs in a pool process, one event loop drives all of its bots
+    listener = setup_logging(log_level)
+    try:
+        return asyncio.run(asyncio.wait_for(
+            run_bots(host, port, count, games, seed, name_prefix, **options), timeout))
+    except asyncio.TimeoutError:
+        log.warning("%s: bots still playing after %ss", name_prefix, timeout)
+        stats = BotStats()
+        stats.errors += 1
+        return stats
+    finally:
+        listener.stop()
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def spawn_server(port, extra_args):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'WARNING'] + extra_args.split()
+    return subprocess.Popen(command)
+
+
+def run_benchmark(settings, host, port, wire_format, seed, timeout, server_pid=None, log_level='INFO'):
+    """Play the games and return the report as a dict."""
+    bots = settings['bots'] + settings['bots'] % 2  # Everyone needs an opponent
+    processes = max(1, min(settings['processes'], bots // 2))
+    options = {
+        'wire_format': wire_format,
+        'max_moves': settings['max_moves'],
+        'think_time': settings['think_time'],
+        'ramp_up': settings['ramp_up']
+    }
+    
+    # Split the bots as evenly as possible, each process gets its own names and seeds
+    shares = [bots // processes + (1 if index < bots % processes else 0) for index in range(processes)]
+    jobs = []
+    first_bot = 0
+    for index, count in enumerate(shares):
+        jobs.append((host, port, count, settings['games'], seed + first_bot, f'bench{index}-',
+                     options, timeout, log_level))
+        first_bot += count
+    
+    sampler = ProcessSampler(server_pid) if server_pid else None
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.starmap(bot_process, jobs)
+    
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.stop()
+    
+    stats = BotStats()
+    for result in results:
+        stats.merge(result)
+    
+    round_trips = stats.move_round_trips
+    # Both players count a finished game, so halve it
+    matches = stats.games_finished / 2
+    report = {
+        'bots': bots,
+        'processes': processes,
+        'games_per_bot': settings['games'],
+        'wire_format': wire_format,
+        'elapsed_seconds': round(elapsed, 3),
+        'matches': matches,
+        'matches_per_second': round(matches / elapsed, 2),
+        'moves': stats.moves,
+        'moves_per_second': round(stats.moves / elapsed, 2),
+        'chats': stats.chats,
+        'errors': stats.errors,
+        'busy_rejections': stats.busy,
+        'move_rtt_p50_ms': round(percentile(round_trips, 0.50) * 1000, 3) if round_trips else None,
+        'move_rtt_p99_ms': round(percentile(round_trips, 0.99) * 1000, 3) if round_trips else None,
+        'move_rtt_max_ms': round(max(round_trips) * 1000, 3) if round_trips else None
+    }
+    if sampler:
+        report['server_cpu_seconds'] = round(sampler.cpu_seconds, 3)
+        report['server_cpu_percent'] = round(100 * sampler.cpu_seconds / sampler.elapsed, 1) if sampler.elapsed else None
+        report['server_peak_rss_mb'] = round(sampler.peak_rss / (1024 * 1024), 1)
+    return report
+
+
+def print_report(report):
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        print(f"{key.ljust(width)}  {value}")
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    log_listener = setup_logging(args.log_level)
+    
+    settings = dict(SCENARIOS[args.scenario])
+    for key in ('bots', 'processes', 'games', 'max_moves', 'think_time', 'ramp_up'):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+    
+    server = None
+    server_pid = args.server_pid
+    exit_code = 0
+    try:
+        if args.spawn_server:
+            server = spawn_server(args.port, f"{settings.get('server_args', '')} {args.server_args}")
+            server_pid = server.pid
+            if not wait_for_port(args.host, args.port):
+                log.error("Server did not start listening on port %d", args.port)
+                sys.exit(1)
+        
+        report = run_benchmark(settings, args.host, args.port, args.protocol, args.seed, args.timeout,
+                               server_pid, args.log_level)
+        report = {'scenario': args.scenario, **report}
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+        
+        # Non-zero exit lets a CI job fail on regressions
+        if report['errors'] or report['matches'] < report['bots'] * report['games_per_bot'] / 2:
+            log.error("Run had errors or unfinished games")
+            exit_code = 1
+        if args.max_p99_ms is not None and (report['move_rtt_p99_ms'] or 0) > args.max_p99_ms:
+            log.error("p99 move round trip %.3fms is above the %.3fms limit", report['move_rtt_p99_ms'], args.max_p99_ms)
+            exit_code = 1
+    finally:
+        if server is not None:
+            # Terminating drains, don't wait long on games a timed out run left behind
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+        log_listener.stop()
+    sys.exit(exit_code)
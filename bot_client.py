@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import logging
+import random
+import time
+from chess_logic import ChessGame
+from protocol import encode_message, MessageReader, FORMAT_JSON, WIRE_FORMATS, COMPRESSIONS
+from chess_logging import setup_logging, LOG_LEVELS
+
+log = logging.getLogger('bot_client')
+
+CHAT_LINES = ('gl hf', 'nice move', 'hmm', 'good game', 'oops')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Headless chess bots for load testing')
+    parser.add_argument('--host', default='localhost',
+                        help='Server hostname or IP address (default: localhost)')
+    parser.add_argument('--port', type=int, default=5555,
+                        help='Server port (default: 5555)')
+    parser.add_argument('--bots', type=int, default=2,
+                        help='Bots to run in this process (default: 2)')
+    parser.add_argument('--games', type=int, default=1,
+                        help='Games each bot plays before leaving (default: 1)')
+    parser.add_argument('--protocol', choices=WIRE_FORMATS, default=FORMAT_JSON,
+                        help='Wire format the bots ask for (default: json)')
+    parser.add_argument('--compression', choices=COMPRESSIONS,
+                        help='Compression the bots ask for (default: none)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Base seed, bot n plays with seed + n (default: 0)')
+    parser.add_argument('--ramp-up', type=float, default=0.0,
+                        help='Seconds over which the bots connect (default: 0)')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO',
+                        help='Least severe log messages to show (default: INFO)')
+    return parser.parse_args()
+
+
+def random_legal_move(game, color, rng):
+    """A random move for color that ChessGame accepts and doesn't leave its king attacked.
+    
+    Returns ([from_row, from_col], [to_row, to_col]), or None if there is no such move.
+    """
+    # Squares are tried in random order and the first acceptable move is
+    # taken, cheaper than listing every legal move first
+    pieces = [(row, col) for row in range(8) for col in range(8)
+              if game.board[row][col] and game.board[row][col].color == color]
+    targets = [(row, col) for row in range(8) for col in range(8)]
+    rng.shuffle(pieces)
+    
+    for from_row, from_col in pieces:
+        rng.shuffle(targets)
+        for to_row, to_col in targets:
+            if (from_row, from_col) == (to_row, to_col):
+                continue
+            if not game._is_valid_move(from_row, from_col, to_row, to_col)['valid']:
+                continue
+            if leaves_king_attacked(game, color, from_row, from_col, to_row, to_col):
+                continue
+            return [from_row, from_col], [to_row, to_col]
+    return None
+
+
+def leaves_king_attacked(game, color, from_row, from_col, to_row, to_col):
+    board = [row[:] for row in game.board]
+    board[to_row][to_col] = board[from_row][from_col]
+    board[from_row][from_col] = None
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece and piece.color == color and piece.type == 'king':
+                return game._is_square_attacked(row, col, color, board)
+    return True
+
+
+class BotStats:
+    def __init__(self):
+        self.move_round_trips = []  # Seconds from sending a move to its move_result
+        self.games_finished = 0
+        self.moves = 0
+        self.chats = 0
+        self.errors = 0
+        self.busy = 0  # Times the server turned a bot away and it came back later
+    
+    def merge(self, other):
+        self.move_round_trips.extend(other.move_round_trips)
+        self.games_finished += other.games_finished
+        self.moves += other.moves
+        self.chats += other.chats
+        self.errors += other.errors
+        self.busy += other.busy
+
+
+class ChessBot:
+    """A client without the GUI that plays random legal moves.
+    
+    Keeps its own ChessGame in step with the server's moves and picks from
+    the moves ChessGame accepts, so everything it sends is valid.
+    """
+    
+    def __init__(self, host, port, username, seed=0, wire_format=FORMAT_JSON, compression=None,
+                 max_moves=40, chat_chance=0.05, think_time=0.0, connect_timeout=10.0, busy_retries=5, stats=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.random = random.Random(seed)
+        self.wire_format = wire_format
+        self.compression = compression
+        self.max_moves = max_moves  # Resign once the game is this many plies long
+        self.chat_chance = chat_chance  # Chance of a chat line with each move
+        self.think_time = think_time  # Pause before each move, in seconds
+        self.connect_timeout = connect_timeout
+        self.busy_retries = busy_retries  # Times to come back after a server_busy before giving up
+        self.stats = stats if stats is not None else BotStats()
+        
+        self.reader = None
+        self.writer = None
+        self.messages = MessageReader(negotiate=True, inflate=True)
+        self.sent_format = FORMAT_JSON
+        self.game = None
+        self.color = None
+        self.move_sent_at = None
+    
+    async def run(self, games=1):
+        await self.connect()
+        try:
+            for _ in range(games):
+                await self.play_game()
+        finally:
+            self.writer.close()
+    
+    async def connect(self, handoff=None):
+        handshake = {'username': self.username, 'format': self.wire_format, 'compression': self.compression}
+        if handoff:
+            # Joining a game hosted by another server process
+            handshake['handoff'] = handoff
+        for attempt in range(self.busy_retries + 1):
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            self.messages = MessageReader(negotiate=True, inflate=True)
+            self.sent_format = FORMAT_JSON
+            self.send(handshake)
+            try:
+                message = await asyncio.wait_for(self.expect('connection_success', 'server_busy'), self.connect_timeout)
+            except asyncio.TimeoutError:
+                # Typically the server's accept backlog overflowed
+                self.writer.close()
+                raise ConnectionError(f"{self.username}: no connection_success within {self.connect_timeout}s")
+            except ConnectionError:
+                self.writer.close()
+                raise
+            
+            if message['type'] == 'connection_success':
+                return
+            # Turned away, come back when the server said to
+            self.writer.close()
+            self.stats.busy += 1
+            await asyncio.sleep(message.get('retry_after', 1))
+        raise ConnectionError(f"{self.username}: server still busy after {self.busy_retries} retries")
+    
+    async def play_game(self):
+        self.send({'type': 'find_game'})
+        while True:
+            message = await self.receive()
+            message_type = message.get('type')
+            
+            if message_type == 'game_start':
+                self.game = ChessGame()
+                self.color = message['color']
+                self.move_sent_at = None
+                if self.color == 'white':
+                    await self.move()
+            
+            elif message_type == 'move_result':
+                if not message.get('valid'):
+                    # Our replica and the server disagree, nothing sensible left to do
+                    log.warning("%s: move rejected: %s", self.username, message.get('message'))
+                    self.stats.errors += 1
+                    self.send({'type': 'resign'})
+                    continue
+                if self.move_sent_at is not None:
+                    self.stats.move_round_trips.append(time.perf_counter() - self.move_sent_at)
+                    self.move_sent_at = None
+                self.apply(message)
+            
+            elif message_type == 'opponent_move':
+                self.apply(message)
+                if not self.game.game_over:
+                    await self.move()
+            
+            elif message_type == 'game_over':
+                self.stats.games_finished += 1
+                self.game = None
+                return
+            
+            elif message_type == 'handoff':
+                # Our game is hosted by another worker, reconnect there and
+                # wait for its game_start
+                self.writer.close()
+                await self.connect(handoff=message.get('token'))
+            
+            elif message_type == 'ping':
+                self.send({'type': 'pong'})
+            
+            elif message_type == 'error':
+                log.warning("%s: error from server: %s", self.username, message.get('message'))
+                self.stats.errors += 1
+    
+    async def move(self):
+        if self.think_time:
+            await asyncio.sleep(self.think_time)
+        
+        if self.game.get_move_count() >= self.max_moves:
+            self.send({'type': 'resign'})
+            return
+        
+        choice = random_legal_move(self.game, self.color, self.random)
+        if choice is None:
+            # Every move leaves our king en prise, give up
+            self.send({'type': 'resign'})
+            return
+        
+        from_pos, to_pos = choice
+        self.move_sent_at = time.perf_counter()
+        self.send({'type': 'move', 'from': from_pos, 'to': to_pos})
+        self.stats.moves += 1
+        
+        if self.random.random() < self.chat_chance:
+            self.send({'type': 'chat', 'content': self.random.choice(CHAT_LINES)})
+            self.stats.chats += 1
+    
+    def apply(self, message):
+        move = message['move']
+        result = self.game.make_move(move['from'], move['to'])
+        if not result['valid'] or self.game.get_position_hash() != message.get('hash'):
+            log.warning("%s: replica out of step after %s", self.username, move)
+            self.stats.errors += 1
+    
+    def send(self, message):
+        self.writer.write(encode_message(message, self.sent_format))
+    
+    async def receive(self):
+        while True:
+            messages = self.messages.feed(b'', limit=1)
+            if messages:
+                message = messages[0]
+                if message.get('type') == 'connection_success':
+                    # Switch what we send once the server confirms the format
+                    self.sent_format = message.get('format', FORMAT_JSON)
+                return message
+            
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError(f"{self.username}: server closed the connection")
+            self.messages.feed(data, limit=0)
+    
+    async def expect(self, *message_types):
+        while True:
+            message = await self.receive()
+            if message.get('type') in message_types:
+                return message
+
+
+async def run_bots(host, port, count, games=1, seed=0, name_prefix='bot', ramp_up=0.0, **options):
+    """Run count bots concurrently on one event loop, returns their combined BotStats.
+    
+    Bots connect evenly spread over ramp_up seconds rather than all at once.
+    """
+    stats = BotStats()
+    
+    async def run_bot(index):
+        await asyncio.sleep(ramp_up * index / count)
+        bot = ChessBot(host, port, f'{name_prefix}{index}', seed=seed + index, stats=stats, **options)
+        await bot.run(games)
+    
+    results = await asyncio.gather(*(run_bot(index) for index in range(count)), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            log.warning("Bot failed: %s", result)
+            stats.errors += 1
+    return stats
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    log_listener = setup_logging(args.log_level)
+    try:
+        stats = asyncio.run(run_bots(args.host, args.port, args.bots, args.games, args.seed,
+                                     ramp_up=args.ramp_up, wire_format=args.protocol,
+                                     compression=args.compression))
+        log.info("%d games finished, %d moves, %d errors, turned away %d times",
+                 stats.games_finished, stats.moves, stats.errors, stats.busy)
+    finally:
+        log_listener.stop()
@@ -0,0 +1,242 @@
+import base64
+import collections
+import json
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from matchmaker import Matchmaker, DEFAULT_RATING
+from chess_logging import setup_logging
+from protocol import MAX_CLIENT_FRAME_SIZE
+
+log = logging.getLogger(__name__)
+
+# Most client bytes forwarded along with a connection: the handshake and
+# whatever arrived in the same reads
+MAX_FORWARDED_DATA = 2 * MAX_CLIENT_FRAME_SIZE
+
+# Largest message exchanged between workers and the broker. SOCK_SEQPACKET
+# keeps message boundaries, so every send is exactly one JSON message. The
+# biggest is a forward, its data base64 encoded inside a small envelope.
+PACKET_SIZE = 4 * MAX_FORWARDED_DATA // 3 + 4096
+
+# How long a handoff token stays valid for the moving player to reconnect
+HANDOFF_TIMEOUT = 30
+
+
+def send_packet(sock, message, fds=()):
+    data = json.dumps(message).encode('utf-8')
+    if len(data) > PACKET_SIZE:
+        # The receiver would only get the start of it
+        raise ValueError(f"{message.get('type')} message of {len(data)} bytes exceeds {PACKET_SIZE}")
+    if fds:
+        # The file descriptors travel alongside as SCM_RIGHTS ancillary data
+        socket.send_fds(sock, [data], list(fds))
+    else:
+        sock.send(data)
+
+
+def recv_packet(sock):
+    while True:
+        data, fds, flags, address = socket.recv_fds(sock, PACKET_SIZE, 1)
+        if not flags & socket.MSG_TRUNC:
+            break
+        # Cut short, so it can't be parsed. Drop it along with any connection
+        # it carried rather than the whole link.
+        log.error("Dropping a message larger than %d bytes", PACKET_SIZE)
+        for fd in fds:
+            os.close(fd)
+    
+    if not data:
+        return None, fds
+    return json.loads(data.decode('utf-8')), fds
+
+
+def encode_handoff_data(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def decode_handoff_data(data):
+    return base64.b64decode(data)
+
+
+class MatchBroker:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.workers = {}  # {worker_id: (socket, send_lock)}
+        self.ratings = {}  # {(worker_id, player_key): rating} for queued players
+        self.handoffs = collections.OrderedDict()  # {token: (owner_worker_id, issued_at)}
+        
+        # Queue entries are (worker_id, player_key) pairs from every worker
+        self.matchmaker = Matchmaker(self.on_match)
+    
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        listener.bind(self.path)
+        listener.listen(64)
+        self.matchmaker.start()
+        log.info("Match broker listening on %s", self.path)
+        
+        try:
+            while True:
+                worker_socket, _ = listener.accept()
+                worker_thread = threading.Thread(target=self.handle_worker, args=(worker_socket,))
+                worker_thread.daemon = True
+                worker_thread.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.matchmaker.stop()
+            listener.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+    
+    def handle_worker(self, worker_socket):
+        worker_id = None
+        queued = set()
+        try:
+            # First message from a worker identifies it
+            message, fds = recv_packet(worker_socket)
+            if message is None or message.get('type') != 'hello':
+                return
+            worker_id = message['worker']
+            with self.lock:
+                self.workers[worker_id] = (worker_socket, threading.Lock())
+            
+            while True:
+                message, fds = recv_packet(worker_socket)
+                if message is None:
+                    break
+                
+                message_type = message.get('type')
+                if message_type == 'enqueue':
+                    player = (worker_id, message['player'])
+                    with self.lock:
+                        self.ratings[player] = message.get('rating', DEFAULT_RATING)
+                    queued.add(player)
+                    self.matchmaker.enqueue(player, self.ratings[player])
+                elif message_type == 'dequeue':
+                    player = (worker_id, message['player'])
+                    queued.discard(player)
+                    self.matchmaker.remove(player)
+                elif message_type == 'forward':
+                    self.forward_connection(message, fds)
+                else:
+                    for fd in fds:
+                        os.close(fd)
+        except Exception as e:
+            log.error("Error handling worker %s: %s", worker_id, e)
+        finally:
+            # Players of a dead worker can't be matched anymore
+            for player in queued:
+                self.matchmaker.remove(player)
+            with self.lock:
+                if worker_id is not None and self.workers.get(worker_id, (None,))[0] is worker_socket:
+                    del self.workers[worker_id]
+            worker_socket.close()
+    
+    def on_match(self, player1, player2, game_id):
+        # The first player's worker owns the game, the other player (if it
+        # lives elsewhere) gets a token to reconnect to it with
+        owner = player1[0]
+        now = time.monotonic()
+        players = []
+        
+        with self.lock:
+            # Tokens are issued in time order, expired ones sit at the front
+            while self.handoffs and now - next(iter(self.handoffs.values()))[1] > HANDOFF_TIMEOUT:
+                self.handoffs.popitem(last=False)
+            
+            for worker_id, player_key in (player1, player2):
+                entry = {
+                    'worker': worker_id,
+                    'player': player_key,
+                    'rating': self.ratings.pop((worker_id, player_key), DEFAULT_RATING)
+                }
+                if worker_id != owner:
+                    entry['token'] = secrets.token_hex(16)
+                    self.handoffs[entry['token']] = (owner, now)
+                players.append(entry)
+        
+        message = {'type': 'match', 'game_id': game_id, 'owner': owner, 'players': players}
+        for worker_id in {player1[0], player2[0]}:
+            self.send_to_worker(worker_id, message)
+    
+    def forward_connection(self, message, fds):
+        # A reconnecting player landed on the wrong worker, pass the socket on.
+        # Resumed sessions name their worker, handoffs go by token.
+        with self.lock:
+            if 'worker' in message:
+                owner = message['worker']
+            else:
+                owner = self.handoffs.pop(message.get('token'), (None,))[0]
+        
+        try:
+            if owner is not None and fds:
+                self.send_to_worker(owner, message, fds)
+        finally:
+            # Our copies are no longer needed once they are in flight
+            for fd in fds:
+                os.close(fd)
+    
+    def send_to_worker(self, worker_id, message, fds=()):
+        with self.lock:
+            worker = self.workers.get(worker_id)
+        if worker is None:
+            return False
+        
+        worker_socket, send_lock = worker
+        try:
+            with send_lock:
+                send_packet(worker_socket, message, fds)
+            return True
+        except OSError as e:
+            log.error("Error sending to worker %s: %s", worker_id, e)
+            return False
+
+
+class BrokerLink:
+    def __init__(self, path, worker_id, on_message):
+        # Worker side of the broker connection; on_message(message, fds) runs on
+        # the link's reader thread
+        self.worker_id = worker_id
+        self.on_message = on_message
+        self.send_lock = threading.Lock()
+        
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.socket.connect(path)
+        self.send({'type': 'hello', 'worker': worker_id})
+        
+        self.thread = threading.Thread(target=self.receive_messages)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def send(self, message, fds=()):
+        with self.send_lock:
+            send_packet(self.socket, message, fds)
+    
+    def receive_messages(self):
+        try:
+            while True:
+                message, fds = recv_packet(self.socket)
+                if message is None:
+                    break
+                try:
+                    self.on_message(message, fds)
+                except Exception as e:
+                    log.error("Error handling broker message: %s", e)
+        except OSError as e:
+            log.error("Lost connection to match broker: %s", e)
+        log.warning("Worker %s disconnected from match broker", self.worker_id)
+
+
+def run_broker(path, log_level=None):
+    if log_level is not None:
+        setup_logging(log_level)
+    MatchBroker(path).serve_forever()
@@ -0,0 +1,47 @@
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+
+def setup_logging(level='INFO'):
+    """Send all log records through a queue to a single background writer.
+
+    Callers only pay for creating the record and a queue put, never for
+    formatting or writing to stdout. Records below the level (payload dumps
+    are all DEBUG) are dropped before either happens. Returns the listener,
+    stop() it at shutdown to flush what is left.
+    """
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, output)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+
+    listener.start()
+    return listener
+
+
+class Sampler:
+    """Lets one in every few occurrences of a frequent event through.
+
+    Calling it returns how many occurrences there have been when this one
+    should be logged, 0 otherwise.
+    """
+
+    def __init__(self, every):
+        self.every = every
+        self.occurrences = itertools.count(1)  # next() is atomic, no lock needed
+
+    def __call__(self):
+        occurrence = next(self.occurrences)
+        return occurrence if occurrence % self.every == 0 else 0
@@ -1,4 +1,80 @@
 import time
+import random
+
+# Standard chess piece point values
+PIECE_POINT_VALUES = {
+    'pawn': 1,
+    'knight': 3,
+    'bishop': 3,
+    'rook': 5,
+    'queen': 9,
+    'king': 0  # King has no point value since it can't be captured
+}
+
+# Zobrist keys for position hashing. The generator is seeded so that the
+# server and every client derive exactly the same table.
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECE_KEYS = {
+    (color, piece_type): [_zobrist_random.getrandbits(64) for _ in range(64)]
+    for color in ('white', 'black')
+    for piece_type in ('pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+# Drawn after the original table so the piece keys stay the same
+ZOBRIST_CASTLING_KEYS = {
+    (color, rook_col): _zobrist_random.getrandbits(64)
+    for color in ('white', 'black')
+    for rook_col in (0, 7)
+}
+ZOBRIST_EN_PASSANT_KEYS = [_zobrist_random.getrandbits(64) for _ in range(8)]
+
+
+def _piece_key(piece):
+    if isinstance(piece, dict):
+        return piece['color'], piece['type'], piece.get('has_moved', False)
+    return piece.color, piece.type, piece.has_moved
+
+
+def compute_position_hash(board, turn, en_passant_target=None):
+    """Zobrist hash of a board of Piece objects or piece dicts plus side to move.
+    
+    Castling rights come from the has_moved flags of the kings and rooks, the
+    en passant file from the square of a pawn that just moved two squares, so
+    positions that only differ in those rights hash differently.
+    """
+    position_hash = 0
+    for row in range(8):
+        for col in range(8):
+            piece = board[row][col]
+            if piece:
+                color, piece_type, has_moved = _piece_key(piece)
+                position_hash ^= ZOBRIST_PIECE_KEYS[(color, piece_type)][row * 8 + col]
+    
+    if turn == 'black':
+        position_hash ^= ZOBRIST_BLACK_TO_MOVE
+    
+    # A side can still castle with a rook while neither it nor the king moved
+    for color, home_row in (('white', 7), ('black', 0)):
+        king = board[home_row][4]
+        if not king or _piece_key(king) != (color, 'king', False):
+            continue
+        for rook_col in (0, 7):
+            rook = board[home_row][rook_col]
+            if rook and _piece_key(rook) == (color, 'rook', False):
+                position_hash ^= ZOBRIST_CASTLING_KEYS[(color, rook_col)]
+    
+    # Only count en passant when a pawn of the side to move can take it
+    if en_passant_target:
+        row, col = en_passant_target
+        for capture_col in (col - 1, col + 1):
+            if 0 <= capture_col < 8:
+                pawn = board[row][capture_col]
+                if pawn and _piece_key(pawn)[:2] == (turn, 'pawn'):
+                    position_hash ^= ZOBRIST_EN_PASSANT_KEYS[col]
+                    break
+    
+    return position_hash
+
 
 class Piece:
     def __init__(self, color, piece_type):
@@ -6,15 +82,8 @@ class Piece:
         self.type = piece_type  # 'pawn', 'rook', 'knight', 'bishop', 'queen', 'king'
         self.has_moved = False
         
-        # Standard chess piece point values
-        self.point_values = {
-            'pawn': 1,
-            'knight': 3,
-            'bishop': 3,
-            'rook': 5,
-            'queen': 9,
-            'king': 0  # King has no point value since it can't be captured
-        }
+        # Shared table, no need for a copy per piece
+        self.point_values = PIECE_POINT_VALUES
     
     def __str__(self):
         return f"{self.color[0]}{self.type[0]}"
@@ -105,6 +174,25 @@ class ChessGame:
     def get_current_turn(self):
         return self.current_turn
     
+    def get_position_hash(self):
+        """Get the Zobrist hash of the current position."""
+        return compute_position_hash(self.board, self.current_turn, self.en_passant_target)
+    
+    def get_move_delta(self, index=-1):
+        """Get a recorded move as the minimal board change needed to replay it."""
+        move = self.move_history[index]
+        delta = {'from': list(move['from']), 'to': list(move['to'])}
+        
+        # Optional parts are left out entirely to keep the delta small
+        if move['promotion']:
+            delta['promotion'] = move['promotion']
+        if move['captured_square']:
+            delta['captured'] = list(move['captured_square'])
+        if move['rook_move']:
+            delta['rook'] = [list(move['rook_move'][0]), list(move['rook_move'][1])]
+        
+        return delta
+    
     def get_game_status(self):
         return {
             'game_over': self.game_over,
@@ -141,8 +229,54 @@ class ChessGame:
         if not valid_move['valid']:
             return valid_move
         
+        self._apply_move(from_row, from_col, to_row, to_col)
+        
+        # Check for check or checkmate
+        self._update_check_status()
+        if self._is_checkmate():
+            self.game_over = True
+            self.result = 'checkmate'
+            self.winner = 'white' if self.current_turn == 'black' else 'black'
+        elif self._is_stalemate():
+            self.game_over = True
+            self.result = 'stalemate'
+            self.winner = None
+        elif self._is_draw_by_insufficient_material():
+            self.game_over = True
+            self.result = 'insufficient_material'
+            self.winner = None
+        elif self._is_draw_by_fifty_move_rule():
+            self.game_over = True
+            self.result = 'fifty_move_rule'
+            self.winner = None
+        elif self._is_draw_by_threefold_repetition():
+            self.game_over = True
+            self.result = 'threefold_repetition'
+            self.winner = None
+        
+        # If game is over, record end time
+        if self.game_over:
+            self.end_time = time.time()
+        
+        return {'valid': True}
+    
+    def apply_recorded_move(self, from_pos, to_pos):
+        """Replay a move that was already validated when it was first played.
+        
+        Skips move validation and all check/game-over detection, call
+        refresh_status() once after the last replayed move.
+        """
+        self._apply_move(from_pos[0], from_pos[1], to_pos[0], to_pos[1])
+    
+    def refresh_status(self):
+        self._update_check_status()
+    
+    def _apply_move(self, from_row, from_col, to_row, to_col):
+        piece = self.board[from_row][from_col]
+        
         # Make the move
         captured_piece = self.board[to_row][to_col]
+        captured_square = (to_row, to_col) if captured_piece else None
         
         # Special handling for en passant
         en_passant = False
@@ -150,11 +284,11 @@ class ChessGame:
             # This is an en passant capture
             en_passant = True
             if piece.color == 'white':
-                captured_piece = self.board[to_row + 1][to_col]
-                self.board[to_row + 1][to_col] = None
+                captured_square = (to_row + 1, to_col)
             else:
-                captured_piece = self.board[to_row - 1][to_col]
-                self.board[to_row - 1][to_col] = None
+                captured_square = (to_row - 1, to_col)
+            captured_piece = self.board[captured_square[0]][captured_square[1]]
+            self.board[captured_square[0]][captured_square[1]] = None
         
         # Record capture if there was one
         if captured_piece:
@@ -167,6 +301,7 @@ class ChessGame:
         self.board[from_row][from_col] = None
         
         # Special handling for castling
+        rook_move = None
         if piece.type == 'king' and abs(to_col - from_col) == 2:
             # This is castling - move the rook too
             if to_col > from_col:  # Kingside castling
@@ -174,16 +309,20 @@ class ChessGame:
                 self.board[from_row][7] = None
                 self.board[from_row][5] = rook
                 rook.has_moved = True
+                rook_move = ((from_row, 7), (from_row, 5))
             else:  # Queenside castling
                 rook = self.board[from_row][0]
                 self.board[from_row][0] = None
                 self.board[from_row][3] = rook
                 rook.has_moved = True
+                rook_move = ((from_row, 0), (from_row, 3))
         
         # Special handling for pawn promotion
+        promotion = None
         if piece.type == 'pawn' and (to_row == 0 or to_row == 7):
             # Promote pawn to queen by default (could be expanded to allow choice)
-            self.board[to_row][to_col] = Piece(piece.color, 'queen')
+            promotion = 'queen'
+            self.board[to_row][to_col] = Piece(piece.color, promotion)
         
         # Set en_passant_target if double pawn move
         self.en_passant_target = None
@@ -203,40 +342,14 @@ class ChessGame:
             'piece': piece.type,
             'color': piece.color,
             'captured': captured_piece.type if captured_piece else None,
-            'en_passant': en_passant
+            'captured_square': captured_square,
+            'en_passant': en_passant,
+            'rook_move': rook_move,
+            'promotion': promotion
         })
         
         # Change turn
         self.current_turn = 'black' if self.current_turn == 'white' else 'white'
-        
-        # Check for check or checkmate
-        self._update_check_status()
-        if self._is_checkmate():
-            self.game_over = True
-            self.result = 'checkmate'
-            self.winner = 'white' if self.current_turn == 'black' else 'black'
-        elif self._is_stalemate():
-            self.game_over = True
-            self.result = 'stalemate'
-            self.winner = None
-        elif self._is_draw_by_insufficient_material():
-            self.game_over = True
-            self.result = 'insufficient_material'
-            self.winner = None
-        elif self._is_draw_by_fifty_move_rule():
-            self.game_over = True
-            self.result = 'fifty_move_rule'
-            self.winner = None
-        elif self._is_draw_by_threefold_repetition():
-            self.game_over = True
-            self.result = 'threefold_repetition'
-            self.winner = None
-        
-        # If game is over, record end time
-        if self.game_over:
-            self.end_time = time.time()
-        
-        return {'valid': True}
     
     def _is_valid_position(self, row, col):
         return 0 <= row < 8 and 0 <= col < 8
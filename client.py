@@ -4,13 +4,19 @@ import threading
 import json
 import sys
 import time
-import traceback
 import math
 import argparse
+import logging
 from gui.board import ChessBoard
 from gui.menu import Menu
 from gui.chat import ChatPanel
 from gui.utils import Button, TextBox, draw_text
+from chess_logic import compute_position_hash
+from protocol import encode_message, MessageReader, FORMAT_JSON, WIRE_FORMATS, COMPRESSION_ZLIB
+from chess_logging import setup_logging, LOG_LEVELS
+from session_capture import SessionCapture, TO_SERVER, TO_CLIENT, CLOSED
+
+log = logging.getLogger('client')
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Chess game client')
@@ -18,10 +24,18 @@ def parse_arguments():
                         help='Server hostname or IP address (default: localhost)')
     parser.add_argument('--port', type=int, default=5555, 
                         help='Server port (default: 5555)')
+    parser.add_argument('--protocol', choices=WIRE_FORMATS, default=FORMAT_JSON,
+                        help='Wire format to request from the server (default: json)')
+    parser.add_argument('--spectate', metavar='USERNAME',
+                        help="Watch this player's current game instead of playing")
+    parser.add_argument('--capture', metavar='PATH',
+                        help='Record all traffic with the server to this file for replaying later')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO',
+                        help='Least severe log messages to show, DEBUG dumps every message (default: INFO)')
     return parser.parse_args()
 
 class ChessClient:
-    def __init__(self, host='localhost', port=5555):
+    def __init__(self, host='localhost', port=5555, wire_format=FORMAT_JSON, spectate=None, capture_path=None):
         # Initialize pygame
         pygame.init()
         
@@ -62,8 +76,14 @@ class ChessClient:
         self.receive_thread = None
         self.connection_error = None
         
+        # Format we ask for in the handshake, and the one the server confirmed
+        self.requested_format = wire_format
+        self.wire_format = FORMAT_JSON
+        
         # Game state
         self.in_game = False
+        self.spectating = False
+        self.spectate_target = spectate  # Player whose game to watch once connected
         self.player_color = None
         self.opponent_name = None
         self.is_my_turn = False
@@ -81,6 +101,33 @@ class ChessClient:
         self.player_times = {"white": 0, "black": 0}  # Time in seconds for each player
         self.last_move_time = None  # Timestamp of the last move
         self.current_turn_color = "white"  # White starts first
+        # Untimed games count time used up, timed games count the server's
+        # remaining time down
+        self.clock_direction = 1
+        
+        # Move sequence of the board we hold, used to validate move deltas
+        self.move_seq = 0
+        self.resync_pending = False
+        
+        # Session token from the server, lets us take our game back after a
+        # dropped connection
+        self.session = None
+        self.resuming = False
+        self.server_restarting = False  # Told the connection is about to move to a new server process
+        self.busy_retry = None  # Seconds the server asked us to wait before connecting again
+        self.busy_attempts = 0
+        
+        # Optional record of all traffic, every connection under its own id
+        self.capture = None
+        self.capture_id = None
+        if capture_path:
+            self.capture = SessionCapture(capture_path)
+            self.capture.open()
+        
+        # Everyone online as last published by the server, kept up to date by
+        # versioned deltas
+        self.lobby_players = {}  # {name: {'status': status, 'rating': rating}}
+        self.lobby_version = None
         
         # UI components
         self.board = ChessBoard(self.screen, self.colors)
@@ -94,7 +141,7 @@ class ChessClient:
         self.message_queue = []
         self.queue_lock = threading.Lock()
     
-    def connect_to_server(self, username):
+    def connect_to_server(self, username, handoff=None, resume=None):
         # First, clear any previous connection error
         self.connection_error = None
         
@@ -113,14 +160,25 @@ class ChessClient:
             self.socket.connect((self.host, self.port))
             self.socket.settimeout(None)  # Remove timeout for normal operation
             self.username = username
+            if self.capture is not None:
+                self.capture_id = self.capture.connection()
         
             
             # Send username to server
-            print(f"Sending username: {username}")
-            message = {'username': username}
-            data = json.dumps(message).encode('utf-8')
-            self.socket.send(data)
-            print(f"Username sent to server: {message}")
+            log.debug("Sending username: %s", username)
+            self.wire_format = FORMAT_JSON
+            message = {'username': username, 'format': self.requested_format, 'compression': COMPRESSION_ZLIB}
+            if handoff:
+                # Joining a game hosted by another server process
+                message['handoff'] = handoff
+            if resume:
+                # Taking our game back, the server sends the moves we missed
+                message.update({'type': 'resume', 'session': resume, 'last_seq': self.move_seq})
+            data = encode_message(message)
+            self.socket.sendall(data)
+            if self.capture is not None:
+                self.capture.record(self.capture_id, TO_SERVER, data)
+            log.debug("Username sent to server: %s", message)
             
             # Stop any existing receive thread
             if self.receive_thread and self.receive_thread.is_alive():
@@ -129,77 +187,154 @@ class ChessClient:
             
             # Start a thread to receive messages
             self.connected = True
-            self.receive_thread = threading.Thread(target=self.receive_messages)
+            self.receive_thread = threading.Thread(target=self.receive_messages, args=(self.socket,))
             self.receive_thread.daemon = True
             self.receive_thread.start()
             
-            print(f"Connected to server as {username}")
+            log.info("Connected to server as %s", username)
             self.menu.set_status("Connected to server!")
             return True
         except socket.timeout:
             self.connection_error = "Connection timeout - server not responding"
-            print(self.connection_error)
+            log.error(self.connection_error)
             self.menu.set_status("Connection timeout")
             return False
         except ConnectionRefusedError:
             self.connection_error = "Connection refused - server may not be running"
-            print(self.connection_error)
+            log.error(self.connection_error)
             self.menu.set_status("Connection refused")
             return False
         except Exception as e:
             self.connection_error = f"Connection error: {str(e)}"
-            print(self.connection_error)
-            traceback.print_exc()
+            log.exception(self.connection_error)
             self.menu.set_status("Connection failed")
             return False
     
     def send_message(self, message):
         try:
             if self.socket and self.connected:
-                data = json.dumps(message).encode('utf-8')
-                self.socket.send(data)
+                data = encode_message(message, self.wire_format)
+                self.socket.sendall(data)
+                if self.capture is not None:
+                    self.capture.record(self.capture_id, TO_SERVER, data)
                 return True
             return False
         except Exception as e:
-            print(f"Send error: {e}")
-            self.disconnect()
+            log.warning("Send error: %s", e)
+            if not self.resuming:
+                self.disconnect()
             return False
     
-    def receive_messages(self):
+    def receive_messages(self, sock):
+        capture_id = self.capture_id
         try:
-            print("Message receiver thread started")
-            while self.connected:
+            log.debug("Message receiver thread started")
+            reader = MessageReader(negotiate=True, inflate=True)
+            while self.connected and self.socket is sock:
                 try:
-                    data = self.socket.recv(4096).decode('utf-8')
+                    data = sock.recv(4096)
                     if not data:
-                        print("Server closed connection (no data)")
+                        log.info("Server closed connection (no data)")
                         break
+                    if self.capture is not None:
+                        self.capture.record(capture_id, TO_CLIENT, data)
                     
-                    # Parse message
-                    message = json.loads(data)
-                    print(f"Received message from server: {message}")
-                    
-                    # Special handling for connection_success
-                    if message.get('type') == 'connection_success':
-                        print("FORCIBLY setting current_screen to menu due to connection_success")
-                        self.current_screen = 'menu'
-                    
-                    # Add to message queue for processing in main thread
-                    with self.queue_lock:
-                        self.message_queue.append(message)
+                    # Parse every complete message in this chunk
+                    for message in reader.feed(data):
+                        log.debug("Received message from server: %s", message)
+                        
+                        # Special handling for connection_success
+                        if message.get('type') == 'connection_success':
+                            if not self.resuming:
+                                log.debug("FORCIBLY setting current_screen to menu due to connection_success")
+                                self.current_screen = 'menu'
+                            # Our reader already switched, switch what we send as well
+                            self.wire_format = message.get('format', FORMAT_JSON)
+                            # The server pings us when things are quiet, so a
+                            # long silence means the connection is gone
+                            heartbeat_interval = message.get('heartbeat_interval')
+                            if heartbeat_interval:
+                                sock.settimeout(heartbeat_interval * 3)
+                            self.busy_attempts = 0
+                        
+                        elif message.get('type') == 'server_busy':
+                            # Turned away, the server closes the connection next
+                            self.busy_retry = message.get('retry_after', 1)
+                        
+                        elif message.get('type') == 'server_restarting':
+                            # Noted here, the connection may well close before
+                            # the main thread gets to the message
+                            self.server_restarting = True
+                        
+                        # Add to message queue for processing in main thread
+                        with self.queue_lock:
+                            self.message_queue.append(message)
                 except json.JSONDecodeError as e:
-                    print(f"Invalid JSON received: {e}")
+                    log.debug("Invalid JSON received: %s", e)
                     continue
                 except Exception as e:
-                    print(f"Receive error: {e}")
+                    log.warning("Receive error: %s", e)
                     break
         except Exception as e:
             if self.connected:  # Only show error if we were supposed to be connected
-                print(f"Receiver thread error: {e}")
-                traceback.print_exc()
+                log.exception("Receiver thread error: %s", e)
         finally:
-            print("Message receiver thread stopped")
-            self.disconnect()
+            log.debug("Message receiver thread stopped")
+            if self.capture is not None:
+                self.capture.record(capture_id, CLOSED)
+            # After a reconnect the new socket belongs to another thread
+            if self.socket is sock:
+                # Losing the connection mid-game (rather than quitting) is
+                # worth a few attempts to get the game back
+                if self.connected and self.busy_retry is not None:
+                    self.retry_when_not_busy()
+                elif self.connected and self.in_game and not self.game_over and not self.spectating and self.session:
+                    self.resume_session()
+                elif self.connected and self.server_restarting:
+                    self.reconnect()
+                else:
+                    self.disconnect()
+    
+    def resume_session(self, attempts=5, delay=1.0):
+        self.resuming = True
+        self.menu.set_status("Connection lost, reconnecting...")
+        for attempt in range(attempts):
+            time.sleep(delay)
+            log.info("Resuming session, attempt %s", attempt + 1)
+            if self.connect_to_server(self.username, resume=self.session):
+                return
+        
+        self.resuming = False
+        self.disconnect()
+    
+    def retry_when_not_busy(self, attempts=3):
+        # Come back when the server said to, resuming if that's what we were doing
+        delay = self.busy_retry
+        self.busy_retry = None
+        self.busy_attempts += 1
+        if self.busy_attempts <= attempts:
+            self.menu.set_status(f"Server busy, retrying in {delay}s...")
+            time.sleep(delay)
+            log.info("Retrying busy server, attempt %s", self.busy_attempts)
+            if self.connect_to_server(self.username, resume=self.session if self.resuming else None):
+                return
+        
+        self.busy_attempts = 0
+        self.resuming = False
+        self.disconnect()
+        self.menu.set_status("Server busy, try again later")
+    
+    def reconnect(self, attempts=5, delay=0.5):
+        # The server is being replaced, log in again with the new process
+        self.server_restarting = False
+        self.menu.set_status("Server restarting, reconnecting...")
+        for attempt in range(attempts):
+            time.sleep(delay)
+            log.info("Reconnecting, attempt %s", attempt + 1)
+            if self.connect_to_server(self.username):
+                return
+        
+        self.disconnect()
     
     def process_messages(self):
         with self.queue_lock:
@@ -209,7 +344,7 @@ class ChessClient:
         if not messages:
             return
             
-        print(f"Processing {len(messages)} messages")
+        log.debug("Processing %s messages", len(messages))
         
         # Group messages by type for priority processing
         game_start_messages = []
@@ -227,12 +362,12 @@ class ChessClient:
         
         # Process game_start messages first (highest priority)
         for message in game_start_messages:
-            print("Processing high-priority game_start message")
+            log.debug("Processing high-priority game_start message")
             self.handle_message(message)
         
         # Process board_state messages next
         for message in board_state_messages:
-            print("Processing board_state message")
+            log.debug("Processing board_state message")
             self.handle_message(message)
         
         # Process all other messages
@@ -245,21 +380,36 @@ class ChessClient:
     
     def handle_message(self, message):
         message_type = message.get('type')
-        print(f"Handling message of type: {message_type}")
+        log.debug("Handling message of type: %s", message_type)
         
         if message_type == 'connection_success':
-            print(f"Connection successful: {message.get('message')}")
+            log.debug("Connection successful: %s", message.get('message'))
+            self.session = message.get('session')
+            # Follow who is online. After a reconnect the server only sends
+            # what changed since the version we have.
+            self.send_message({'type': 'lobby_subscribe', 'since': self.lobby_version})
+            if self.resuming:
+                # Stay on the board, session_resumed or resume_failed follows
+                return
             self.menu.set_status(message.get('message'))
-            print(f"Setting current_screen from '{self.current_screen}' to 'menu'")
+            log.debug("Setting current_screen from '%s' to 'menu'", self.current_screen)
             self.current_screen = 'menu'
-            print(f"Current screen is now: {self.current_screen}")
+            log.debug("Current screen is now: %s", self.current_screen)
+            
+            if self.spectate_target and not self.in_game:
+                self.spectate(self.spectate_target)
+        
+        elif message_type == 'handoff':
+            # Our game is hosted by another server process, reconnect there
+            log.info("Moving to the server process hosting our game")
+            self.connect_to_server(self.username, handoff=message.get('token'))
         
         elif message_type == 'queue':
             self.menu.set_status(message.get('message'))
-            print(f"Queue status: {message.get('message')}")
+            log.debug("Queue status: %s", message.get('message'))
         
         elif message_type == 'game_start':
-            print(f"GAME START RECEIVED: {message}")
+            log.debug("GAME START RECEIVED: %s", message)
             self.player_color = message.get('color')
             self.opponent_name = message.get('opponent')
             self.in_game = True
@@ -268,62 +418,67 @@ class ChessClient:
             self.player_times = {"white": 0, "black": 0}
             self.last_move_time = time.time()
             self.current_turn_color = "white"  # Chess always starts with white
+            self.clock_direction = 1
+            self.sync_clock(message)
             
             # Update menu status first for visual feedback
             self.menu.set_status(f"Game found! Playing as {self.player_color} vs {self.opponent_name}")
             
             # Force transition to game screen
-            print(f"Changing screen from '{self.current_screen}' to 'game'")
+            log.debug("Changing screen from '%s' to 'game'", self.current_screen)
             self.current_screen = 'game'
             
             # Post an event to ensure UI updates immediately
             pygame.event.post(pygame.event.Event(pygame.USEREVENT, {'subtype': 'screen_change'}))
             
             self.is_my_turn = self.player_color == 'white'  # White goes first
-            print(f"Game started: playing as {self.player_color} against {self.opponent_name}")
-            print(f"Current screen is now: {self.current_screen}")
+            log.info("Game started: playing as %s against %s", self.player_color, self.opponent_name)
+            log.debug("Current screen is now: %s", self.current_screen)
             
             # Force redraw to update the screen immediately
             self.draw()
             pygame.display.flip()
         
         elif message_type == 'board_state':
-            print(f"BOARD STATE RECEIVED: {message}")
+            log.debug("BOARD STATE RECEIVED: %s", message)
             board_data = message.get('board')
             if board_data:
-                self.board.update_board(board_data)
+                self.board.update_board(board_data, message.get('en_passant'))
+                self.move_seq = message.get('seq', 0)
+                self.resync_pending = False
                 new_turn = message.get('turn')
                 
                 # Update chess clock if turn changed
                 if self.current_turn_color != new_turn and self.last_move_time is not None:
                     elapsed = time.time() - self.last_move_time
-                    self.player_times[self.current_turn_color] += elapsed
+                    self.player_times[self.current_turn_color] += self.clock_direction * elapsed
                     self.last_move_time = time.time()
                     self.current_turn_color = new_turn
                 
-                self.is_my_turn = new_turn == self.player_color
+                self.is_my_turn = not self.spectating and new_turn == self.player_color
                 turn = "your" if self.is_my_turn else "opponent's"
-                print(f"Received board state. It's {turn} turn.")
+                log.debug("Received board state. It's %s turn.", turn)
             else:
-                print("Warning: Received empty board state")
+                log.warning("Received empty board state")
             
             # Ensure we're in game screen when receiving board state
             if self.current_screen != 'game' and self.in_game:
-                print("Forcing transition to game screen after receiving board state")
+                log.debug("Forcing transition to game screen after receiving board state")
                 self.current_screen = 'game'
                 pygame.event.post(pygame.event.Event(pygame.USEREVENT, {'subtype': 'screen_change'}))
         
         elif message_type == 'move_result':
             if message.get('valid'):
-                self.board.update_board(message.get('board'))
+                self.apply_move_update(message)
                 new_turn = message.get('turn')
                 
                 # Update chess clock if turn changed
                 if self.current_turn_color != new_turn and self.last_move_time is not None:
                     elapsed = time.time() - self.last_move_time
-                    self.player_times[self.current_turn_color] += elapsed
+                    self.player_times[self.current_turn_color] += self.clock_direction * elapsed
                     self.last_move_time = time.time()
                     self.current_turn_color = new_turn
+                self.sync_clock(message)
                 
                 self.is_my_turn = new_turn == self.player_color
                 self.selected_piece = None
@@ -340,25 +495,48 @@ class ChessClient:
                 if status.get('game_over'):
                     self.game_over = True
                     self.game_result = status
-                    print(f"Game over: {status}")
+                    log.info("Game over: %s", status)
             else:
-                print(f"Invalid move: {message.get('message')}")
+                log.info("Invalid move: %s", message.get('message'))
         
-        elif message_type == 'opponent_move':
-            from_pos = message.get('from')
-            to_pos = message.get('to')
-            self.board.update_board(message.get('board'))
+        elif message_type == 'spectate_start':
+            # Watching someone else's game, shown from white's side
+            self.reset_game()
+            self.in_game = True
+            self.spectating = True
+            self.player_color = 'white'
+            self.opponent_name = f"{message.get('white')} vs {message.get('black')}"
+            self.player_times = {"white": 0, "black": 0}
+            self.last_move_time = time.time()
+            self.current_turn_color = "white"
+            self.menu.set_status(f"Watching {self.opponent_name}")
+            self.current_screen = 'game'
+            pygame.event.post(pygame.event.Event(pygame.USEREVENT, {'subtype': 'screen_change'}))
+            log.info("Spectating game %s: %s", message.get('game_id'), self.opponent_name)
+        
+        elif message_type == 'spectate_end':
+            log.info("Stopped spectating: %s", message.get('reason'))
+            self.reset_game()
+            self.current_screen = 'menu'
+            self.menu.set_status("No longer spectating")
+        
+        elif message_type in ('opponent_move', 'spectate_move'):
+            move = message.get('move', message)
+            from_pos = move.get('from')
+            to_pos = move.get('to')
+            self.apply_move_update(message)
             new_turn = message.get('turn')
             
             # Update chess clock if turn changed
             if self.current_turn_color != new_turn and self.last_move_time is not None:
                 elapsed = time.time() - self.last_move_time
-                self.player_times[self.current_turn_color] += elapsed
+                self.player_times[self.current_turn_color] += self.clock_direction * elapsed
                 self.last_move_time = time.time()
                 self.current_turn_color = new_turn
+            self.sync_clock(message)
             
-            self.is_my_turn = new_turn == self.player_color
-            print(f"Opponent moved from {from_pos} to {to_pos}")
+            self.is_my_turn = not self.spectating and new_turn == self.player_color
+            log.debug("Opponent moved from %s to %s", from_pos, to_pos)
             
             # Update game information if available
             game_info = message.get('game_info', {})
@@ -371,7 +549,7 @@ class ChessClient:
             if status.get('game_over'):
                 self.game_over = True
                 self.game_result = status
-                print(f"Game over: {status}")
+                log.info("Game over: %s", status)
         
         elif message_type == 'game_over':
             self.game_over = True
@@ -383,8 +561,10 @@ class ChessClient:
             # Update final time for the current player
             if self.last_move_time is not None:
                 elapsed = time.time() - self.last_move_time
-                self.player_times[self.current_turn_color] += elapsed
+                self.player_times[self.current_turn_color] += self.clock_direction * elapsed
                 self.last_move_time = None
+            if message.get('clock'):
+                self.player_times = {'white': message['clock']['white'], 'black': message['clock']['black']}
             
             # Update game information if available
             game_info = message.get('game_info', {})
@@ -393,47 +573,162 @@ class ChessClient:
                 self.game_duration = game_info.get('duration', self.game_duration)
                 self.points = game_info.get('points', self.points)
             
-            print(f"Game over: {self.game_result}, info: {game_info}")
+            log.info("Game over: %s, info: %s", self.game_result, game_info)
         
+        elif message_type == 'session_resumed':
+            self.resuming = False
+            self.session = message.get('session')
+            self.player_color = message.get('color')
+            self.opponent_name = message.get('opponent')
+            
+            # Replay the moves we missed; a mismatch or a missing move list
+            # falls back to the snapshot the server sends in that case
+            moves = message.get('moves')
+            if moves is not None:
+                for move in moves:
+                    if not self.board.apply_move(move):
+                        self.request_resync()
+                        break
+                    self.move_seq += 1
+                else:
+                    if compute_position_hash(self.board.board, message.get('turn'), self.board.en_passant_target) != message.get('hash'):
+                        log.warning("Board hash mismatch after resuming, requesting resync")
+                        self.request_resync()
+            
+            new_turn = message.get('turn')
+            self.current_turn_color = new_turn
+            self.last_move_time = time.time()
+            self.sync_clock(message)
+            self.is_my_turn = new_turn == self.player_color
+            
+            game_info = message.get('game_info', {})
+            if game_info:
+                self.move_count = game_info.get('move_count', self.move_count)
+                self.game_duration = game_info.get('duration', self.game_duration)
+                self.points = game_info.get('points', self.points)
+            
+            self.chat_panel.add_message("Server: Reconnected to the game")
+            log.info("Resumed game %s, missed %s moves", message.get('game_id'), len(moves or []))
+        
+        elif message_type == 'resume_failed':
+            self.resuming = False
+            log.warning("Could not resume: %s", message.get('message'))
+            self.reset_game()
+            self.current_screen = 'menu'
+            self.menu.set_status(message.get('message'))
+        
+        elif message_type == 'opponent_away':
+            self.chat_panel.add_message(f"Server: Opponent disconnected, waiting {int(message.get('grace', 0))}s for them")
+        
+        elif message_type == 'opponent_back':
+            self.chat_panel.add_message("Server: Opponent reconnected")
+        
+        elif message_type == 'server_restarting':
+            log.info("Server is restarting, reconnecting to its replacement")
+        
+        elif message_type == 'server_busy':
+            log.info("Server busy, retrying in %ss", message.get('retry_after'))
+        
+        elif message_type == 'ping':
+            self.send_message({'type': 'pong'})
+        
+        elif message_type == 'lobby_snapshot':
+            self.lobby_players = {player.pop('name'): player for player in message.get('players', [])}
+            self.lobby_version = message.get('version')
+        
+        elif message_type == 'lobby_delta':
+            self.apply_lobby_delta(message)
+
         elif message_type == 'chat':
-            sender = message.get('sender')
-            content = message.get('content')
-            print(f"Chat from {sender}: {content}")
-            self.chat_panel.add_message(f"{sender}: {content}")
+            # Bursts arrive batched in a single frame
+            for chat in message.get('messages') or [message]:
+                sender = chat.get('sender')
+                content = chat.get('content')
+                log.debug("Chat from %s: %s", sender, content)
+                self.chat_panel.add_message(f"{sender}: {content}")
         
         elif message_type == 'error':
             error_msg = message.get('message')
-            print(f"Error from server: {error_msg}")
+            log.warning("Error from server: %s", error_msg)
             # Could display this in the UI
     
+    def apply_move_update(self, message):
+        # Older servers still send the whole board with every move
+        if message.get('board'):
+            self.board.update_board(message.get('board'))
+            return
+        
+        # A snapshot is already on its way, deltas until then are stale
+        if self.resync_pending:
+            return
+        
+        seq = message.get('seq')
+        move = message.get('move')
+        
+        # Already covered by a snapshot that was processed ahead of it
+        if seq is not None and seq <= self.move_seq:
+            return
+        
+        # Deltas only make sense applied in order to the exact position they
+        # were made from, anything else means our board has drifted
+        if not move or seq != self.move_seq + 1 or not self.board.apply_move(move):
+            log.warning("Move %s can't be applied on top of move %s, requesting resync", seq, self.move_seq)
+            self.request_resync()
+            return
+        
+        self.move_seq = seq
+        if compute_position_hash(self.board.board, message.get('turn'), self.board.en_passant_target) != message.get('hash'):
+            log.warning("Board hash mismatch after move %s, requesting resync", seq)
+            self.request_resync()
+    
+    def apply_lobby_delta(self, message):
+        version = message.get('version')
+        if self.lobby_version is None or version <= self.lobby_version:
+            # Before the snapshot, or already seen after catching up
+            return
+        if version != self.lobby_version + 1:
+            # Missed one, ask for everything after the version we have
+            self.send_message({'type': 'lobby_subscribe', 'since': self.lobby_version})
+            return
+        
+        for change in message.get('changes', []):
+            name = change.get('name')
+            if change.get('op') == 'leave':
+                self.lobby_players.pop(name, None)
+            else:
+                self.lobby_players[name] = {'status': change.get('status'), 'rating': change.get('rating')}
+        self.lobby_version = version
+    
+    def request_resync(self):
+        self.resync_pending = True
+        if not self.send_message({'type': 'resync'}):
+            log.warning("Failed to request resync")
+    
+    def spectate(self, username):
+        if self.send_message({'type': 'spectate', 'player': username}):
+            log.debug("Asked to spectate %s", username)
+            self.menu.set_status(f"Looking for {username}'s game...")
+        else:
+            log.warning("Failed to ask to spectate %s", username)
+    
     def find_game(self):
         if not self.connected:
-            print("Cannot find game: not connected to server")
+            log.warning("Cannot find game: not connected to server")
             self.menu.set_status("Cannot find game: not connected")
             return False
         
-        print("Sending find game request to server...")
+        log.debug("Sending find game request to server...")
         # Format the message exactly as the server expects it
         message = {'type': 'find_game'}
         
-        try:
-            if self.socket:
-                # Convert to JSON and send
-                data = json.dumps(message).encode('utf-8')
-                self.socket.send(data)
-                print(f"Successfully sent: {message}")
-                self.menu.set_status("Finding a game...")
-                return True
-            else:
-                print("Cannot send - socket is None")
-                self.menu.set_status("Error: No connection")
-                return False
-        except Exception as e:
-            print(f"Error sending find game request: {e}")
-            traceback.print_exc()
-            self.menu.set_status("Error sending request")
-            self.disconnect()
-            return False
+        # Sent like every other request so a capture records it too
+        if self.send_message(message):
+            log.debug("Successfully sent: %s", message)
+            self.menu.set_status("Finding a game...")
+            return True
+        
+        self.menu.set_status("Error sending request")
+        return False
     
     def make_move(self, from_pos, to_pos):
         if self.send_message({
@@ -441,15 +736,15 @@ class ChessClient:
             'from': from_pos,
             'to': to_pos
         }):
-            print(f"Sent move from {from_pos} to {to_pos}")
+            log.debug("Sent move from %s to %s", from_pos, to_pos)
         else:
-            print(f"Failed to send move from {from_pos} to {to_pos}")
+            log.warning("Failed to send move from %s to %s", from_pos, to_pos)
     
     def resign_game(self):
         if self.send_message({'type': 'resign'}):
-            print("Sent resignation")
+            log.debug("Sent resignation")
         else:
-            print("Failed to send resignation")
+            log.warning("Failed to send resignation")
     
     def send_chat(self, message):
         if self.send_message({
@@ -457,9 +752,9 @@ class ChessClient:
             'content': message
         }):
             self.chat_panel.add_message(f"You: {message}")
-            print(f"Sent chat: {message}")
+            log.debug("Sent chat: %s", message)
         else:
-            print(f"Failed to send chat: {message}")
+            log.warning("Failed to send chat: %s", message)
     
     def disconnect(self):
         self.connected = False
@@ -484,7 +779,7 @@ class ChessClient:
             # Handle custom events
             elif event.type == pygame.USEREVENT:
                 if hasattr(event, 'dict') and event.dict.get('subtype') == 'screen_change':
-                    print("Detected screen change event")
+                    log.debug("Detected screen change event")
                     # Force an immediate redraw
                     self.draw()
                     pygame.display.flip()
@@ -583,6 +878,7 @@ class ChessClient:
     
     def reset_game(self):
         self.in_game = False
+        self.spectating = False
         self.player_color = None
         self.opponent_name = None
         self.is_my_turn = False
@@ -590,13 +886,15 @@ class ChessClient:
         self.valid_moves = []
         self.game_over = False
         self.game_result = None
+        self.move_seq = 0
+        self.resync_pending = False
         self.board.reset_board()
         self.chat_panel.clear_messages()
     
     def draw(self):
         self.screen.fill(self.colors['background'])
         
-        print(f"Drawing screen: {self.current_screen}, Connected: {self.connected}")
+        log.debug("Drawing screen: %s, Connected: %s", self.current_screen, self.connected)
         
         if self.current_screen == 'login':
             self.menu.draw_login_screen()
@@ -608,8 +906,8 @@ class ChessClient:
                 self.screen.blit(error_surface, error_rect)
         
         elif self.current_screen == 'menu':
-            print("Drawing menu screen with FIND GAME button")
-            self.menu.draw_menu_screen(self.username)
+            log.debug("Drawing menu screen with FIND GAME button")
+            self.menu.draw_menu_screen(self.username, self.lobby_players)
             
             # Draw connection status
             status_text = "Connected" if self.connected else "Disconnected"
@@ -618,7 +916,7 @@ class ChessClient:
             self.screen.blit(status_surface, (10, 10))
         
         elif self.current_screen == 'game':
-            print("Drawing game screen")
+            log.debug("Drawing game screen")
             
             # Draw header bar
             pygame.draw.rect(self.screen, self.colors['header'], (0, 0, self.width, 60))
@@ -897,7 +1195,7 @@ class ChessClient:
         result = self.game_result.get('result')
         winner = self.game_result.get('winner')
         
-        if result == 'checkmate' or result == 'resignation' or result == 'opponent_resigned' or result == 'opponent_disconnected':
+        if result == 'checkmate' or result == 'resignation' or result == 'opponent_resigned' or result == 'opponent_disconnected' or result == 'timeout':
             if winner == self.player_color or result == 'opponent_resigned' or result == 'opponent_disconnected':
                 header_color = self.colors['success']  # Win
                 header_text = "VICTORY!"
@@ -939,6 +1237,11 @@ class ChessClient:
             message = "Opponent resigned! You win!"
         elif result == 'opponent_disconnected':
             message = "Opponent disconnected! You win!"
+        elif result == 'timeout':
+            if winner == self.player_color:
+                message = "Opponent ran out of time! You win!"
+            else:
+                message = "You ran out of time!"
         elif result == 'insufficient_material':
             message = "Game drawn by insufficient material!"
         elif result == 'fifty_move_rule':
@@ -1010,13 +1313,23 @@ class ChessClient:
             elapsed = current_time - self.last_move_time
             # Only update the displayed time, don't add to the accumulated time yet
             # (that happens when the turn changes)
-            current_time_secs = self.player_times[self.current_turn_color] + elapsed
+            current_time_secs = max(0, self.player_times[self.current_turn_color] + self.clock_direction * elapsed)
             
             minutes = int(current_time_secs // 60)
             seconds = int(current_time_secs % 60)
             return f"{minutes:02d}:{seconds:02d}"
         return "00:00"
 
+    def sync_clock(self, message):
+        # In timed games the server's clock is authoritative, ours only fills
+        # in between its updates
+        clock = message.get('clock')
+        if clock:
+            self.clock_direction = -1
+            self.player_times = {'white': clock['white'], 'black': clock['black']}
+            self.current_turn_color = clock['turn']
+            self.last_move_time = time.time()
+    
     def format_time(self, seconds):
         """Format seconds into minutes:seconds display"""
         minutes = int(seconds // 60)
@@ -1032,9 +1345,9 @@ class ChessClient:
         if self.last_move_time is not None:
             elapsed = time.time() - self.last_move_time
             if self.current_turn_color == "white":
-                white_time += elapsed
+                white_time = max(0, white_time + self.clock_direction * elapsed)
             else:
-                black_time += elapsed
+                black_time = max(0, black_time + self.clock_direction * elapsed)
         
         # Format both times
         white_minutes = int(white_time // 60)
@@ -1069,11 +1382,17 @@ class ChessClient:
         
         # Clean up
         self.disconnect()
+        if self.capture is not None:
+            self.capture.close()
         pygame.quit()
         return 0
 
 
 if __name__ == "__main__":
     args = parse_arguments()
-    client = ChessClient(args.host, args.port)
-    client.run() 
\ No newline at end of file
+    log_listener = setup_logging(args.log_level)
+    client = ChessClient(args.host, args.port, args.protocol, args.spectate, args.capture)
+    try:
+        client.run()
+    finally:
+        log_listener.stop() 
\ No newline at end of file
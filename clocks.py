@@ -0,0 +1,145 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def parse_time_control(text):
+    """Parse 'minutes+increment', e.g. '5+3', into (initial_seconds, increment_seconds)."""
+    minutes, _, increment = text.partition('+')
+    initial = float(minutes) * 60
+    increment = float(increment) if increment else 0.0
+    if initial <= 0 or increment < 0:
+        raise ValueError(f"Invalid time control: {text}")
+    return initial, increment
+
+
+class TimerHandle:
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerService:
+    def __init__(self):
+        # A single thread sleeps until the earliest deadline in the heap, so
+        # idle timers cost nothing however many there are. Cancelled timers
+        # stay in the heap and are skipped when they come up.
+        self.heap = []  # [(deadline, sequence, TimerHandle)]
+        self.sequence = itertools.count()  # Keeps equal deadlines in order
+        self.condition = threading.Condition()
+        self.cancelled = 0
+        self.stopping = False
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+    
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) on the timer thread after delay seconds."""
+        handle = TimerHandle(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (handle.deadline, next(self.sequence), handle))
+            # Only a new earliest deadline needs the thread to wake up early
+            if self.heap[0][2] is handle:
+                self.condition.notify()
+        return handle
+    
+    def cancel(self, handle):
+        with self.condition:
+            if handle.cancelled:
+                return
+            handle.cancelled = True
+            self.cancelled += 1
+            
+            # Mostly dead heaps are rebuilt so long timers don't pile up
+            if self.cancelled > 64 and self.cancelled > len(self.heap) // 2:
+                self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if self.stopping:
+                        return
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    
+                    deadline, sequence, handle = self.heap[0]
+                    if handle.cancelled:
+                        heapq.heappop(self.heap)
+                        self.cancelled -= 1
+                        continue
+                    
+                    delay = deadline - time.monotonic()
+                    if delay > 0:
+                        self.condition.wait(delay)
+                        continue
+                    
+                    heapq.heappop(self.heap)
+                    # Firing counts as cancelling, later cancel() calls are no-ops
+                    handle.cancelled = True
+                    break
+            
+            # Callbacks run without the heap lock so they can schedule more timers
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                log.error("Error in timer callback: %s", e)
+
+
+class GameClock:
+    def __init__(self, initial, increment):
+        self.initial = initial
+        self.increment = increment
+        self.remaining = {'white': initial, 'black': initial}
+        self.turn = 'white'
+        self.turn_started = time.monotonic()
+        self.running = True
+    
+    def time_left(self, color, now=None):
+        now = time.monotonic() if now is None else now
+        if color != self.turn or not self.running:
+            return self.remaining[color]
+        return self.remaining[color] - (now - self.turn_started)
+    
+    def flag_delay(self):
+        """Seconds until the player to move runs out of time."""
+        return max(0.0, self.time_left(self.turn))
+    
+    def press(self):
+        # Charge the mover for the time used, add the increment, start the
+        # opponent's clock
+        now = time.monotonic()
+        self.remaining[self.turn] = self.time_left(self.turn, now) + self.increment
+        self.turn = 'black' if self.turn == 'white' else 'white'
+        self.turn_started = now
+    
+    def stop(self):
+        now = time.monotonic()
+        self.remaining[self.turn] = max(0.0, self.time_left(self.turn, now))
+        self.running = False
+    
+    def to_dict(self):
+        now = time.monotonic()
+        return {
+            'white': round(max(0.0, self.time_left('white', now)), 3),
+            'black': round(max(0.0, self.time_left('black', now)), 3),
+            'turn': self.turn,
+            'increment': self.increment
+        }
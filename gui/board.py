@@ -1,5 +1,9 @@
 import pygame
 import os
+import logging
+from chess_logic import PIECE_POINT_VALUES
+
+log = logging.getLogger(__name__)
 
 class ChessBoard:
     def __init__(self, screen, colors, board_size=600):
@@ -9,6 +13,7 @@ class ChessBoard:
         self.square_size = board_size // 8
         self.board_position = (50, 50)  # Position on screen
         self.board = [[None for _ in range(8)] for _ in range(8)]
+        self.en_passant_target = None  # Square of a pawn that just moved two squares
         
         # Create the pieces directory and generate placeholder images
         self.setup_assets()
@@ -66,7 +71,7 @@ class ChessBoard:
         return pieces
     
     def generate_placeholder_images(self):
-        print("Generating placeholder chess piece images...")
+        log.debug("Generating placeholder chess piece images...")
         # Generate placeholder images for pieces
         piece_types = ['pawn', 'rook', 'knight', 'bishop', 'queen', 'king']
         colors = ['white', 'black']
@@ -76,9 +81,9 @@ class ChessBoard:
                 surface = self.create_placeholder_piece(color, piece_type)
                 try:
                     pygame.image.save(surface, f'assets/pieces/{color}_{piece_type}.png')
-                    print(f"Created placeholder for {color} {piece_type}")
+                    log.debug("Created placeholder for %s %s", color, piece_type)
                 except Exception as e:
-                    print(f"Error creating placeholder for {color} {piece_type}: {e}")
+                    log.error("Error creating placeholder for %s %s: %s", color, piece_type, e)
     
     def create_placeholder_piece(self, color, piece_type):
         # Create a simple representation of a piece using shapes and text
@@ -147,28 +152,75 @@ class ChessBoard:
         
         return surface
     
-    def update_board(self, board_state):
+    def update_board(self, board_state, en_passant_target=None):
         if not board_state:
-            print("Warning: Received empty board state in update_board")
+            log.warning("Received empty board state in update_board")
             return
         
-        print(f"Updating board with state, dimensions: {len(board_state)}x{len(board_state[0]) if board_state else 0}")
+        log.debug("Updating board with state, dimensions: %sx%s", len(board_state), len(board_state[0]) if board_state else 0)
         
         try:
             # Verify the board state format
             if len(board_state) != 8 or any(len(row) != 8 for row in board_state):
-                print(f"Warning: Invalid board dimensions - expected 8x8, got {len(board_state)}x{len(board_state[0]) if board_state else 0}")
+                log.warning("Invalid board dimensions - expected 8x8, got %sx%s", len(board_state), len(board_state[0]) if board_state else 0)
             
             # Copy the board state
             self.board = board_state
-            print("Board updated successfully")
+            self.en_passant_target = tuple(en_passant_target) if en_passant_target else None
+            log.debug("Board updated successfully")
         except Exception as e:
-            print(f"Error updating board: {e}")
+            log.error("Error updating board: %s", e)
             import traceback
             traceback.print_exc()
     
+    def apply_move(self, move):
+        # Replay a move delta from the server on our copy of the board
+        from_row, from_col = move['from']
+        to_row, to_col = move['to']
+        
+        piece = self.board[from_row][from_col]
+        if not piece:
+            log.warning("No piece at %s,%s to move", from_row, from_col)
+            return False
+        
+        # Captured square differs from the destination for en passant
+        captured = move.get('captured')
+        if captured:
+            self.board[captured[0]][captured[1]] = None
+        
+        promotion = move.get('promotion')
+        if promotion:
+            piece = {
+                'color': piece['color'],
+                'type': promotion,
+                'has_moved': False,
+                'points': PIECE_POINT_VALUES.get(promotion, 0)
+            }
+        else:
+            piece = dict(piece, has_moved=True)
+        
+        self.board[to_row][to_col] = piece
+        self.board[from_row][from_col] = None
+        
+        # Remembered for the position hash, like ChessGame does
+        self.en_passant_target = None
+        if piece['type'] == 'pawn' and abs(from_row - to_row) == 2:
+            self.en_passant_target = (to_row, to_col)
+        
+        # Castling moves the rook as well
+        rook_move = move.get('rook')
+        if rook_move:
+            (rook_from_row, rook_from_col), (rook_to_row, rook_to_col) = rook_move
+            rook = self.board[rook_from_row][rook_from_col]
+            if rook:
+                self.board[rook_to_row][rook_to_col] = dict(rook, has_moved=True)
+                self.board[rook_from_row][rook_from_col] = None
+        
+        return True
+    
     def reset_board(self):
         self.board = [[None for _ in range(8)] for _ in range(8)]
+        self.en_passant_target = None
     
     def draw_board(self):
         # Draw a nice wooden border around the board
@@ -212,7 +264,7 @@ class ChessBoard:
                         piece_type = piece.get('type')
                         
                         if not piece_color or not piece_type:
-                            print(f"Invalid piece at {row},{col}: {piece}")
+                            log.warning("Invalid piece at %s,%s: %s", row, col, piece)
                             continue
                         
                         # Draw the piece image
@@ -228,10 +280,10 @@ class ChessBoard:
                             # Draw actual piece
                             self.screen.blit(self.pieces_images[piece_color][piece_type], (x, y))
                         else:
-                            print(f"Missing image for {piece_color} {piece_type}")
+                            log.warning("Missing image for %s %s", piece_color, piece_type)
                     except Exception as e:
-                        print(f"Error drawing piece at {row},{col}: {e}")
-                        print(f"Piece data: {piece}")
+                        log.error("Error drawing piece at %s,%s: %s", row, col, e)
+                        log.error("Piece data: %s", piece)
         
         # Draw coordinate labels with better styling
         font = pygame.font.SysFont('Arial', 16)
@@ -24,6 +24,10 @@ class ChatPanel:
         )
         
         self.message_height = font.get_height() + 5
+        self.small_font = pygame.font.SysFont('Arial', 14)
+        
+        # Text is rendered once per message rather than every frame
+        self.rendered = {}  # {message: (sender surface or None, text surface, content width)}
     
     def draw(self, x, y):
         if not self.panel_rect:
@@ -46,56 +50,42 @@ class ChatPanel:
         
         for i, message in enumerate(self.messages[start_idx:]):
             message_y = y + 10 + i * self.message_height
+            rendered = self.render_message(message)
+            if rendered is None:
+                continue
+            sender_surface, text_surface, content_width = rendered
             
             # Determine if this is a player or opponent message
-            if message.startswith("You:"):
+            if sender_surface is None:
                 # Player message - right aligned with different color
-                msg_parts = message.split(":", 1)
-                if len(msg_parts) > 1:
-                    sender, content = msg_parts
-                    
-                    # Draw player message with bubble
-                    bubble_width = min(self.font.size(content)[0] + 20, message_area.width - 50)
-                    bubble_rect = pygame.Rect(
-                        message_area.right - bubble_width - 5,
-                        message_y,
-                        bubble_width,
-                        self.message_height + 5
-                    )
-                    
-                    # Bubble background
-                    pygame.draw.rect(self.screen, self.colors['button'], bubble_rect, border_radius=8)
-                    
-                    # Message text
-                    text_surface = self.font.render(content.strip(), True, self.colors['white'])
-                    text_rect = text_surface.get_rect(midleft=(bubble_rect.left + 10, bubble_rect.centery))
-                    self.screen.blit(text_surface, text_rect)
+                bubble_width = min(content_width + 20, message_area.width - 50)
+                bubble_rect = pygame.Rect(
+                    message_area.right - bubble_width - 5,
+                    message_y,
+                    bubble_width,
+                    self.message_height + 5
+                )
+                
+                # Bubble background
+                pygame.draw.rect(self.screen, self.colors['button'], bubble_rect, border_radius=8)
             else:
-                # Opponent message - left aligned
-                msg_parts = message.split(":", 1)
-                if len(msg_parts) > 1:
-                    sender, content = msg_parts
-                    
-                    # Draw sender name
-                    sender_surface = pygame.font.SysFont('Arial', 14).render(sender, True, self.colors['header'])
-                    self.screen.blit(sender_surface, (x + 10, message_y))
-                    
-                    # Draw opponent message with bubble
-                    bubble_width = min(self.font.size(content)[0] + 20, message_area.width - 50)
-                    bubble_rect = pygame.Rect(
-                        x + 10,
-                        message_y + sender_surface.get_height() + 2,
-                        bubble_width,
-                        self.message_height
-                    )
-                    
-                    # Bubble background
-                    pygame.draw.rect(self.screen, (220, 220, 225), bubble_rect, border_radius=8)
-                    
-                    # Message text
-                    text_surface = self.font.render(content.strip(), True, self.colors['text'])
-                    text_rect = text_surface.get_rect(midleft=(bubble_rect.left + 10, bubble_rect.centery))
-                    self.screen.blit(text_surface, text_rect)
+                # Opponent message - left aligned, under the sender's name
+                self.screen.blit(sender_surface, (x + 10, message_y))
+                
+                bubble_width = min(content_width + 20, message_area.width - 50)
+                bubble_rect = pygame.Rect(
+                    x + 10,
+                    message_y + sender_surface.get_height() + 2,
+                    bubble_width,
+                    self.message_height
+                )
+                
+                # Bubble background
+                pygame.draw.rect(self.screen, (220, 220, 225), bubble_rect, border_radius=8)
+            
+            # Message text
+            text_rect = text_surface.get_rect(midleft=(bubble_rect.left + 10, bubble_rect.centery))
+            self.screen.blit(text_surface, text_rect)
         
         # Draw bottom message divider - MOVED UP by 20 pixels
         pygame.draw.line(
@@ -139,7 +129,7 @@ class ChatPanel:
         
         # Button text
         send_text = "Send"
-        send_text_surface = pygame.font.SysFont('Arial', 14).render(send_text, True, self.colors['white'])
+        send_text_surface = self.small_font.render(send_text, True, self.colors['white'])
         send_text_rect = send_text_surface.get_rect(center=send_button_rect.center)
         self.screen.blit(send_text_surface, send_text_rect)
     
@@ -182,10 +172,29 @@ class ChatPanel:
             return message
         return None
     
+    def render_message(self, message):
+        rendered = self.rendered.get(message)
+        if rendered is None:
+            msg_parts = message.split(":", 1)
+            if len(msg_parts) < 2:
+                return None
+            sender, content = msg_parts
+            if message.startswith("You:"):
+                sender_surface = None
+                text_surface = self.font.render(content.strip(), True, self.colors['white'])
+            else:
+                sender_surface = self.small_font.render(sender, True, self.colors['header'])
+                text_surface = self.font.render(content.strip(), True, self.colors['text'])
+            rendered = self.rendered[message] = (sender_surface, text_surface, self.font.size(content)[0])
+        return rendered
+    
     def add_message(self, message):
         self.messages.append(message)
         if len(self.messages) > self.max_messages:
-            self.messages.pop(0)
+            dropped = self.messages.pop(0)
+            if dropped not in self.messages:
+                self.rendered.pop(dropped, None)
     
     def clear_messages(self):
-        self.messages.clear() 
\ No newline at end of file
+        self.messages.clear()
+        self.rendered.clear() 
\ No newline at end of file
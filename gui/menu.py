@@ -1,8 +1,11 @@
 import pygame
 import time
 import math
+import logging
 from gui.utils import Button, TextBox, draw_text
 
+log = logging.getLogger(__name__)
+
 class Menu:
     def __init__(self, screen, colors, font, title_font):
         self.screen = screen
@@ -143,7 +146,7 @@ class Menu:
         footer_surface = pygame.font.SysFont('Arial', 14).render(footer_text, True, self.colors['text'])
         self.screen.blit(footer_surface, (self.width - footer_surface.get_width() - 10, self.height - 30))
     
-    def draw_menu_screen(self, username=None):
+    def draw_menu_screen(self, username=None, online=None):
         # Draw header bar with gradient effect
         header_rect = pygame.Rect(0, 0, self.width, 80)
         pygame.draw.rect(self.screen, self.colors['header'], header_rect)
@@ -278,6 +281,9 @@ class Menu:
             status_rect = status_surface.get_rect(center=status_bg.center)
             self.screen.blit(status_surface, status_rect)
         
+        if online is not None:
+            self.draw_online_panel(online, username)
+        
         # Footer
         footer_rect = pygame.Rect(0, self.height - 40, self.width, 40)
         pygame.draw.rect(self.screen, self.colors['panel'], footer_rect)
@@ -292,6 +298,43 @@ class Menu:
         footer_surface = pygame.font.SysFont('Arial', 14).render(footer_text, True, self.colors['text'])
         self.screen.blit(footer_surface, (self.width - footer_surface.get_width() - 10, self.height - 30))
     
+    def draw_online_panel(self, online, username=None):
+        # Players online to the right of the lobby card, as many as fit
+        panel_rect = pygame.Rect(self.width - 230, 100, 215, self.height - 160)
+        pygame.draw.rect(self.screen, (250, 250, 255), panel_rect, border_radius=10)
+        pygame.draw.rect(self.screen, self.colors['panel'], panel_rect, 2, border_radius=10)
+        
+        title_surface = self.font.render(f"Online ({len(online)})", True, self.colors['header'])
+        self.screen.blit(title_surface, (panel_rect.x + 12, panel_rect.y + 10))
+        
+        status_colors = {
+            'idle': self.colors['success'],
+            'queued': self.colors['warning'],
+            'playing': self.colors['header'],
+            'spectating': self.colors['text'],
+            'away': (160, 160, 160)
+        }
+        row_font = pygame.font.SysFont('Arial', 15)
+        rows = (panel_rect.height - 50) // 22
+        if len(online) > rows:
+            rows -= 1  # Room for the count of the rest
+        y = panel_rect.y + 42
+        for name in sorted(online)[:rows]:
+            status = online[name].get('status', 'idle')
+            color = status_colors.get(status, self.colors['text'])
+            pygame.draw.circle(self.screen, color, (panel_rect.x + 18, y + 9), 5)
+            
+            label = f"{name} (you)" if name == username else name
+            name_surface = row_font.render(label, True, self.colors['text'])
+            self.screen.blit(name_surface, (panel_rect.x + 30, y))
+            status_surface = row_font.render(status, True, color)
+            self.screen.blit(status_surface, (panel_rect.right - status_surface.get_width() - 12, y))
+            y += 22
+        
+        if len(online) > rows:
+            more_surface = row_font.render(f"and {len(online) - rows} more", True, self.colors['text'])
+            self.screen.blit(more_surface, (panel_rect.x + 30, y))
+    
     def set_status(self, message):
         self.status_message = message
     
@@ -314,7 +357,7 @@ class Menu:
                 self.status_message = "Connected to server!"
                 # Force client screen to menu after successful login
                 client.current_screen = 'menu'
-                print(f"Login successful, forced current_screen to: {client.current_screen}")
+                log.debug("Login successful, forced current_screen to: %s", client.current_screen)
                 return True
             else:
                 self.status_message = "Failed to connect to server"
@@ -325,13 +368,13 @@ class Menu:
     
     def handle_menu_click(self, mouse_pos, client):
         # Print debug info about the find game button
-        print(f"Mouse position: {mouse_pos}")
-        print(f"Find game button rect: {self.find_game_button.rect}")
-        print(f"Button collision check: {self.find_game_button.rect.collidepoint(mouse_pos)}")
+        log.debug("Mouse position: %s", mouse_pos)
+        log.debug("Find game button rect: %s", self.find_game_button.rect)
+        log.debug("Button collision check: %s", self.find_game_button.rect.collidepoint(mouse_pos))
         
         # Update button hover state
         hover_changed = self.find_game_button.update(mouse_pos)
-        print(f"Button hover state: {self.find_game_button.hover}")
+        log.debug("Button hover state: %s", self.find_game_button.hover)
         
         # Get card dimensions for hit testing
         card_width, card_height = 500, 300
@@ -340,17 +383,17 @@ class Menu:
         
         # Check if find game button was clicked - use the Button's is_clicked method
         if self.find_game_button.is_clicked(mouse_pos):
-            print("Find Game button clicked!")
+            log.debug("Find Game button clicked!")
             self.status_message = "Finding a game..."
             result = client.find_game()
             if result:
                 self.find_game_clicked = True
-                print("Find game request sent successfully")
+                log.debug("Find game request sent successfully")
             else:
-                print("Failed to send find game request")
+                log.warning("Failed to send find game request")
             return True
         else:
-            print("Click was not on the Find Game button")
+            log.debug("Click was not on the Find Game button")
             
         return False
     
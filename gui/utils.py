@@ -1,4 +1,7 @@
 import pygame
+import logging
+
+log = logging.getLogger(__name__)
 
 def draw_text(surface, text, font, color, x, y):
     text_surface = font.render(text, True, color)
@@ -38,7 +41,7 @@ class Button:
     def is_clicked(self, mouse_pos):
         # Simple method to check if the button was clicked
         clicked = self.rect.collidepoint(mouse_pos)
-        print(f"Button clicked check: pos={mouse_pos}, rect={self.rect}, result={clicked}")
+        log.debug("Button clicked check: pos=%s, rect=%s, result=%s", mouse_pos, self.rect, clicked)
         return clicked
     
     def handle_event(self, event):
@@ -106,7 +109,7 @@ class TextBox:
             return prev_active != self.active
         
         if event.type == pygame.KEYDOWN and self.active:
-            print(f"TextBox handling keydown: {event.key}")
+            log.debug("TextBox handling keydown: %s", event.key)
             current_time = pygame.time.get_ticks()
             
             if event.key == pygame.K_BACKSPACE:
@@ -122,7 +125,7 @@ class TextBox:
                 # Only add printable characters
                 if event.unicode.isprintable():
                     self.text += event.unicode
-                    print(f"Added character: '{event.unicode}' - Text is now: '{self.text}'")
+                    log.debug("Added character: '%s' - Text is now: '%s'", event.unicode, self.text)
                     self.last_key_time = current_time
                     return True
         
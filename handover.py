@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import socket
+import struct
+from chess_logic import ChessGame
+from clocks import GameClock
+from protocol import pack_move, unpack_move
+
+log = logging.getLogger(__name__)
+
+# A replacement server connects to the running one's control socket and sends
+# this, it gets back the listening socket as SCM_RIGHTS ancillary data and
+# everything the old server knew about its live games as length-prefixed JSON
+HANDOVER_REQUEST = b'chess-handover/1\n'
+HANDOVER_HEADER = struct.Struct('>I')
+
+
+def listen_for_handover(path):
+    """Unix socket a replacement server connects to when it takes over."""
+    if os.path.exists(path):
+        os.unlink(path)
+    control_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    control_socket.bind(path)
+    control_socket.listen(1)
+    return control_socket
+
+
+def send_handover(connection, server_socket, state):
+    data = json.dumps(state).encode('utf-8')
+    socket.send_fds(connection, [HANDOVER_HEADER.pack(len(data))], [server_socket.fileno()])
+    connection.sendall(data)
+
+
+def request_handover(path, timeout=10.0):
+    """Take over from the server offering its games at path.
+    
+    Returns (listening socket, state). The old server stops accepting before
+    it answers, connections arriving meanwhile wait in the listen backlog.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(timeout)
+    try:
+        connection.connect(path)
+        connection.sendall(HANDOVER_REQUEST)
+        
+        header, fds, flags, address = socket.recv_fds(connection, HANDOVER_HEADER.size, 1)
+        if len(header) < HANDOVER_HEADER.size or not fds:
+            raise ConnectionError(f"Server at {path} did not hand over")
+        server_socket = socket.socket(fileno=fds[0])
+        
+        length, = HANDOVER_HEADER.unpack(header)
+        data = bytearray()
+        while len(data) < length:
+            chunk = connection.recv(min(65536, length - len(data)))
+            if not chunk:
+                raise ConnectionError("Handover state cut short")
+            data += chunk
+        return server_socket, json.loads(data.decode('utf-8'))
+    finally:
+        connection.close()
+
+
+def pack_game(game):
+    return {
+        'moves': [pack_move(move['from'], move['to']) for move in game.move_history],
+        'start_time': game.start_time
+    }
+
+
+def unpack_game(state):
+    # Same replay as journal recovery, the moves were checked when played
+    game = ChessGame()
+    game.start_time = state['start_time']
+    for packed_move in state['moves']:
+        from_pos, to_pos, promotion = unpack_move(packed_move)
+        game.apply_recorded_move(from_pos, to_pos)
+    game.refresh_status()
+    return game
+
+
+def pack_clock(clock):
+    return {
+        'initial': clock.initial,
+        'increment': clock.increment,
+        'remaining': {color: clock.time_left(color) for color in ('white', 'black')},
+        'turn': clock.turn
+    }
+
+
+def unpack_clock(state):
+    # Runs again from now, the moment spent handing over isn't charged
+    clock = GameClock(state['initial'], state['increment'])
+    clock.remaining = dict(state['remaining'])
+    clock.turn = state['turn']
+    return clock
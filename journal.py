@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import queue
+import threading
+from chess_logic import ChessGame
+from protocol import encode_message, pack_move, unpack_move
+
+log = logging.getLogger(__name__)
+
+
+class GameJournal:
+    def __init__(self, path):
+        # One JSON record per line, appended in the order events happened:
+        #   {'e': 'start', 'g': game_id, 'w': white, 'b': black, 't': start_time}
+        #   {'e': 'move', 'g': game_id, 'm': packed_move}
+        #   {'e': 'chat', 'g': game_id, 's': sender, 'c': content}
+        #   {'e': 'end', 'g': game_id, 'r': result, 'x': winner}
+        self.path = path
+        self.records = queue.SimpleQueue()
+        self.file = None
+        self.thread = None
+        
+        # Statistics
+        self.commits = 0
+        self.records_written = 0
+    
+    def open(self):
+        self.file = open(self.path, 'ab')
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def close(self):
+        if self.thread is not None:
+            self.records.put(None)
+            self.thread.join()
+            self.thread = None
+    
+    def record_start(self, game_id, white, black, start_time):
+        self.append({'e': 'start', 'g': game_id, 'w': white, 'b': black, 't': start_time})
+    
+    def record_move(self, game_id, from_pos, to_pos):
+        self.append({'e': 'move', 'g': game_id, 'm': pack_move(from_pos, to_pos)})
+    
+    def record_chat(self, game_id, sender, content):
+        self.append({'e': 'chat', 'g': game_id, 's': sender, 'c': content})
+    
+    def record_end(self, game_id, result, winner):
+        self.append({'e': 'end', 'g': game_id, 'r': result, 'x': winner})
+    
+    def append(self, record):
+        # Never touches the disk, callers may hold the server lock
+        self.records.put(encode_message(record))
+    
+    def run(self):
+        stopping = False
+        while not stopping:
+            # Group commit: wait for one record, then take everything queued
+            # up behind it (typically whatever arrived during the previous
+            # fsync) and make the whole batch durable with a single fsync
+            batch = [self.records.get()]
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+            
+            try:
+                if batch:
+                    self.file.write(b''.join(batch))
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    self.commits += 1
+                    self.records_written += len(batch)
+            except OSError as e:
+                log.error("Error writing game journal: %s", e)
+        
+        self.file.close()
+
+
+def recover_games(path):
+    """Rebuild every game the journal shows as still in progress.
+    
+    Returns {game_id: {'white': name, 'black': name, 'game': ChessGame, 'chat': [(sender, content)]}}.
+    """
+    started = {}
+    moves = {}
+    chats = {}
+    
+    if not os.path.exists(path):
+        return {}
+    
+    with open(path, 'rb') as journal_file:
+        for line in journal_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn write from a crash, only ever the very last line
+                continue
+            
+            game_id = record['g']
+            event = record['e']
+            if event == 'start':
+                started[game_id] = record
+                moves[game_id] = []
+                chats[game_id] = []
+            elif event == 'move' and game_id in moves:
+                moves[game_id].append(record['m'])
+            elif event == 'chat' and game_id in chats:
+                chats[game_id].append((record['s'], record['c']))
+            elif event == 'end':
+                # Finished games are never replayed
+                started.pop(game_id, None)
+                moves.pop(game_id, None)
+                chats.pop(game_id, None)
+    
+    games = {}
+    for game_id, record in started.items():
+        # Every move was validated when it was played, so replay skips all
+        # rule checks and works out check status once at the end
+        game = ChessGame()
+        game.start_time = record['t']
+        for packed_move in moves[game_id]:
+            from_pos, to_pos, promotion = unpack_move(packed_move)
+            game.apply_recorded_move(from_pos, to_pos)
+        game.refresh_status()
+        
+        games[game_id] = {
+            'white': record['w'],
+            'black': record['b'],
+            'game': game,
+            'chat': chats[game_id]
+        }
+    
+    return games
+
+
+def compact_journal(path, games):
+    """Rewrite the journal with only the given in-progress games."""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as journal_file:
+        for game_id, entry in games.items():
+            game = entry['game']
+            journal_file.write(encode_message({
+                'e': 'start', 'g': game_id, 'w': entry['white'], 'b': entry['black'], 't': game.start_time
+            }))
+            for move in game.move_history:
+                journal_file.write(encode_message({'e': 'move', 'g': game_id, 'm': pack_move(move['from'], move['to'])}))
+            for sender, content in entry['chat']:
+                journal_file.write(encode_message({'e': 'chat', 'g': game_id, 's': sender, 'c': content}))
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    
+    # Atomic swap, a crash leaves either the old or the new journal
+    os.replace(temp_path, path)
+
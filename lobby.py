@@ -0,0 +1,113 @@
+import collections
+import threading
+from protocol import SharedMessage
+
+# Changes are collected for this long and then published together
+LOBBY_BATCH_WINDOW = 0.25
+
+# Deltas kept so subscribers that fell behind can catch up without a snapshot
+LOBBY_HISTORY = 256
+
+
+class Lobby:
+    """Who is online and what they are doing, for the clients that subscribe.
+    
+    Subscribers get a snapshot once, then versioned deltas. Changes within a
+    batch window go out as a single delta with one entry per player changed,
+    so traffic follows the rate of change rather than the number of players.
+    """
+    
+    def __init__(self, timers, send, batch_window=LOBBY_BATCH_WINDOW, history=LOBBY_HISTORY):
+        self.timers = timers
+        self.send = send  # send(client_socket, SharedMessage), must not block
+        self.batch_window = batch_window
+        self.lock = threading.Lock()
+        
+        # Status is one of 'idle', 'queued', 'playing', 'spectating' or 'away'
+        self.players = {}  # {name: {'status': status, 'rating': rating}} as it is now
+        self.published = {}  # The same, as of the last delta sent
+        self.owners = {}  # {name: client_socket or None while away}
+        self.changed = set()  # Names whose entry may differ from the published one
+        self.flush_timer = None
+        
+        self.version = 0
+        self.history = collections.deque(maxlen=history)  # [(version, SharedMessage)]
+        self.subscribers = set()
+    
+    def update(self, name, status, rating, owner):
+        """Add or update a player, owner is the connection the entry belongs to."""
+        with self.lock:
+            self.owners[name] = owner
+            entry = {'status': status, 'rating': rating}
+            if self.players.get(name) != entry:
+                self.players[name] = entry
+                self.mark_changed(name)
+    
+    def remove(self, name, owner):
+        # A newer connection under the same name keeps its entry
+        with self.lock:
+            if name not in self.players or self.owners.get(name) is not owner:
+                return
+            del self.players[name]
+            del self.owners[name]
+            self.mark_changed(name)
+    
+    def mark_changed(self, name):
+        self.changed.add(name)
+        if self.flush_timer is None:
+            self.flush_timer = self.timers.schedule(self.batch_window, self.flush)
+    
+    def flush(self):
+        # Runs on the timer thread once the batch window is over
+        with self.lock:
+            self.flush_timer = None
+            changes = []
+            for name in sorted(self.changed):
+                current = self.players.get(name)
+                previous = self.published.get(name)
+                if current == previous:
+                    # Changed and changed back, or joined and left again
+                    continue
+                if current is None:
+                    changes.append({'op': 'leave', 'name': name})
+                    del self.published[name]
+                else:
+                    changes.append({'op': 'join' if previous is None else 'status', 'name': name, **current})
+                    self.published[name] = current
+            self.changed.clear()
+            
+            if not changes:
+                return
+            
+            self.version += 1
+            delta = SharedMessage({'type': 'lobby_delta', 'version': self.version, 'changes': changes})
+            self.history.append((self.version, delta))
+            for client_socket in self.subscribers:
+                self.send(client_socket, delta)
+    
+    def subscribe(self, client_socket, since=None):
+        """Start sending updates, beginning with whatever the client is missing.
+        
+        A client that still has the lobby as of version since only gets the
+        deltas after it, if they are all still in the history.
+        """
+        with self.lock:
+            self.subscribers.add(client_socket)
+            
+            oldest = self.history[0][0] if self.history else self.version + 1
+            if isinstance(since, int) and oldest - 1 <= since <= self.version:
+                for version, delta in self.history:
+                    if version > since:
+                        self.send(client_socket, delta)
+                return
+            
+            # Sent under the lock, so it is queued ahead of any later delta
+            self.send(client_socket, SharedMessage({
+                'type': 'lobby_snapshot',
+                'version': self.version,
+                'players': [{'name': name, **entry} for name, entry in sorted(self.published.items())]
+            }))
+    
+    def unsubscribe(self, client_socket):
+        with self.lock:
+            self.subscribers.discard(client_socket)
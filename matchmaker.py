@@ -0,0 +1,202 @@
+import collections
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RATING = 1200
+
+
+def elo_update(rating, opponent_rating, score, k_factor=32):
+    """New rating after a game, score is 1 for a win, 0.5 for a draw, 0 for a loss."""
+    expected = 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+    return round(rating + k_factor * (score - expected))
+
+
+class Matchmaker:
+    def __init__(self, on_match, batch_size=256, bucket_width=50, base_window=100,
+                 window_growth=25, max_window=800, tick_interval=0.5):
+        # on_match(client1, client2, game_id) is called from the pairing thread
+        self.on_match = on_match
+        self.batch_size = batch_size  # Most seekers examined per tick
+        
+        # Acceptable rating difference starts at base_window and widens by
+        # window_growth for every second spent waiting, up to max_window
+        self.bucket_width = bucket_width
+        self.base_window = base_window
+        self.window_growth = window_growth
+        self.max_window = max_window
+        self.tick_interval = tick_interval
+        
+        # Rotation of (client, ticket), oldest first, plus the authoritative
+        # membership map. Leaving the queue only touches the map and the bucket;
+        # stale deque entries are skipped when they reach the front, so both
+        # enqueue and remove are O(1).
+        self.queue = collections.deque()
+        self.waiting = {}  # {client: (ticket, enqueue_time, rating)}
+        self.buckets = {}  # {rating // bucket_width: {client: ticket}} in arrival order
+        self.tickets = itertools.count()
+        self.condition = threading.Condition()
+        
+        # Game IDs are never reused while the server runs
+        self.game_ids = itertools.count(1)
+        
+        # Statistics
+        self.started_at = time.monotonic()
+        self.matches = 0
+        self.wait_times = collections.deque(maxlen=10000)  # Recent queue waits in seconds
+        self.tick_times = collections.deque(maxlen=1000)  # Recent pairing tick durations
+        
+        self.running = False
+        self.thread = None
+    
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+    
+    def enqueue(self, client, rating=DEFAULT_RATING):
+        """Add a client to the queue, returns False if it is already waiting."""
+        with self.condition:
+            if client in self.waiting:
+                return False
+            
+            ticket = next(self.tickets)
+            self.waiting[client] = (ticket, time.monotonic(), rating)
+            self.queue.append((client, ticket))
+            self.buckets.setdefault(rating // self.bucket_width, {})[client] = ticket
+            
+            if len(self.waiting) >= 2:
+                self.condition.notify()
+            return True
+    
+    def remove(self, client):
+        with self.condition:
+            if self.waiting.get(client) is None:
+                return
+            self.discard(client)
+            
+            # Don't let entries of departed clients pile up in the deque
+            if len(self.queue) > 2 * len(self.waiting) + self.batch_size:
+                self.queue = collections.deque(
+                    entry for entry in self.queue
+                    if self.waiting.get(entry[0], (None,))[0] == entry[1]
+                )
+    
+    def discard(self, client):
+        # Drop a client from the membership map and its bucket, the deque entry
+        # goes stale. Caller holds the condition.
+        ticket, enqueue_time, rating = self.waiting.pop(client)
+        bucket_key = rating // self.bucket_width
+        bucket = self.buckets[bucket_key]
+        del bucket[client]
+        if not bucket:
+            del self.buckets[bucket_key]
+        return enqueue_time
+    
+    def is_waiting(self, client):
+        return client in self.waiting
+    
+    def next_game_id(self):
+        return str(next(self.game_ids))
+    
+    def skip_game_ids(self, last_game_id):
+        # Keep clear of IDs that are still in use, e.g. by recovered games
+        self.game_ids = itertools.count(last_game_id + 1)
+    
+    def run(self):
+        # Single long-lived pairing loop, drains the queue in batches
+        while True:
+            with self.condition:
+                while self.running and len(self.waiting) < 2:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                pairs = self.take_pairs()
+                
+                if not pairs:
+                    # Nobody is close enough yet. Windows widen with time, so
+                    # look again after a tick or as soon as someone new arrives.
+                    self.condition.wait(self.tick_interval)
+            
+            # Games are set up outside the queue lock so enqueues never wait on it
+            for client1, client2 in pairs:
+                try:
+                    self.on_match(client1, client2, self.next_game_id())
+                except Exception as e:
+                    log.error("Error during matchmaking: %s", e)
+    
+    def take_pairs(self):
+        started = time.perf_counter()
+        pairs = []
+        now = time.monotonic()
+        
+        # Look for opponents for a bounded number of seekers, oldest first.
+        # Each search only touches the buckets inside the seeker's window, so a
+        # tick costs O(batch_size * window / bucket_width) however long the queue.
+        for _ in range(min(self.batch_size, len(self.queue))):
+            client, ticket = self.queue.popleft()
+            entry = self.waiting.get(client)
+            if entry is None or entry[0] != ticket:
+                # Client left the queue (or re-joined with a newer ticket)
+                continue
+            
+            opponent = self.find_opponent(client, entry, now)
+            if opponent is None:
+                # Try again on a later tick with a wider window
+                self.queue.append((client, ticket))
+                continue
+            
+            for matched in (client, opponent):
+                self.wait_times.append(now - self.discard(matched))
+            pairs.append((client, opponent))
+        
+        self.matches += len(pairs)
+        self.tick_times.append(time.perf_counter() - started)
+        return pairs
+    
+    def find_opponent(self, client, entry, now):
+        ticket, enqueue_time, rating = entry
+        window = min(self.base_window + self.window_growth * (now - enqueue_time), self.max_window)
+        home_bucket = rating // self.bucket_width
+        reach = int(window // self.bucket_width)
+        
+        # Nearest buckets first: home, +1, -1, +2, -2, ... Only buckets lying
+        # entirely inside the window are used, so the first entry of any of them
+        # is an acceptable opponent and no bucket is ever scanned.
+        for distance in range(reach + 1):
+            for bucket_key in ((home_bucket,) if distance == 0 else (home_bucket + distance, home_bucket - distance)):
+                lowest = bucket_key * self.bucket_width
+                highest = lowest + self.bucket_width - 1
+                if rating - lowest > window or highest - rating > window:
+                    continue
+                
+                for candidate in self.buckets.get(bucket_key, ()):
+                    if candidate is not client:
+                        return candidate
+                    # Only ourselves in front, the next entry will do
+        return None
+    
+    def stats(self):
+        with self.condition:
+            waits = sorted(self.wait_times)
+            queued = len(self.waiting)
+            matches = self.matches
+        
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'queued': queued,
+            'matches': matches,
+            'matches_per_second': matches / elapsed if elapsed > 0 else 0.0,
+            'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+            'wait_p99': waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0,
+            'tick_max': max(self.tick_times) if self.tick_times else 0.0
+        }
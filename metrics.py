@@ -0,0 +1,199 @@
+import bisect
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, from 50µs up to 2.5s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class _Shard:
+    # One per thread. Only its own thread ever writes to it, so recording
+    # needs no lock; the scraper sums all shards and may be a moment behind.
+    def __init__(self):
+        self.counters = {}  # {(name, label): count}
+        self.histograms = {}  # {(name, label): [bucket counts..., +Inf count, sum]}
+
+
+class Metrics:
+    def __init__(self):
+        self.descriptions = {}  # {name: (kind, help, label_name)}
+        self.gauges = {}  # {name: callback returning a number or {label: number}}
+        self.local = threading.local()
+        self.lock = threading.RLock()  # Guards the shard registry, never taken to record
+        self.shards = {}  # {shard id: _Shard contents} of live threads
+        self.retired = _Shard()  # Totals of threads that have exited
+        self.shard_ids = 0
+    
+    def counter(self, name, help_text, label=None):
+        self.descriptions[name] = ('counter', help_text, label)
+    
+    def histogram(self, name, help_text, label=None):
+        self.descriptions[name] = ('histogram', help_text, label)
+    
+    def gauge(self, name, help_text, callback, label=None):
+        """callback() is run at scrape time, so the hot path pays nothing."""
+        self.descriptions[name] = ('gauge', help_text, label)
+        self.gauges[name] = callback
+    
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = _Shard()
+            with self.lock:
+                self.shard_ids += 1
+                shard_id = self.shard_ids
+                self.shards[shard_id] = (shard.counters, shard.histograms)
+            # Thread-per-client means threads come and go, fold the counts of
+            # a finished thread into the totals instead of keeping its shard
+            weakref.finalize(shard, self.retire, shard_id)
+        return shard
+    
+    def retire(self, shard_id):
+        with self.lock:
+            counters, histograms = self.shards.pop(shard_id)
+            merge(self.retired, counters, histograms)
+    
+    def inc(self, name, label=None, amount=1):
+        counters = self.shard().counters
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + amount
+    
+    def observe(self, name, value, label=None):
+        histograms = self.shard().histograms
+        key = (name, label)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        # Buckets are stored non-cumulative, rendering adds them up
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[-1] += value
+    
+    def collect(self):
+        totals = _Shard()
+        with self.lock:
+            merge(totals, self.retired.counters, self.retired.histograms)
+            for counters, histograms in list(self.shards.values()):
+                # Copies, the owning threads keep writing meanwhile
+                merge(totals, dict(counters), dict((key, list(value)) for key, value in list(histograms.items())))
+        return totals
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        totals = self.collect()
+        lines = []
+        
+        for name, (kind, help_text, label) in self.descriptions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            
+            if kind == 'counter':
+                for (metric, label_value), count in sorted(totals.counters.items(), key=sort_key):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(label, label_value)} {count}")
+            
+            elif kind == 'histogram':
+                for (metric, label_value), histogram in sorted(totals.histograms.items(), key=sort_key):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(label, label_value, le=bound)} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(label, label_value)} {histogram[-1]:.6f}")
+                    lines.append(f"{name}_count{format_labels(label, label_value)} {cumulative}")
+            
+            else:
+                try:
+                    value = self.gauges[name]()
+                except Exception as e:
+                    lines.append(f"# {name} unavailable: {e}")
+                    continue
+                if isinstance(value, dict):
+                    for label_value, number in sorted(value.items()):
+                        lines.append(f"{name}{format_labels(label, label_value)} {number}")
+                else:
+                    lines.append(f"{name} {value}")
+        
+        return '\n'.join(lines) + '\n'
+
+
+class TimedLock:
+    """Drop-in for threading.Lock that records how long acquiring it took."""
+    
+    def __init__(self, metrics, name='chess_lock_wait_seconds'):
+        self.lock = threading.Lock()
+        self.metrics = metrics
+        self.name = name
+    
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        self.metrics.observe(self.name, time.perf_counter() - started)
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.lock.release()
+    
+    def acquire(self, blocking=True, timeout=-1):
+        return self.lock.acquire(blocking, timeout)
+    
+    def release(self):
+        self.lock.release()
+    
+    def locked(self):
+        return self.lock.locked()
+
+
+def merge(totals, counters, histograms):
+    for key, count in counters.items():
+        totals.counters[key] = totals.counters.get(key, 0) + count
+    for key, histogram in histograms.items():
+        total = totals.histograms.get(key)
+        if total is None:
+            totals.histograms[key] = list(histogram)
+        else:
+            for index, value in enumerate(histogram):
+                total[index] += value
+
+
+def sort_key(item):
+    return str(item[0][1])
+
+
+def format_labels(label, label_value, le=None):
+    labels = []
+    if label is not None and label_value is not None:
+        labels.append(f'{label}="{label_value}"')
+    if le is not None:
+        labels.append(f'le="{le}"')
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def serve_metrics(metrics, host='127.0.0.1', port=9100):
+    """Serve metrics.render() at /metrics from a daemon thread."""
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would drown the server's own output
+            pass
+    
+    http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    http_server.daemon_threads = True
+    thread = threading.Thread(target=http_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return http_server
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import queue
+import threading
+from chess_logic import ChessGame
+from protocol import encode_message, pack_move, unpack_move
+
+log = logging.getLogger(__name__)
+
+WHITE_WIN = 0
+DRAW = 1
+BLACK_WIN = 2
+
+
+class OpeningTree:
+    def __init__(self, path=None, max_plies=30, compact_after=10000):
+        # Optional persistence: a snapshot of the whole tree at path plus a log
+        # of the games added since. Every compaction moves on to a new log
+        # generation and the snapshot names the one it stops at, so a crash
+        # halfway through never counts the same games twice.
+        self.path = path
+        self.generation = 0
+        self.max_plies = max_plies  # Only the opening phase of each game counts
+        self.compact_after = compact_after  # Logged games that trigger a new snapshot
+        
+        # {position_hash: {packed_move: [white_wins, draws, black_wins]}}
+        self.nodes = {}
+        self.lock = threading.Lock()
+        
+        self.finished_games = queue.SimpleQueue()
+        self.logged_games = 0
+        self.thread = None
+    
+    def start(self):
+        if self.path:
+            self.load()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        self.finished_games.put(None)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+    
+    def record_game(self, move_history, winner):
+        """Queue a finished game, cheap enough to call while holding the server lock."""
+        moves = [pack_move(move['from'], move['to'], move['promotion']) for move in move_history[:self.max_plies]]
+        if moves:
+            outcome = WHITE_WIN if winner == 'white' else (BLACK_WIN if winner == 'black' else DRAW)
+            self.finished_games.put((moves, outcome))
+    
+    def explore(self, position_hash):
+        """Moves played from a position with their results, most popular first."""
+        with self.lock:
+            node = self.nodes.get(position_hash)
+            moves = [(packed, list(counts)) for packed, counts in node.items()] if node else []
+        
+        explored = []
+        for packed, (white_wins, draws, black_wins) in moves:
+            from_pos, to_pos, promotion = unpack_move(packed)
+            explored.append({
+                'from': from_pos,
+                'to': to_pos,
+                'white': white_wins,
+                'draws': draws,
+                'black': black_wins,
+                'total': white_wins + draws + black_wins
+            })
+        explored.sort(key=lambda move: move['total'], reverse=True)
+        return explored
+    
+    def run(self):
+        stopping = False
+        while not stopping:
+            # Take every game that finished meanwhile in one go
+            batch = [self.finished_games.get()]
+            while True:
+                try:
+                    batch.append(self.finished_games.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if None in batch:
+                stopping = True
+                batch = [item for item in batch if item is not None]
+            
+            try:
+                if batch:
+                    self.add_games(batch)
+            except Exception as e:
+                log.error("Error updating opening tree: %s", e)
+    
+    def add_games(self, batch):
+        # Replaying the moves for their position hashes is the expensive part,
+        # it happens before taking the lock
+        entries = []
+        for moves, outcome in batch:
+            game = ChessGame()
+            plies = []
+            for packed in moves:
+                plies.append((game.get_position_hash(), packed))
+                from_pos, to_pos, promotion = unpack_move(packed)
+                game.apply_recorded_move(from_pos, to_pos)
+            entries.append((plies, outcome))
+        
+        with self.lock:
+            for plies, outcome in entries:
+                apply_game(self.nodes, plies, outcome)
+        
+        if self.path:
+            with open(log_file_path(self.path, self.generation), 'ab') as log_file:
+                for plies, outcome in entries:
+                    log_file.write(encode_message({'p': plies, 'o': outcome}))
+            self.logged_games += len(entries)
+            
+            if self.logged_games >= self.compact_after:
+                self.compact()
+    
+    def load(self):
+        nodes, self.generation = read_tree(self.path)
+        with self.lock:
+            self.nodes = nodes
+        
+        # Left behind by a crash right after the last compaction
+        stale_path = log_file_path(self.path, self.generation - 1)
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+    
+    def compact(self):
+        # Built from the files rather than the live tree, so queries and new
+        # games never wait on it. Only this thread writes the log.
+        nodes, generation = read_tree(self.path)
+        
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as snapshot_file:
+            json.dump({
+                'generation': generation + 1,
+                'nodes': {
+                    str(position_hash): {str(packed): counts for packed, counts in node.items()}
+                    for position_hash, node in nodes.items()
+                }
+            }, snapshot_file, separators=(',', ':'))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, self.path)
+        
+        # Everything in the log is in the snapshot now, which no longer reads
+        # it. Later games go to the next generation's log.
+        self.generation = generation + 1
+        self.logged_games = 0
+        os.remove(log_file_path(self.path, generation))
+
+
+def apply_game(nodes, plies, outcome):
+    for position_hash, packed in plies:
+        counts = nodes.setdefault(position_hash, {}).setdefault(packed, [0, 0, 0])
+        counts[outcome] += 1
+
+
+def log_file_path(path, generation):
+    return f'{path}.{generation}.log'
+
+
+def read_tree(path):
+    """The tree in a snapshot plus its log, and the log generation it's at."""
+    nodes = {}
+    generation = 0
+    if os.path.exists(path):
+        with open(path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        generation = snapshot['generation']
+        for position_hash, node in snapshot['nodes'].items():
+            nodes[int(position_hash)] = {int(packed): counts for packed, counts in node.items()}
+    
+    log_path = log_file_path(path, generation)
+    if os.path.exists(log_path):
+        with open(log_path, 'rb') as log_file:
+            for line in log_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash
+                    continue
+                apply_game(nodes, record['p'], record['o'])
+    
+    return nodes, generation
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from chess_logic import ChessGame
+from opening_tree import OpeningTree, WHITE_WIN, log_file_path, read_tree
+from protocol import pack_move
+
+OPENING = [((6, 4), (4, 4)), ((1, 4), (3, 4)), ((7, 6), (5, 5))]
+
+
+class OpeningTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tree.json')
+    
+    def tearDown(self):
+        self.directory.cleanup()
+    
+    def add_games(self, tree, count):
+        moves = [pack_move(from_pos, to_pos) for from_pos, to_pos in OPENING]
+        tree.add_games([(moves, WHITE_WIN)] * count)
+    
+    def first_move_count(self):
+        nodes, generation = read_tree(self.path)
+        return sum(counts[WHITE_WIN] for counts in nodes[ChessGame().get_position_hash()].values())
+    
+    def test_compaction_keeps_counts(self):
+        tree = OpeningTree(self.path, compact_after=3)
+        self.add_games(tree, 2)
+        self.add_games(tree, 2)
+        self.add_games(tree, 1)
+        self.assertEqual(self.first_move_count(), 5)
+        
+        reloaded = OpeningTree(self.path)
+        reloaded.load()
+        self.assertEqual(reloaded.explore(ChessGame().get_position_hash())[0]['white'], 5)
+    
+    def test_crash_after_snapshot_counts_games_once(self):
+        tree = OpeningTree(self.path, compact_after=2)
+        self.add_games(tree, 1)
+        
+        # Dies after the new snapshot is in place but before the log goes
+        with mock.patch('opening_tree.os.remove', side_effect=OSError('crash')):
+            with self.assertRaises(OSError):
+                self.add_games(tree, 1)
+        self.assertEqual(self.first_move_count(), 2)
+        
+        restarted = OpeningTree(self.path, compact_after=2)
+        restarted.load()
+        self.assertFalse(os.path.exists(log_file_path(self.path, 0)))
+        self.add_games(restarted, 1)
+        self.assertEqual(self.first_move_count(), 3)
+        self.assertEqual(restarted.explore(ChessGame().get_position_hash())[0]['white'], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,501 @@
+import collections
+import json
+import struct
+import zlib
+from chess_logic import PIECE_POINT_VALUES
+
+# Wire formats a connection can negotiate in its handshake
+FORMAT_JSON = 'json'
+FORMAT_BINARY = 'binary'
+WIRE_FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+# JSON format: every message is one line of UTF-8 JSON. json.dumps never emits a
+# raw newline, so the newline always marks the end of a frame and several
+# messages arriving in one recv() can be split apart reliably.
+FRAME_DELIMITER = b'\n'
+
+# Binary format: every frame is a type byte and a payload length followed by
+# the payload. Hot messages (moves and board snapshots) get packed struct
+# layouts, everything else travels as a JSON payload inside a binary frame.
+BINARY_HEADER = struct.Struct('>BI')
+MSG_JSON = 0
+MSG_MOVE = 1
+MSG_MOVE_RESULT = 2
+MSG_OPPONENT_MOVE = 3
+MSG_BOARD_STATE = 4
+MSG_SPECTATE_MOVE = 5
+MSG_COMPRESSED = 6
+
+# seq, move, hash, captured square, rook from, rook to, turn, flags, result,
+# winner, move count, duration in seconds, white points, black points
+MOVE_UPDATE_STRUCT = struct.Struct('>IHQBBBBBBBHIBB')
+# seq, turn, hash, has_moved bitmask, the 32-byte packed board, then the
+# square of a pawn that can be taken en passant
+BOARD_STATE_STRUCT = struct.Struct('>IBQQ32sB')
+# Timed games append white's and black's remaining time and the increment, in ms
+CLOCK_STRUCT = struct.Struct('>III')
+
+# Message types sharing the move update layout
+MOVE_UPDATE_TYPES = {
+    'move_result': MSG_MOVE_RESULT,
+    'opponent_move': MSG_OPPONENT_MOVE,
+    'spectate_move': MSG_SPECTATE_MOVE
+}
+
+NO_SQUARE = 0xFF
+COLORS = ('white', 'black')
+PIECE_TYPES = (None, 'pawn', 'knight', 'bishop', 'rook', 'queen', 'king')
+PROMOTIONS = (None, 'knight', 'bishop', 'rook', 'queen')
+RESULTS = (None, 'checkmate', 'stalemate', 'insufficient_material', 'fifty_move_rule', 'threefold_repetition')
+WINNERS = (None, 'white', 'black')
+
+# Compression, negotiated in the handshake and only ever from server to
+# client. A frame of COMPRESSION_THRESHOLD bytes or more, or a run of frames
+# sent together, can go out as one MSG_COMPRESSED frame: a binary header and
+# the frames deflated against a preset dictionary of our message shapes. The
+# header is the same in both formats, a JSON frame never starts with that byte.
+# Every frame is compressed on its own so it can be shared between recipients
+# like any other, and moves stay well under the threshold so they cost nothing.
+COMPRESSION_ZLIB = 'zlib1'  # Bump the number whenever the dictionary changes
+COMPRESSIONS = (COMPRESSION_ZLIB,)
+COMPRESSION_THRESHOLD = 512
+COMPRESSION_LEVEL = 6
+COMPRESSED_MARKER = bytes([MSG_COMPRESSED])
+
+# Frames beyond these sizes are refused rather than buffered, so a peer can't
+# make us hold on to unbounded amounts of memory. Clients only ever send small
+# frames and are held to much less than the server. A compressed frame may
+# inflate to at most MAX_INFLATED_SIZE, all the frames in it together.
+MAX_FRAME_SIZE = 1 << 20
+MAX_CLIENT_FRAME_SIZE = 1 << 16
+MAX_INFLATED_SIZE = 1 << 22
+
+# Bits of the flags byte in a move update
+FLAG_STATUS = 0x01
+FLAG_GAME_OVER = 0x02
+FLAG_WHITE_IN_CHECK = 0x04
+FLAG_BLACK_IN_CHECK = 0x08
+FLAG_CLOCK = 0x10
+
+
+class FrameError(ValueError):
+    """A frame the reader won't take: too large, or compressed where that isn't allowed."""
+
+
+def encode_message(message, wire_format=FORMAT_JSON):
+    """Encode a message dict as a single wire frame."""
+    if wire_format == FORMAT_BINARY:
+        return _encode_binary(message)
+    return json.dumps(message, separators=(',', ':')).encode('utf-8') + FRAME_DELIMITER
+
+
+def compress_frames(frames):
+    """frames as a single compressed frame, or None when that wouldn't pay."""
+    data = b''.join(frames)
+    if len(data) < COMPRESSION_THRESHOLD:
+        return None
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=COMPRESSION_DICTIONARY)
+    payload = compressor.compress(data) + compressor.flush()
+    if BINARY_HEADER.size + len(payload) >= len(data):
+        return None
+    return _pack_frame(MSG_COMPRESSED, payload)
+
+
+def compress_frame(frame):
+    return compress_frames([frame]) or frame
+
+
+def decompress_frames(payload, max_size=MAX_INFLATED_SIZE):
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=COMPRESSION_DICTIONARY)
+    try:
+        data = decompressor.decompress(payload, max_size)
+    except zlib.error as e:
+        raise FrameError(f"Corrupt compressed frame: {e}")
+    # Stopping short of the end of the stream means it inflates to more
+    if not decompressor.eof:
+        raise FrameError(f"Compressed frame inflates to more than {max_size} bytes")
+    return data
+
+
+def _sample_messages():
+    # What the server sends in bulk, least common first: deflate reaches back
+    # to the end of the dictionary most cheaply, so the board goes last
+    def piece(color, piece_type, has_moved=False):
+        return {'color': color, 'type': piece_type, 'has_moved': has_moved,
+                'points': PIECE_POINT_VALUES.get(piece_type, 0)}
+    back_rank = ('rook', 'knight', 'bishop', 'queen', 'king', 'bishop', 'knight', 'rook')
+    board = ([[piece('black', piece_type) for piece_type in back_rank], [piece('black', 'pawn')] * 8]
+             + [[None] * 8 for _ in range(4)]
+             + [[piece('white', 'pawn')] * 8, [piece('white', piece_type) for piece_type in back_rank]])
+    game_info = {'move_count': 12, 'duration': '2m 15s', 'points': {'white': 39, 'black': 39}}
+    clock = {'white': 287.5, 'black': 291.25, 'turn': 'white', 'increment': 2}
+    move = {'from': [6, 4], 'to': [4, 4], 'captured': [4, 4], 'rook': [[7, 7], [7, 5]], 'promotion': 'queen'}
+    return [
+        {'type': 'tournament_standings', 'tournament': 1, 'name': 'Swiss', 'system': 'swiss', 'rounds': 5,
+         'round': 2, 'state': 'running', 'players': 16, 'standings': [
+             {'rank': 1, 'name': 'player', 'score': 1.5, 'buchholz': 2.0, 'sonneborn_berger': 1.75,
+              'wins': 1, 'withdrawn': False}]},
+        {'type': 'lobby_snapshot', 'version': 1, 'players': [
+            {'name': 'player', 'status': status, 'rating': 1200}
+            for status in ('away', 'spectating', 'queued', 'playing', 'idle')]},
+        {'type': 'lobby_delta', 'version': 2, 'changes': [
+            {'op': 'leave', 'name': 'player'},
+            {'op': 'status', 'name': 'player', 'status': 'playing', 'rating': 1200},
+            {'op': 'join', 'name': 'player', 'status': 'idle', 'rating': 1200}]},
+        {'type': 'game_start', 'color': 'white', 'opponent': 'player', 'rating': 1200,
+         'opponent_rating': 1200, 'clock': clock},
+        {'type': 'session_resumed', 'session': '', 'game_id': '1', 'color': 'black', 'opponent': 'player',
+         'seq': 12, 'hash': 0, 'turn': 'white', 'game_info': game_info, 'clock': clock,
+         'moves': [{'from': [1, 4], 'to': [3, 4]}, move]},
+        {'type': 'spectate_start', 'game_id': '1', 'white': 'player', 'black': 'player'},
+        {'type': 'spectate_move', 'move': move, 'seq': 12, 'hash': 0, 'turn': 'black', 'game_info': game_info,
+         'status': {'game_over': False, 'result': None, 'winner': None, 'check': {'white': False, 'black': False}}},
+        {'type': 'board_state', 'board': [[piece('white', 'queen', True), piece('black', 'knight', True)]]},
+        {'type': 'board_state', 'board': board, 'turn': 'white', 'seq': 0, 'hash': 0, 'en_passant': None}
+    ]
+
+
+COMPRESSION_DICTIONARY = b''.join(encode_message(message) for message in _sample_messages())
+
+
+def square_index(pos):
+    row, col = pos
+    return row * 8 + col
+
+
+def square_pos(index):
+    return [index // 8, index % 8]
+
+
+def pack_move(from_pos, to_pos, promotion=None):
+    """Pack a move into 16 bits: 6 bits from, 6 bits to, 4 bits promotion."""
+    return (square_index(from_pos) << 10) | (square_index(to_pos) << 4) | PROMOTIONS.index(promotion)
+
+
+def unpack_move(packed):
+    return square_pos(packed >> 10), square_pos((packed >> 4) & 0x3F), PROMOTIONS[packed & 0x0F]
+
+
+def _duration_seconds(duration):
+    # game_info durations are formatted as "Xm Ys"
+    minutes, seconds = duration.rstrip('s').split('m ')
+    return int(minutes) * 60 + int(seconds)
+
+
+def _pack_frame(message_type, payload):
+    return BINARY_HEADER.pack(message_type, len(payload)) + payload
+
+
+def _encode_binary(message):
+    message_type = message.get('type')
+    
+    if message_type == 'move' and set(message) <= {'type', 'from', 'to', 'promotion'}:
+        payload = struct.pack('>H', pack_move(message['from'], message['to'], message.get('promotion')))
+        return _pack_frame(MSG_MOVE, payload)
+    
+    if message_type in MOVE_UPDATE_TYPES and 'move' in message and 'board' not in message:
+        return _pack_frame(MOVE_UPDATE_TYPES[message_type], _encode_move_update(message))
+    
+    if message_type == 'board_state' and 'seq' in message:
+        return _pack_frame(MSG_BOARD_STATE, _encode_board_state(message))
+    
+    # Everything else is rare enough to stay JSON
+    return _pack_frame(MSG_JSON, json.dumps(message, separators=(',', ':')).encode('utf-8'))
+
+
+def _encode_move_update(message):
+    move = message['move']
+    captured = move.get('captured')
+    rook = move.get('rook')
+    game_info = message['game_info']
+    status = message.get('status')
+    
+    flags = 0
+    result = winner = 0
+    if status:
+        flags |= FLAG_STATUS
+        if status['game_over']:
+            flags |= FLAG_GAME_OVER
+        if status['check']['white']:
+            flags |= FLAG_WHITE_IN_CHECK
+        if status['check']['black']:
+            flags |= FLAG_BLACK_IN_CHECK
+        result = RESULTS.index(status['result'])
+        winner = WINNERS.index(status['winner'])
+    
+    clock = message.get('clock')
+    if clock:
+        flags |= FLAG_CLOCK
+    
+    payload = MOVE_UPDATE_STRUCT.pack(
+        message['seq'],
+        pack_move(move['from'], move['to'], move.get('promotion')),
+        message['hash'],
+        square_index(captured) if captured else NO_SQUARE,
+        square_index(rook[0]) if rook else NO_SQUARE,
+        square_index(rook[1]) if rook else NO_SQUARE,
+        COLORS.index(message['turn']),
+        flags,
+        result,
+        winner,
+        game_info['move_count'],
+        _duration_seconds(game_info['duration']),
+        game_info['points']['white'],
+        game_info['points']['black']
+    )
+    
+    if clock:
+        payload += CLOCK_STRUCT.pack(
+            round(clock['white'] * 1000),
+            round(clock['black'] * 1000),
+            round(clock['increment'] * 1000)
+        )
+    return payload
+
+
+def _encode_board_state(message):
+    en_passant = message.get('en_passant')
+    packed_board = bytearray(32)
+    moved_mask = 0
+    
+    for row, board_row in enumerate(message['board']):
+        for col, piece in enumerate(board_row):
+            if not piece:
+                continue
+            index = row * 8 + col
+            # One nibble per square: piece type in the low 3 bits, color in the 4th
+            nibble = PIECE_TYPES.index(piece['type']) | (8 if piece['color'] == 'black' else 0)
+            packed_board[index // 2] |= nibble << (4 if index % 2 == 0 else 0)
+            if piece.get('has_moved'):
+                moved_mask |= 1 << index
+    
+    return BOARD_STATE_STRUCT.pack(
+        message['seq'],
+        COLORS.index(message['turn']),
+        message['hash'],
+        moved_mask,
+        bytes(packed_board),
+        square_index(en_passant) if en_passant else NO_SQUARE
+    )
+
+
+def _decode_binary(message_type, payload):
+    if message_type == MSG_MOVE:
+        from_pos, to_pos, promotion = unpack_move(struct.unpack('>H', payload)[0])
+        message = {'type': 'move', 'from': from_pos, 'to': to_pos}
+        if promotion:
+            message['promotion'] = promotion
+        return message
+    
+    if message_type in (MSG_MOVE_RESULT, MSG_OPPONENT_MOVE, MSG_SPECTATE_MOVE):
+        return _decode_move_update(message_type, payload)
+    
+    if message_type == MSG_BOARD_STATE:
+        return _decode_board_state(payload)
+    
+    return json.loads(payload.decode('utf-8'))
+
+
+def _decode_move_update(message_type, payload):
+    (seq, packed_move, position_hash, captured, rook_from, rook_to, turn, flags,
+     result, winner, move_count, duration, white_points, black_points) = MOVE_UPDATE_STRUCT.unpack_from(payload)
+    
+    from_pos, to_pos, promotion = unpack_move(packed_move)
+    move = {'from': from_pos, 'to': to_pos}
+    if promotion:
+        move['promotion'] = promotion
+    if captured != NO_SQUARE:
+        move['captured'] = square_pos(captured)
+    if rook_from != NO_SQUARE:
+        move['rook'] = [square_pos(rook_from), square_pos(rook_to)]
+    
+    if message_type == MSG_MOVE_RESULT:
+        message = {'type': 'move_result', 'valid': True}
+    elif message_type == MSG_SPECTATE_MOVE:
+        message = {'type': 'spectate_move'}
+    else:
+        message = {'type': 'opponent_move'}
+    
+    message.update({
+        'move': move,
+        'seq': seq,
+        'hash': position_hash,
+        'turn': COLORS[turn],
+        'game_info': {
+            'move_count': move_count,
+            'duration': f"{duration // 60}m {duration % 60}s",
+            'points': {'white': white_points, 'black': black_points}
+        }
+    })
+    
+    if flags & FLAG_STATUS:
+        message['status'] = {
+            'game_over': bool(flags & FLAG_GAME_OVER),
+            'result': RESULTS[result],
+            'winner': WINNERS[winner],
+            'check': {
+                'white': bool(flags & FLAG_WHITE_IN_CHECK),
+                'black': bool(flags & FLAG_BLACK_IN_CHECK)
+            }
+        }
+    
+    if flags & FLAG_CLOCK:
+        white_ms, black_ms, increment_ms = CLOCK_STRUCT.unpack_from(payload, MOVE_UPDATE_STRUCT.size)
+        message['clock'] = {
+            'white': white_ms / 1000,
+            'black': black_ms / 1000,
+            'turn': COLORS[turn],
+            'increment': increment_ms / 1000
+        }
+    
+    return message
+
+
+def _decode_board_state(payload):
+    seq, turn, position_hash, moved_mask, packed_board, en_passant = BOARD_STATE_STRUCT.unpack(payload)
+    
+    board = [[None for _ in range(8)] for _ in range(8)]
+    for index in range(64):
+        nibble = packed_board[index // 2] >> (4 if index % 2 == 0 else 0) & 0x0F
+        if not nibble:
+            continue
+        piece_type = PIECE_TYPES[nibble & 0x07]
+        board[index // 8][index % 8] = {
+            'color': 'black' if nibble & 0x08 else 'white',
+            'type': piece_type,
+            'has_moved': bool(moved_mask >> index & 1),
+            'points': PIECE_POINT_VALUES.get(piece_type, 0)
+        }
+    
+    return {
+        'type': 'board_state',
+        'board': board,
+        'turn': COLORS[turn],
+        'seq': seq,
+        'hash': position_hash,
+        'en_passant': square_pos(en_passant) if en_passant != NO_SQUARE else None
+    }
+
+
+class MessageReader:
+    def __init__(self, wire_format=FORMAT_JSON, negotiate=False, inflate=False, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.wire_format = wire_format
+        # Client side: follow the format the server confirms in connection_success,
+        # and take compressed frames. The server never accepts those.
+        self.negotiate = negotiate
+        self.inflate = inflate
+        self.max_frame_size = max_frame_size
+        self.unpacked = collections.deque()  # Messages out of a compressed frame, not returned yet
+    
+    def set_format(self, wire_format):
+        self.wire_format = wire_format
+    
+    def feed(self, data, limit=None):
+        """Add received bytes and return the complete messages decoded from them.
+        
+        With a limit, undecoded frames stay buffered, e.g. so the handshake can be
+        read before the rest of the stream switches to the negotiated format.
+        """
+        self.buffer += data
+        messages = []
+        
+        while limit is None or len(messages) < limit:
+            if self.unpacked:
+                message = self.unpacked.popleft()
+            elif self.wire_format == FORMAT_BINARY or self.buffer[:1] == COMPRESSED_MARKER:
+                message = self._read_binary_frame()
+            else:
+                message = self._read_json_frame()
+            
+            if message is None:
+                # Only an incomplete frame is left, wait for the next recv()
+                break
+            if not message:
+                continue
+            
+            messages.append(message)
+            if self.negotiate and message.get('type') == 'connection_success' and message.get('format') in WIRE_FORMATS:
+                self.wire_format = message['format']
+        
+        return messages
+    
+    def _read_json_frame(self):
+        end = self.buffer.find(FRAME_DELIMITER)
+        if end < 0:
+            if len(self.buffer) > self.max_frame_size:
+                raise FrameError(f"Frame longer than {self.max_frame_size} bytes")
+            return None
+        if end > self.max_frame_size:
+            raise FrameError(f"Frame longer than {self.max_frame_size} bytes")
+        
+        frame = bytes(self.buffer[:end])
+        del self.buffer[:end + 1]
+        if not frame.strip():
+            return {}
+        return json.loads(frame.decode('utf-8'))
+    
+    def _read_binary_frame(self):
+        if len(self.buffer) < BINARY_HEADER.size:
+            return None
+        
+        message_type, length = BINARY_HEADER.unpack_from(self.buffer)
+        if length > self.max_frame_size:
+            raise FrameError(f"Frame longer than {self.max_frame_size} bytes")
+        if message_type == MSG_COMPRESSED and not self.inflate:
+            raise FrameError("Compressed frame where none was negotiated")
+        end = BINARY_HEADER.size + length
+        if len(self.buffer) < end:
+            return None
+        
+        payload = bytes(self.buffer[BINARY_HEADER.size:end])
+        del self.buffer[:end]
+        if message_type == MSG_COMPRESSED:
+            # Whole frames in the current format, handed out one by one
+            inner = MessageReader(self.wire_format, max_frame_size=MAX_INFLATED_SIZE)
+            self.unpacked.extend(inner.feed(decompress_frames(payload)))
+            return {}
+        return _decode_binary(message_type, payload)
+
+
+class SharedMessage:
+    def __init__(self, body):
+        # Body shared by every recipient, encoded at most once per wire format
+        self.body = body
+        self.encoded_body = None
+        self.frames = {}
+    
+    def frame(self, wire_format=FORMAT_JSON, compress=False, **fields):
+        """Wire frame for the shared body plus per-recipient fields.
+        
+        Recipients asking for the same format and fields get the very same bytes
+        object, so fanning out to many of them costs one encode in total. The
+        same goes for compressing it.
+        """
+        key = (wire_format, compress, tuple(sorted(fields.items())))
+        frame = self.frames.get(key)
+        if frame is not None:
+            return frame
+        
+        if compress:
+            frame = compress_frame(self.frame(wire_format, **fields))
+            self.frames[key] = frame
+            return frame
+        
+        if wire_format == FORMAT_BINARY:
+            # Packed layouts are tiny, there is nothing worth splicing
+            frame = encode_message({**fields, **self.body}, FORMAT_BINARY)
+            self.frames[key] = frame
+            return frame
+        
+        if self.encoded_body is None:
+            # Strip the outer braces so fields can be spliced in front
+            self.encoded_body = encode_message(self.body)[1:-2]
+        
+        parts = [json.dumps(fields, separators=(',', ':'))[1:-1].encode('utf-8')] if fields else []
+        if self.encoded_body:
+            parts.append(self.encoded_body)
+        
+        frame = b'{' + b','.join(parts) + b'}' + FRAME_DELIMITER
+        self.frames[key] = frame
+        return frame
@@ -0,0 +1,29 @@
+import time
+
+
+class TokenBucket:
+    """Allows bursts of up to burst events, refilling at rate per second.
+    
+    Not thread-safe: each bucket belongs to a single thread, e.g. the reader
+    thread of the connection it limits.
+    """
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+    
+    def take(self, now=None):
+        """Use up a token if there is one, returns whether the event is allowed."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def wait_time(self):
+        """Seconds until the next token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate else float('inf')
@@ -1,10 +1,80 @@
 import socket
+import sys
 import threading
 import json
+import os
+import queue
 import random
+import tempfile
 import time
+import itertools
+import secrets
 import argparse
+import logging
+import math
+import signal
+import multiprocessing
 from chess_logic import ChessGame
+from matchmaker import Matchmaker, DEFAULT_RATING, elo_update
+from spectators import SpectatorFeed
+from lobby import Lobby
+from tournament import Tournament, SYSTEMS as TOURNAMENT_SYSTEMS, SWISS
+from journal import GameJournal, recover_games, compact_journal
+from archive import GameArchive, pack_moves
+from opening_tree import OpeningTree
+from handover import (listen_for_handover, request_handover, send_handover, HANDOVER_REQUEST,
+                      pack_game, unpack_game, pack_clock, unpack_clock)
+from session_capture import SessionCapture, TO_SERVER, TO_CLIENT, CLOSED
+from ratelimit import TokenBucket
+from clocks import TimerService, GameClock, parse_time_control
+from metrics import Metrics, TimedLock, serve_metrics
+from chess_logging import setup_logging, Sampler, LOG_LEVELS
+from broker import (BrokerLink, HANDOFF_TIMEOUT, MAX_FORWARDED_DATA, run_broker, encode_handoff_data,
+                    decode_handoff_data)
+from protocol import (encode_message, compress_frame, MessageReader, SharedMessage, FORMAT_JSON, WIRE_FORMATS,
+                      COMPRESSIONS, COMPRESSED_MARKER, MAX_CLIENT_FRAME_SIZE, FrameError)
+
+log = logging.getLogger('server')
+
+# How long players of a game recovered from the journal have to log back in
+RECOVERY_GRACE_PERIOD = 300
+
+# Clients quiet for a heartbeat interval get pinged, clients quiet for the idle
+# timeout are taken for dead and disconnected
+HEARTBEAT_INTERVAL = 10
+IDLE_TIMEOUT = 30
+
+# How long a player who drops out of a game has to resume it before forfeiting
+RESUME_GRACE_PERIOD = 60
+
+# Players whose game moved to a new server process get at least this long to
+# reconnect to it, whatever the resume grace period
+HANDOVER_RESUME_GRACE = 30
+
+# How often the accept loop looks up from accept() to see whether it should stop
+ACCEPT_POLL_INTERVAL = 0.25
+
+# Admission control, all limits are per server process. Connections beyond
+# them are answered with a ready-made server_busy frame and closed on the
+# accept thread, so an overload costs neither threads nor the lock. Turned
+# away clients are told to retry after BUSY_RETRY_AFTER to twice that many
+# seconds, spread so they don't all come back at once.
+LISTEN_BACKLOG = 512
+MAX_CONNECTIONS = 4096
+ACCEPT_BURST = 100
+BUSY_RETRY_AFTER = 5
+
+# Chat allowance per connection: a burst of CHAT_BURST messages, then
+# CHAT_RATE per second. Longer messages are cut short. Messages reaching a
+# player within CHAT_BATCH_WINDOW of the last one are sent together.
+CHAT_RATE = 1.0
+CHAT_BURST = 5
+CHAT_MAX_LENGTH = 200
+CHAT_BATCH_WINDOW = 0.1
+
+# Client messages about tournaments, all handled by handle_tournament
+TOURNAMENT_MESSAGES = ('tournament_create', 'tournament_join', 'tournament_leave', 'tournament_start',
+                       'tournament_standings', 'tournament_list')
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Chess game server')
@@ -12,23 +82,527 @@ def parse_arguments():
                         help='Server hostname or IP address (default: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=5555, 
                         help='Server port (default: 5555)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes sharing the port (default: 1)')
+    parser.add_argument('--journal', metavar='PATH',
+                        help='Journal live games to this file and recover them on restart')
+    parser.add_argument('--archive', metavar='PATH',
+                        help='Keep finished games in this SQLite database')
+    parser.add_argument('--opening-tree', metavar='PATH',
+                        help='Persist opening explorer statistics to this file')
+    parser.add_argument('--time-control', metavar='MINUTES+INCREMENT', type=parse_time_control,
+                        help='Play timed games, e.g. 5+3 (default: untimed)')
+    parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL,
+                        help=f'Seconds of silence before a client is pinged (default: {HEARTBEAT_INTERVAL})')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help=f'Seconds of silence before a client is disconnected (default: {IDLE_TIMEOUT})')
+    parser.add_argument('--resume-grace', type=float, default=RESUME_GRACE_PERIOD,
+                        help=f'Seconds a dropped player\'s game is held for them (default: {RESUME_GRACE_PERIOD}, 0 forfeits at once)')
+    parser.add_argument('--chat-rate', type=float, default=CHAT_RATE,
+                        help=f'Chat messages per second a client may keep up (default: {CHAT_RATE})')
+    parser.add_argument('--chat-burst', type=int, default=CHAT_BURST,
+                        help=f'Chat messages a client may send in a burst (default: {CHAT_BURST})')
+    parser.add_argument('--backlog', type=int, default=LISTEN_BACKLOG,
+                        help=f'Connections the kernel queues until they are accepted (default: {LISTEN_BACKLOG})')
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS,
+                        help=f'Open connections per worker, more are turned away (default: {MAX_CONNECTIONS})')
+    parser.add_argument('--max-per-ip', type=int,
+                        help='Open connections per client address and worker (default: no limit)')
+    parser.add_argument('--accept-rate', type=float,
+                        help='New connections per second a worker accepts (default: no limit)')
+    parser.add_argument('--accept-burst', type=int, default=ACCEPT_BURST,
+                        help=f'New connections a worker accepts in a burst with --accept-rate (default: {ACCEPT_BURST})')
+    parser.add_argument('--capture', metavar='PATH',
+                        help='Record all client traffic to this file for replaying later')
+    parser.add_argument('--control', metavar='PATH',
+                        help='Offer the live games to a replacement server started with --takeover PATH')
+    parser.add_argument('--takeover', metavar='PATH',
+                        help='Take over the listening socket and live games of the server offering them at PATH')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics on 127.0.0.1 at this port (workers use consecutive ports)')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO',
+                        help='Least severe log messages to show, DEBUG includes per-message detail (default: INFO)')
     return parser.parse_args()
 
+def client_int(value):
+    """A whole number sent by a client, or None if it isn't one."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
 class ChessServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    def __init__(self, host='0.0.0.0', port=5555, reuse_port=False, broker_path=None, worker_id=None,
+                 journal_path=None, archive_path=None, opening_tree_path=None, time_control=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, idle_timeout=IDLE_TIMEOUT, resume_grace=RESUME_GRACE_PERIOD,
+                 metrics_port=None, capture_path=None, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 control_path=None, takeover_path=None, backlog=LISTEN_BACKLOG, max_connections=MAX_CONNECTIONS,
+                 max_per_ip=None, accept_rate=None, accept_burst=ACCEPT_BURST):
         self.host = host
         self.port = port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.clients = {}  # {client_socket: {'username': username, 'game': game_id, 'color': color}}
-        self.waiting_queue = []  # List of client sockets waiting for a match
-        self.games = {}  # {game_id: {'white': client_socket, 'black': client_socket, 'game': ChessGame}}
-        self.lock = threading.Lock()
+        if reuse_port:
+            # Every worker process binds its own socket to the same port and
+            # the kernel spreads incoming connections across them
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.clients = {}  # {client_socket: {'username': username, 'game': game_id, 'color': color, 'rating': rating, 'outbox': Queue, 'format': wire_format, 'compress': bool, 'key': player_key, 'last_seen': monotonic_time, 'session': token, 'chat_bucket': TokenBucket, 'chat_pending': [{'sender', 'content'}]}}
+        self.ratings = {}  # {username: rating}, kept across reconnects
+        self.matchmaker = Matchmaker(self.match_players)  # Client sockets waiting for a match
+        self.games = {}  # {game_id: {'white': client_socket, 'black': client_socket, 'players': {color: username}, 'game': ChessGame, 'clock': GameClock, 'flag_timer': TimerHandle}}
+        self.spectators = SpectatorFeed(self.spectator_dropped)  # Everyone watching a game they don't play in
+        
+        # Recording is per thread and lock-free, everything is summed up when
+        # the metrics endpoint is scraped
+        self.metrics = Metrics()
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.lock = TimedLock(self.metrics)
+        
+        # Per-connection and per-game events are DEBUG, INFO only gets a
+        # running count every so often
+        self.connection_sampler = Sampler(1000)
+        self.game_sampler = Sampler(1000)
+        
+        # Optional on-disk record of live games, replayed on startup. Players of
+        # recovered games get their seat back when they log in again.
+        self.journal = GameJournal(journal_path) if journal_path else None
+        self.recovered_players = {}  # {username: {'game': game_id, 'color': color, 'opponent': name, 'chat': [(sender, content)]}}
+        
+        # Optional database of finished games, written on its own thread
+        self.archive = GameArchive(archive_path) if archive_path else None
+        
+        # Win/draw/loss counts per move for every opening position played
+        self.opening_tree = OpeningTree(opening_tree_path)
+        
+        # Timed games: (initial_seconds, increment_seconds) or None. One timer
+        # thread watches every running clock for a flag fall.
+        self.time_control = time_control
+        self.timers = TimerService()
+        
+        # Half-open connections never get a FIN, so silence is the only sign
+        # of a dead peer. The same timer thread sweeps for them.
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.ping_message = SharedMessage({'type': 'ping'})
+        
+        # Every connection gets a session token. Players who drop out of a game
+        # keep their seat for resume_grace seconds and can take it back from a
+        # new connection by presenting the token.
+        self.resume_grace = resume_grace
+        self.sessions = {}  # {token: client_socket}
+        self.suspended_sessions = {}  # {token: {'username': name, 'game': game_id, 'color': color, 'rating': rating, 'timer': TimerHandle}}
+        
+        # Optional record of every byte exchanged with clients, for replaying
+        # with session_capture.py
+        self.capture = SessionCapture(capture_path) if capture_path else None
+        
+        # Chat is rate limited per connection and batched per recipient, so a
+        # spammer can't keep the lock busy or flood the other side
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        
+        # Presence of everyone connected, published as versioned deltas to the
+        # clients that subscribe
+        self.lobby = Lobby(self.timers, self.send_shared)
+        
+        # Tournaments run their boards as ordinary games, each result is
+        # scored when the game is cleaned up and the next round is paired the
+        # moment the last board of the current one finishes
+        self.tournaments = {}  # {tournament_id: Tournament}
+        self.tournament_ids = itertools.count(1)
+        self.tournament_games = {}  # {game_id: tournament_id} for boards not scored yet
+        
+        # Deploys without dropping games: a replacement process started with
+        # --takeover connects to control_path and is handed the listening
+        # socket and every live game, players resume their sessions with it.
+        # Without a replacement, draining lets the running games finish.
+        self.control_path = control_path or takeover_path
+        self.takeover_path = takeover_path
+        self.control_socket = None
+        self.draining = False
+        self.stop_accepting = threading.Event()
+        self.accept_stopped = threading.Event()
+        self.handover_done = threading.Event()
+        
+        # Admission control. Connections are counted from accept until their
+        # reader thread ends, the accept rate bucket belongs to the accept thread.
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.accept_bucket = TokenBucket(accept_rate, accept_burst) if accept_rate else None
+        self.admission_lock = threading.Lock()
+        self.open_connections = 0
+        self.connections_by_ip = {}  # {address: open connections}
+        self.busy_frames = {}  # {retry_after: encoded server_busy frame}
+        self.rejection_sampler = Sampler(1000)
+        
+        self.register_metrics()
+        
+        # When running as one of several workers, matchmaking goes through the
+        # shared broker instead of the local matchmaker
+        self.broker_path = broker_path
+        self.worker_id = worker_id
+        self.broker = None
+        self.player_keys = itertools.count(1)
+        self.players_by_key = {}  # {player_key: client_socket}
+        self.pending_games = {}  # {game_id: {'local': client_socket, 'token': token}} waiting for a handoff
+        self.expected_handoffs = {}  # {token: (game_id, rating)}
+        
+    def register_metrics(self):
+        self.metrics.counter('chess_messages_total', 'Client messages handled', label='type')
+        self.metrics.histogram('chess_handler_seconds', 'Time spent handling a client message', label='type')
+        self.metrics.histogram('chess_lock_wait_seconds', 'Time spent waiting for the server lock')
+        self.metrics.counter('chess_connections_total', 'Connections accepted')
+        self.metrics.counter('chess_connections_rejected_total', 'Connections turned away by admission control', label='reason')
+        self.metrics.counter('chess_frames_sent_total', 'Frames written to clients')
+        self.metrics.counter('chess_bytes_sent_total', 'Bytes written to clients')
+        self.metrics.counter('chess_frames_compressed_total', 'Frames written to clients compressed')
+        self.metrics.counter('chess_games_started_total', 'Games started')
+        self.metrics.counter('chess_games_finished_total', 'Games finished', label='result')
+        self.metrics.counter('chess_chat_dropped_total', 'Chat messages dropped by the rate limit')
+        self.metrics.counter('chess_chat_frames_total', 'Chat frames sent, each carrying one or more messages')
+        self.metrics.gauge('chess_connections', 'Connected clients', lambda: len(self.clients))
+        self.metrics.gauge('chess_connections_open', 'Accepted connections not closed yet', lambda: self.open_connections)
+        self.metrics.gauge('chess_games_active', 'Games in progress', lambda: len(self.games))
+        self.metrics.gauge('chess_tournaments_running', 'Tournaments in progress',
+                           lambda: sum(1 for tournament in list(self.tournaments.values()) if tournament.state == 'running'))
+        self.metrics.gauge('chess_lobby_subscribers', 'Clients following the lobby', lambda: len(self.lobby.subscribers))
+        self.metrics.gauge('chess_sessions_suspended', 'Players away from a game they can resume',
+                           lambda: len(self.suspended_sessions))
+        self.metrics.gauge('chess_outbox_frames', 'Frames waiting in client outboxes',
+                           lambda: sum(client['outbox'].qsize() for client in list(self.clients.values())))
+        self.metrics.gauge('chess_queue_depth', 'Items waiting in background queues', self.queue_depths, label='queue')
+    
+    def queue_depths(self):
+        depths = {
+            'matchmaker': len(self.matchmaker.waiting),
+            'spectator_events': self.spectators.events.qsize(),
+            'opening_tree': self.opening_tree.finished_games.qsize(),
+            'timers': len(self.timers.heap)
+        }
+        if self.journal is not None:
+            depths['journal'] = self.journal.records.qsize()
+        if self.archive is not None:
+            depths['archive'] = self.archive.pending.qsize()
+        return depths
+    
+    def start(self, announce=True):
+        handover_state = None
+        if self.takeover_path:
+            # The socket stays bound throughout, clients connecting meanwhile
+            # wait in the backlog
+            self.server_socket.close()
+            self.server_socket, handover_state = request_handover(self.takeover_path)
+            # Listening again only changes the backlog to ours
+            self.server_socket.listen(self.backlog)
+        else:
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(self.backlog)
+        self.server_socket.settimeout(ACCEPT_POLL_INTERVAL)
+        if self.metrics_port:
+            self.metrics_server = serve_metrics(self.metrics, port=self.metrics_port)
+        if handover_state is not None:
+            # The journal already has these games, it carries on where the
+            # old process left off
+            self.restore_handover(handover_state)
+            if self.journal is not None:
+                self.journal.open()
+        elif self.journal is not None:
+            self.recover_games()
+            self.journal.open()
+        if self.archive is not None:
+            self.archive.start()
+        if self.capture is not None:
+            self.capture.open()
+        self.opening_tree.start()
+        self.timers.start()
+        self.timers.schedule(self.heartbeat_interval, self.check_heartbeats)
+        if self.broker_path:
+            self.broker = BrokerLink(self.broker_path, self.worker_id, self.handle_broker_message)
+        else:
+            self.matchmaker.start()
+        self.spectators.start()
+        if self.control_path:
+            self.control_socket = listen_for_handover(self.control_path)
+            control_thread = threading.Thread(target=self.serve_control)
+            control_thread.daemon = True
+            control_thread.start()
+        
+        # Being terminated drains, like the first Ctrl+C
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.drain())
+        
+        if announce:
+            self.print_banner()
+        
+        try:
+            self.accept_connections()
+        except KeyboardInterrupt:
+            log.info("Server shutting down...")
+        finally:
+            self.accept_stopped.set()
+            if self.stop_accepting.is_set():
+                self.handover_done.wait()
+            if self.control_socket is not None:
+                self.control_socket.close()
+                # After a handover the path belongs to the new process
+                if not self.stop_accepting.is_set() and os.path.exists(self.control_path):
+                    os.unlink(self.control_path)
+            self.matchmaker.stop()
+            self.spectators.stop()
+            if self.journal is not None:
+                self.journal.close()
+            if self.archive is not None:
+                self.archive.stop()
+            self.opening_tree.stop()
+            self.timers.stop()
+            if self.capture is not None:
+                self.capture.close()
+            self.server_socket.close()
+    
+    def accept_connections(self):
+        while not self.stop_accepting.is_set():
+            try:
+                if self.draining and not self.games:
+                    log.info("All games have finished, shutting down")
+                    return
+                try:
+                    client_socket, address = self.server_socket.accept()
+                except socket.timeout:
+                    continue
+                self.metrics.inc('chess_connections_total')
+                
+                reason = self.admit(address[0])
+                if reason is not None:
+                    self.reject(client_socket, address, reason)
+                    continue
+                
+                log.debug("Connection from %s established", address)
+                connections = self.connection_sampler()
+                if connections:
+                    log.info("%d connections accepted", connections)
+                
+                # Start a new thread to handle this client
+                client_thread = threading.Thread(target=self.serve_connection, args=(client_socket, address[0]))
+                client_thread.daemon = True
+                client_thread.start()
+            except KeyboardInterrupt:
+                # The first Ctrl+C lets the games finish, the second doesn't wait
+                if self.draining:
+                    raise
+                self.drain()
+    
+    def admit(self, address):
+        """Count a new connection in, returns why it is turned away or None."""
+        if self.accept_bucket is not None and not self.accept_bucket.take():
+            return 'rate'
+        with self.admission_lock:
+            if self.open_connections >= self.max_connections:
+                return 'capacity'
+            if self.max_per_ip is not None and self.connections_by_ip.get(address, 0) >= self.max_per_ip:
+                return 'per_ip'
+            self.open_connections += 1
+            self.connections_by_ip[address] = self.connections_by_ip.get(address, 0) + 1
+        return None
+    
+    def release(self, address):
+        with self.admission_lock:
+            self.open_connections -= 1
+            remaining = self.connections_by_ip[address] - 1
+            if remaining:
+                self.connections_by_ip[address] = remaining
+            else:
+                del self.connections_by_ip[address]
+    
+    def serve_connection(self, client_socket, address):
+        try:
+            self.handle_client(client_socket)
+        finally:
+            self.release(address)
+    
+    def reject(self, client_socket, address, reason):
+        # Runs on the accept thread, so nothing here may block or take the lock
+        self.metrics.inc('chess_connections_rejected_total', reason)
+        log.debug("Turned away %s: %s", address, reason)
+        rejections = self.rejection_sampler()
+        if rejections:
+            log.info("%d connections turned away, server busy", rejections)
+        
+        retry_after = BUSY_RETRY_AFTER
+        if reason == 'rate':
+            retry_after = max(1, math.ceil(self.accept_bucket.wait_time()))
+        retry_after = random.randint(retry_after, 2 * retry_after)
+        frame = self.busy_frames.get(retry_after)
+        if frame is None:
+            # Sent before any format is negotiated, so always JSON
+            frame = self.busy_frames[retry_after] = encode_message({
+                'type': 'server_busy',
+                'retry_after': retry_after,
+                'message': f'Server busy, try again in {retry_after} seconds'
+            })
+        
+        try:
+            client_socket.setblocking(False)
+            client_socket.send(frame)
+            client_socket.shutdown(socket.SHUT_WR)
+            # Closing with the handshake still unread would reset the
+            # connection, which can cost the client the frame
+            client_socket.recv(4096)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+    
+    def drain(self):
+        """Stop starting games, the server exits once the running ones are over."""
+        with self.lock:
+            if self.draining:
+                return
+            self.draining = True
+            log.info("Draining, waiting for %d games to finish (Ctrl+C again to stop now)", len(self.games))
+            
+            # Nobody is left waiting for a game that won't start here
+            with self.matchmaker.condition:
+                waiting = list(self.matchmaker.waiting)
+            for client_socket in waiting:
+                self.matchmaker.remove(client_socket)
+                self.send_message(client_socket, {'type': 'error', 'message': 'Server is restarting, no new games for now'})
+                self.update_presence(client_socket)
+    
+    def serve_control(self):
+        # Runs on its own thread and answers the first replacement that asks
+        while True:
+            try:
+                connection, address = self.control_socket.accept()
+            except OSError:
+                return
+            try:
+                connection.settimeout(5)
+                if connection.recv(len(HANDOVER_REQUEST)) == HANDOVER_REQUEST:
+                    self.hand_over(connection)
+                    return
+            except OSError as e:
+                log.warning("Handover failed: %s", e)
+            finally:
+                connection.close()
+    
+    def hand_over(self, connection):
+        started = time.perf_counter()
+        # From here on new connections wait in the backlog for the new process
+        self.stop_accepting.set()
+        self.accept_stopped.wait()
+        
+        # Never released: nothing changes after the snapshot, anything a
+        # client sends from now on is answered by the new process instead
+        self.lock.acquire()
+        state = self.build_handover_state()
+        
+        # Files the new process goes on writing
+        if self.journal is not None:
+            self.journal.close()
+        self.opening_tree.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        
+        send_handover(connection, self.server_socket, state)
+        log.info("Handed over %d games and %d seats in %.3fs",
+                 len(state['games']), len(state['seats']), time.perf_counter() - started)
+        
+        # Everyone reconnects, players resume their games with the new process
+        restarting = SharedMessage({'type': 'server_restarting'})
+        for client_socket, client in self.clients.items():
+            self.send_shared(client_socket, restarting)
+            client['outbox'].put(None)
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline and any(client['outbox'].qsize() for client in self.clients.values()):
+            time.sleep(0.05)
+        self.handover_done.set()
+    
+    def build_handover_state(self):
+        # Caller holds the lock
+        games = {}
+        seats = []
+        for game_id, entry in self.games.items():
+            games[game_id] = {
+                'players': entry['players'],
+                'game': pack_game(entry['game']),
+                'clock': pack_clock(entry['clock']) if entry['clock'] is not None else None
+            }
+            for color in ('white', 'black'):
+                client = self.clients.get(entry[color])
+                if client is not None:
+                    seats.append({'session': client['session'], 'username': client['username'],
+                                  'game': game_id, 'color': color, 'rating': client['rating']})
+        
+        # Players already away keep their seats too
+        for token, seat in self.suspended_sessions.items():
+            seats.append({'session': token, 'username': seat['username'], 'game': seat['game'],
+                          'color': seat['color'], 'rating': seat['rating']})
+        
+        return {
+            'games': games,
+            'seats': seats,
+            'recovered_players': self.recovered_players,
+            'ratings': self.ratings,
+            'next_game_id': int(self.matchmaker.next_game_id()),
+            'tournaments': {tournament_id: tournament.to_dict() for tournament_id, tournament in self.tournaments.items()},
+            'tournament_games': self.tournament_games,
+            'next_tournament_id': next(self.tournament_ids)
+        }
+    
+    def restore_handover(self, state):
+        # Runs before the server accepts anyone, so no locking needed
+        self.ratings.update(state['ratings'])
+        for game_id, saved in state['games'].items():
+            game = unpack_game(saved['game'])
+            entry = self.games[game_id] = {
+                'white': None,
+                'black': None,
+                'players': saved['players'],
+                'game': game,
+                'clock': None,
+                'flag_timer': None
+            }
+            if saved['clock'] is not None:
+                clock = entry['clock'] = unpack_clock(saved['clock'])
+                entry['flag_timer'] = self.timers.schedule(clock.flag_delay(), self.handle_flag, game_id, clock)
+            
+            self.spectators.game_started(game_id, {
+                'type': 'spectate_start',
+                'game_id': game_id,
+                'white': entry['players']['white'],
+                'black': entry['players']['black']
+            }, self.build_board_snapshot(game))
+        
+        # Every player gets their seat back by resuming their session here
+        grace = max(self.resume_grace, HANDOVER_RESUME_GRACE)
+        for seat in state['seats']:
+            token = seat.pop('session')
+            seat['timer'] = self.timers.schedule(grace, self.expire_session, token)
+            self.suspended_sessions[token] = seat
+            self.lobby.update(seat['username'], 'away', seat['rating'], None)
+        
+        # Games recovered from the journal that are still waiting for their players
+        self.recovered_players.update(state['recovered_players'])
+        for game_id in {seat['game'] for seat in state['recovered_players'].values()}:
+            self.timers.schedule(RECOVERY_GRACE_PERIOD, self.abandon_recovered_game, game_id)
         
-    def start(self):
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.matchmaker.skip_game_ids(state['next_game_id'] - 1)
+        self.tournament_games.update(state['tournament_games'])
+        self.tournament_ids = itertools.count(state['next_tournament_id'])
+        for tournament_id, saved in state['tournaments'].items():
+            tournament = self.tournaments[tournament_id] = Tournament.from_dict(saved)
+            if tournament.state == 'running' and not tournament.boards:
+                # Stopped between two rounds
+                self.timers.schedule(0, self.start_tournament_round, tournament_id)
         
+        log.info("Took over %d games and %d seats", len(state['games']), len(state['seats']))
+    
+    def print_banner(self):
         # Get and display IP addresses for connection
         hostname = socket.gethostname()
         local_ip = socket.gethostbyname(hostname)
@@ -55,51 +629,150 @@ class ChessServer:
         print(f"  python client.py --host <IP_ADDRESS> --port {self.port}")
         print("\nPress Ctrl+C to stop the server")
         print("=" * 50)
-        
-        try:
-            while True:
-                client_socket, address = self.server_socket.accept()
-                print(f"Connection from {address} established")
-                
-                # Start a new thread to handle this client
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
-                client_thread.daemon = True
-                client_thread.start()
-        except KeyboardInterrupt:
-            print("Server shutting down...")
-        finally:
-            self.server_socket.close()
     
-    def handle_client(self, client_socket):
+    def handle_client(self, client_socket, initial_data=b'', forwarded=False):
+        reader = MessageReader(max_frame_size=MAX_CLIENT_FRAME_SIZE)
+        capture_id = self.capture.connection() if self.capture is not None else None
         try:
-            # First message from client should be their username
-            username_data = client_socket.recv(1024).decode('utf-8')
-            username = json.loads(username_data)['username']
+            # First message from client should be their username, optionally
+            # asking for a wire format other than JSON. A connection forwarded
+            # from another worker comes with the bytes that worker already read.
+            # Connections that never say who they are don't get to keep a thread.
+            client_socket.settimeout(self.idle_timeout)
+            if capture_id is not None and initial_data:
+                self.capture.record(capture_id, TO_SERVER, initial_data)
+            received = bytearray(initial_data)  # As sent, in case it's passed on
+            messages = reader.feed(initial_data, limit=1)
+            while not messages:
+                data = client_socket.recv(1024)
+                if not data:
+                    return
+                if capture_id is not None:
+                    self.capture.record(capture_id, TO_SERVER, data)
+                received += data
+                messages = reader.feed(data, limit=1)
+            client_socket.settimeout(None)
+            handshake = messages[0]
+            username = handshake['username']
+            wire_format = handshake.get('format', FORMAT_JSON)
+            if wire_format not in WIRE_FORMATS:
+                wire_format = FORMAT_JSON
+            # Clients that can inflate our compressed frames say which kind
+            compression = handshake.get('compression')
+            if compression not in COMPRESSIONS:
+                compression = None
+            
+            # Resuming a session held by another worker, pass the connection over
+            resume = handshake.get('session') if handshake.get('type') == 'resume' else None
+            if resume and self.broker is not None and not forwarded:
+                owner = resume.partition('-')[0]
+                if owner.isdigit() and int(owner) != self.worker_id:
+                    self.forward_connection(client_socket, received, worker=int(owner))
+                    return
+            
+            handoff = handshake.get('handoff')
+            if handoff and self.broker is not None and not forwarded and not self.is_expected_handoff(handoff):
+                # Reconnected to join a game owned by another worker. Pass the
+                # connection over together with everything read from it so far.
+                self.forward_connection(client_socket, received, token=handoff)
+                return
+            
+            # Outgoing frames are queued and written by a dedicated thread, so
+            # nobody ever blocks on this socket while holding the server lock
+            outbox = queue.Queue()
+            writer_thread = threading.Thread(target=self.write_messages, args=(client_socket, outbox, capture_id))
+            writer_thread.daemon = True
+            
+            # Tokens name the worker that issued them so resumes find their way back
+            session = secrets.token_hex(16)
+            if self.worker_id is not None:
+                session = f"{self.worker_id}-{session}"
+            
+            if self.stop_accepting.is_set():
+                # Accepted just before a handover, log in with the new process
+                client_socket.sendall(encode_message({'type': 'server_restarting'}))
+                return
             
             with self.lock:
-                self.clients[client_socket] = {'username': username, 'game': None, 'color': None}
+                player_key = next(self.player_keys)
+                self.clients[client_socket] = {
+                    'username': username,
+                    'game': None,
+                    'color': None,
+                    'rating': self.ratings.get(username, DEFAULT_RATING),
+                    'outbox': outbox,
+                    'format': wire_format,
+                    'compress': compression is not None,
+                    'key': player_key,
+                    'spectating': None,
+                    'last_seen': time.monotonic(),
+                    'session': session,
+                    'chat_bucket': TokenBucket(self.chat_rate, self.chat_burst),
+                    'chat_throttled': False,
+                    'chat_pending': [],
+                    'chat_flush': None,
+                    'chat_sent': 0.0
+                }
+                client = self.clients[client_socket]
+                self.players_by_key[player_key] = client_socket
+                self.sessions[session] = client_socket
+                self.update_presence(client_socket)
+            writer_thread.start()
                 
-            # Inform client they have connected successfully
-            self.send_message(client_socket, {'type': 'connection_success', 'message': f'Welcome {username}!'})
+            # Inform client they have connected successfully. This reply is always
+            # JSON, everything after it uses the negotiated format.
+            self.send_frame(client_socket, encode_message({
+                'type': 'connection_success',
+                'message': f'Welcome {username}!',
+                'format': wire_format,
+                'compression': compression,
+                'heartbeat_interval': self.heartbeat_interval,
+                'session': session
+            }))
+            reader.set_format(wire_format)
+            
+            if resume:
+                self.resume_session(client_socket, resume, handshake.get('last_seq'))
+            elif handoff and self.broker is not None:
+                self.complete_handoff(client_socket, handoff)
+            elif username in self.recovered_players:
+                self.reattach_player(client_socket)
+            
+            # Messages that arrived in the same packet as the username
+            for message in reader.feed(b''):
+                self.process_message(client_socket, message)
             
             # Handle client communication
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
+                data = client_socket.recv(4096)
                 if not data:
                     break
+                if capture_id is not None:
+                    self.capture.record(capture_id, TO_SERVER, data)
                 
-                message = json.loads(data)
-                self.process_message(client_socket, message)
+                # Anything at all from the client, pongs included, shows it is alive
+                client['last_seen'] = time.monotonic()
+                for message in reader.feed(data):
+                    self.process_message(client_socket, message)
                 
         except json.JSONDecodeError:
-            print(f"Invalid JSON received from client")
+            log.warning("Invalid JSON received from client")
+        except FrameError as e:
+            log.warning("Dropping client: %s", e)
+        except socket.timeout:
+            log.info("Client never completed the handshake")
+        except ConnectionError as e:
+            log.debug("Client connection lost: %s", e)
         except Exception as e:
-            print(f"Error handling client: {e}")
+            log.exception("Error handling client: %s", e)
         finally:
+            if capture_id is not None:
+                self.capture.record(capture_id, CLOSED)
             self.disconnect_client(client_socket)
     
     def process_message(self, client_socket, message):
         message_type = message.get('type')
+        started = time.perf_counter()
         
         if message_type == 'find_game':
             self.find_game(client_socket)
@@ -109,106 +782,272 @@ class ChessServer:
             self.handle_resignation(client_socket)
         elif message_type == 'chat':
             self.handle_chat(client_socket, message.get('content'))
+        elif message_type == 'resync':
+            self.handle_resync(client_socket)
+        elif message_type == 'spectate':
+            self.handle_spectate(client_socket, message.get('game_id'), message.get('player'))
+        elif message_type == 'stop_spectating':
+            self.stop_spectating(client_socket)
+        elif message_type == 'history':
+            self.handle_history(client_socket, message)
+        elif message_type == 'find_position':
+            self.handle_find_position(client_socket, message)
+        elif message_type == 'explore':
+            self.handle_explore(client_socket, message)
+        elif message_type in TOURNAMENT_MESSAGES:
+            self.handle_tournament(client_socket, message_type, message)
+        elif message_type == 'lobby_subscribe':
+            self.lobby.subscribe(client_socket, message.get('since'))
+        elif message_type == 'lobby_unsubscribe':
+            self.lobby.unsubscribe(client_socket)
+        elif message_type == 'ping':
+            self.send_message(client_socket, {'type': 'pong'})
+        elif message_type != 'pong':
+            # Keeps made-up types from growing the label set
+            message_type = 'unknown'
+        
+        self.metrics.observe('chess_handler_seconds', time.perf_counter() - started, message_type)
+        self.metrics.inc('chess_messages_total', message_type)
     
     def find_game(self, client_socket):
         with self.lock:
             # Add client to waiting queue if not already in a game
-            if self.clients[client_socket]['game'] is None and client_socket not in self.waiting_queue:
-                self.waiting_queue.append(client_socket)
+            client = self.clients[client_socket]
+            if self.draining:
+                self.send_message(client_socket, {'type': 'error', 'message': 'Server is restarting, no new games for now'})
+                return
+            if client['game'] is None and self.enqueue_player(client_socket):
                 self.send_message(client_socket, {'type': 'queue', 'message': 'Looking for opponent...'})
-                print(f"Added client {self.clients[client_socket]['username']} to waiting queue")
-                
-                # Check if we can match two players
-                if len(self.waiting_queue) >= 2:
-                    # Use a separate thread for matchmaking to avoid blocking
-                    match_thread = threading.Thread(target=self.match_players)
-                    match_thread.daemon = True
-                    match_thread.start()
-                    print("Started matchmaking thread")
-    
-    def match_players(self):
+                self.update_presence(client_socket)
+                log.debug("Added client %s to waiting queue", self.clients[client_socket]['username'])
+    
+    def enqueue_player(self, client_socket):
+        client = self.clients[client_socket]
+        if self.broker is not None:
+            # Pairing happens in the broker so players on any worker can meet.
+            # The broker ignores players that are already queued.
+            self.broker.send({'type': 'enqueue', 'player': client['key'], 'rating': client['rating']})
+            return True
+        return self.matchmaker.enqueue(client_socket, client['rating'])
+    
+    def forward_connection(self, client_socket, received, **target):
+        # The bytes go over exactly as the client sent them, so they're never
+        # more than one broker packet holds
+        if len(received) > MAX_FORWARDED_DATA:
+            log.warning("Not forwarding a connection that sent %d bytes before its handshake", len(received))
+            return
+        self.broker.send(dict(target, type='forward', data=encode_handoff_data(bytes(received))), [client_socket.fileno()])
+    
+    def handle_broker_message(self, message, fds):
+        # Called from the broker link's reader thread
+        message_type = message.get('type')
+        
+        if message_type == 'match':
+            self.handle_broker_match(message)
+        elif message_type == 'forward' and fds:
+            # A player of one of our games landed on another worker
+            client_socket = socket.socket(fileno=fds[0])
+            client_thread = threading.Thread(
+                target=self.handle_client,
+                args=(client_socket, decode_handoff_data(message['data']), True)
+            )
+            client_thread.daemon = True
+            client_thread.start()
+    
+    def handle_broker_match(self, message):
+        game_id = message['game_id']
+        owner = message['owner'] == self.worker_id
+        local_players = []
+        
         with self.lock:
-            # Verify we have at least 2 players
-            if len(self.waiting_queue) < 2:
-                print("Not enough players in queue for matchmaking")
+            for player in message['players']:
+                if player['worker'] != self.worker_id:
+                    # The other player moves over to us with this token
+                    if owner:
+                        self.expected_handoffs[player['token']] = (game_id, player['rating'])
+                    continue
+                
+                client_socket = self.players_by_key.get(player['player'])
+                if client_socket is None:
+                    continue
+                if owner:
+                    local_players.append(client_socket)
+                else:
+                    # The game lives on another worker, reconnect there
+                    self.send_message(client_socket, {'type': 'handoff', 'token': player['token']})
+            
+            if not owner:
+                return
+            
+            remote_tokens = [player['token'] for player in message['players'] if 'token' in player]
+            if len(local_players) + len(remote_tokens) < 2:
+                # A local player left before the match arrived
+                for client_socket in local_players:
+                    self.enqueue_player(client_socket)
+                for token in remote_tokens:
+                    self.expected_handoffs.pop(token, None)
                 return
             
-            # Get two clients from the waiting queue
-            client1 = self.waiting_queue.pop(0)
-            client2 = self.waiting_queue.pop(0)
+            if remote_tokens:
+                self.pending_games[game_id] = {'local': local_players[0], 'token': remote_tokens[0]}
+        
+        if not remote_tokens:
+            self.match_players(local_players[0], local_players[1], game_id)
+            return
+        
+        # Give up on the other player if they never show up
+        self.timers.schedule(HANDOFF_TIMEOUT, self.expire_handoff, game_id)
+    
+    def is_expected_handoff(self, token):
+        with self.lock:
+            return token in self.expected_handoffs
+    
+    def complete_handoff(self, client_socket, token):
+        with self.lock:
+            game_id, rating = self.expected_handoffs.pop(token, (None, None))
+            pending = self.pending_games.pop(game_id, None)
+            if rating is not None:
+                # Ratings live with the worker the player came from
+                self.clients[client_socket]['rating'] = self.ratings[self.clients[client_socket]['username']] = rating
+            
+            if pending is None or pending['local'] not in self.clients:
+                # Opponent is gone, keep looking
+                self.enqueue_player(client_socket)
+                self.send_message(client_socket, {'type': 'queue', 'message': 'Looking for opponent...'})
+                return
+        
+        self.match_players(pending['local'], client_socket, game_id)
+    
+    def expire_handoff(self, game_id):
+        with self.lock:
+            pending = self.pending_games.pop(game_id, None)
+            if pending is None:
+                return
             
-            print(f"Matching players: {self.clients[client1]['username']} and {self.clients[client2]['username']}")
+            self.expected_handoffs.pop(pending['token'], None)
+            if pending['local'] in self.clients:
+                self.enqueue_player(pending['local'])
+    
+    def match_players(self, client1, client2, game_id, colors=None):
+        # Called from the matchmaker's pairing thread, or for a tournament
+        # board with the colors already decided
+        with self.lock:
+            # Either player may have disconnected, or got into another game,
+            # since being queued
+            available = [client_socket in self.clients and self.clients[client_socket]['game'] is None
+                         for client_socket in (client1, client2)]
+            if not all(available):
+                if game_id in self.tournament_games:
+                    # Whoever can't play loses the board
+                    white_score, black_score = available if colors[0] == 'white' else available[::-1]
+                    self.score_tournament_game(game_id, float(white_score), float(black_score))
+                    return
+                for client_socket, ready in zip((client1, client2), available):
+                    if ready:
+                        self.enqueue_player(client_socket)
+                return
             
-            # Create a unique game ID
-            game_id = str(random.randint(1000, 9999))
+            log.debug("Matching players: %s and %s", self.clients[client1]['username'], self.clients[client2]['username'])
             
             # Create a new chess game
             game = ChessGame()
+            self.metrics.inc('chess_games_started_total')
+            
+            # Randomly assign colors, unless they were decided for us
+            if colors is None:
+                colors = ['white', 'black']
+                random.shuffle(colors)
             
-            # Randomly assign colors
-            colors = ['white', 'black']
-            random.shuffle(colors)
+            # Players stop watching other games once they play their own
+            for client_socket in (client1, client2):
+                if self.clients[client_socket]['spectating'] is not None:
+                    self.stop_spectating(client_socket)
             
             # Update client information
             self.clients[client1]['game'] = game_id
             self.clients[client1]['color'] = colors[0]
             self.clients[client2]['game'] = game_id
             self.clients[client2]['color'] = colors[1]
+            self.update_presence(client1)
+            self.update_presence(client2)
             
             # Store game information
+            white_client = client1 if colors[0] == 'white' else client2
+            black_client = client2 if colors[0] == 'white' else client1
+            players = {
+                'white': self.clients[white_client]['username'],
+                'black': self.clients[black_client]['username']
+            }
             self.games[game_id] = {
-                'white': client1 if colors[0] == 'white' else client2,
-                'black': client2 if colors[0] == 'white' else client1,
-                'game': game
+                'white': white_client,
+                'black': black_client,
+                'players': players,
+                'game': game,
+                'clock': None,
+                'flag_timer': None
             }
+            
+            if self.time_control is not None:
+                clock = self.games[game_id]['clock'] = GameClock(*self.time_control)
+                self.games[game_id]['flag_timer'] = self.timers.schedule(clock.flag_delay(), self.handle_flag, game_id, clock)
+            
+            if self.journal is not None:
+                self.journal.record_start(game_id, players['white'], players['black'], game.start_time)
+            
+            # Spectators can join from here on
+            self.spectators.game_started(game_id, {
+                'type': 'spectate_start',
+                'game_id': game_id,
+                'white': players['white'],
+                'black': players['black']
+            }, self.build_board_snapshot(game))
         
         # Outside the lock to avoid potential deadlocks with send_message
         try:
             # Send game_start notifications first
-            print(f"Sending game_start to {self.clients[client1]['username']} as {colors[0]}")
+            clock = self.games[game_id]['clock']
+            
+            log.debug("Sending game_start to %s as %s", self.clients[client1]['username'], colors[0])
             success1 = self.send_message(client1, {
                 'type': 'game_start',
                 'color': colors[0],
-                'opponent': self.clients[client2]['username']
+                'opponent': self.clients[client2]['username'],
+                'rating': self.clients[client1]['rating'],
+                'opponent_rating': self.clients[client2]['rating'],
+                'clock': clock.to_dict() if clock else None
             })
             
-            print(f"Sending game_start to {self.clients[client2]['username']} as {colors[1]}")
+            log.debug("Sending game_start to %s as %s", self.clients[client2]['username'], colors[1])
             success2 = self.send_message(client2, {
                 'type': 'game_start',
                 'color': colors[1],
-                'opponent': self.clients[client1]['username']
+                'opponent': self.clients[client1]['username'],
+                'rating': self.clients[client2]['rating'],
+                'opponent_rating': self.clients[client1]['rating'],
+                'clock': clock.to_dict() if clock else None
             })
             
             # If either message failed, clean up the game
             if not (success1 and success2):
-                print("Failed to send game_start messages. Cleaning up game.")
+                log.warning("Failed to send game_start messages. Cleaning up game.")
                 with self.lock:
                     self.cleanup_game(game_id)
                 return
             
-            # Small delay to ensure game_start messages are processed first
-            time.sleep(0.1)
-            
-            # Send initial board state to both players
-            board_state = game.get_board_state()
-            
-            print(f"Sending board_state to {self.clients[client1]['username']}")
-            self.send_message(client1, {
-                'type': 'board_state',
-                'board': board_state,
-                'turn': game.get_current_turn()
-            })
+            # Send initial board state to both players. This full snapshot is
+            # the base every later move delta is applied to. Outboxes are FIFO,
+            # so it always arrives after game_start.
+            board_message = SharedMessage(self.build_board_snapshot(game))
             
-            print(f"Sending board_state to {self.clients[client2]['username']}")
-            self.send_message(client2, {
-                'type': 'board_state',
-                'board': board_state,
-                'turn': game.get_current_turn()
-            })
+            log.debug("Sending board_state to %s and %s", self.clients[client1]['username'], self.clients[client2]['username'])
+            self.broadcast([client1, client2], board_message)
             
-            print(f"Game {game_id} successfully started")
+            log.debug("Game %s successfully started", game_id)
+            games = self.game_sampler()
+            if games:
+                log.info("%d games started", games)
         except Exception as e:
-            print(f"Error during matchmaking: {e}")
+            log.error("Error during matchmaking: %s", e)
             # Clean up the game if something went wrong
             with self.lock:
                 self.cleanup_game(game_id)
@@ -229,45 +1068,59 @@ class ChessServer:
                 self.send_message(client_socket, {'type': 'error', 'message': 'Not your turn'})
                 return
             
+            # A move arriving after the flag fell, before the timer fired, loses on time
+            clock = self.games[game_id]['clock']
+            if clock is not None and clock.time_left(player_color) <= 0:
+                self.flag_game(game_id)
+                return
+            
             # Make the move
             move_result = game.make_move(from_pos, to_pos)
             
             if move_result['valid']:
+                if clock is not None:
+                    # The opponent's clock runs from here, rearm the flag timer for it
+                    clock.press()
+                    self.timers.cancel(self.games[game_id]['flag_timer'])
+                    self.games[game_id]['flag_timer'] = self.timers.schedule(clock.flag_delay(), self.handle_flag, game_id, clock)
+                
+                if self.journal is not None:
+                    last_move = game.move_history[-1]
+                    self.journal.record_move(game_id, last_move['from'], last_move['to'])
+                
                 # Get opponent socket
                 opponent = self.games[game_id]['white'] if player_color == 'black' else self.games[game_id]['black']
                 
-                # Update both players with new board state
-                board_state = game.get_board_state()
+                # Update both players with just the move. Clients replay it on
+                # their own board and check the result against the position hash,
+                # asking for a full snapshot (resync) if anything disagrees.
                 game_status = game.get_game_status()
+                game_info = self.build_game_info(game)
                 
-                # Additional game information
-                game_info = {
-                    'move_count': game.get_move_count(),
-                    'duration': game.get_formatted_duration(),
-                    'points': {
-                        'white': game.get_points('white'),
-                        'black': game.get_points('black')
-                    }
-                }
-                
-                self.send_message(client_socket, {
-                    'type': 'move_result',
-                    'valid': True,
-                    'board': board_state,
+                move_update = {
+                    'move': game.get_move_delta(),
+                    'seq': game.get_move_count(),
+                    'hash': game.get_position_hash(),
                     'turn': game.get_current_turn(),
-                    'status': game_status,
                     'game_info': game_info
-                })
+                }
+                if clock is not None:
+                    move_update['clock'] = clock.to_dict()
                 
-                self.send_message(opponent, {
-                    'type': 'opponent_move',
-                    'from': from_pos,
-                    'to': to_pos,
-                    'board': board_state,
-                    'turn': game.get_current_turn(),
-                    'status': game_status,
-                    'game_info': game_info
-                })
+                # Status is only worth its bytes when there is check or the game ended
+                if game_status['game_over'] or any(game_status['check'].values()):
+                    move_update['status'] = game_status
+                
+                # Encoded once, only the type differs between the two players
+                move_message = SharedMessage(move_update)
+                self.send_shared(client_socket, move_message, type='move_result', valid=True)
+                self.send_shared(opponent, move_message, type='opponent_move')
+                
+                # Spectators get the same body, fanned out on the feed's own thread.
+                # Every so often it also gets a snapshot for late joiners.
+                seq = move_update['seq']
+                snapshot = self.build_board_snapshot(game) if seq % self.spectators.snapshot_interval == 0 else None
+                self.spectators.publish_move(game_id, move_message, snapshot)
                 
                 # Check if game is over
                 if game_status['game_over']:
@@ -280,6 +1133,240 @@ class ChessServer:
                     'message': move_result.get('message', 'Invalid move')
                 })
     
+    def handle_resync(self, client_socket):
+        with self.lock:
+            game_id = self.clients[client_socket]['game'] or self.clients[client_socket]['spectating']
+            
+            if game_id not in self.games:
+                return
+            
+            # Client's board disagrees with ours, send a full snapshot
+            game = self.games[game_id]['game']
+            self.send_message(client_socket, self.build_board_snapshot(game))
+    
+    def handle_spectate(self, client_socket, game_id=None, player=None):
+        with self.lock:
+            client = self.clients[client_socket]
+            if client['game'] is not None:
+                self.send_message(client_socket, {'type': 'error', 'message': 'Already in a game'})
+                return
+            
+            # Watching a player by name saves looking up their game ID
+            if game_id is None and player is not None:
+                game_id = next((other['game'] for other in self.clients.values()
+                                if other['username'] == player and other['game'] is not None), None)
+            
+            if game_id is None or str(game_id) not in self.games:
+                self.send_message(client_socket, {'type': 'error', 'message': 'Game not found'})
+                return
+            
+            # The feed sends the latest snapshot and the moves since, then
+            # keeps the spectator up to date
+            client['spectating'] = str(game_id)
+            self.spectators.subscribe(client_socket, client['spectating'], client['outbox'], client['format'],
+                                       client['compress'])
+            self.update_presence(client_socket)
+    
+    def handle_history(self, client_socket, message):
+        if self.archive is None:
+            self.send_message(client_socket, {'type': 'error', 'message': 'No game archive on this server'})
+            return
+        
+        # Runs on this client's own thread without the server lock, so a slow
+        # query never holds up anybody's game
+        username = message.get('player') or self.clients[client_socket]['username']
+        limit = client_int(message.get('limit', 20))
+        before = message.get('before')  # started_at of the last game the client has
+        valid_before = before is None or (isinstance(before, (int, float)) and not isinstance(before, bool))
+        if limit is None or not isinstance(username, str) or not valid_before:
+            self.send_message(client_socket, {'type': 'error', 'message': 'Invalid history request'})
+            return
+        limit = max(1, min(limit, 100))
+        games = self.archive.player_history(username, limit, before)
+        
+        with self.lock:
+            self.send_message(client_socket, {'type': 'history', 'player': username, 'games': games})
+    
+    def handle_find_position(self, client_socket, message):
+        if self.archive is None:
+            self.send_message(client_socket, {'type': 'error', 'message': 'No game archive on this server'})
+            return
+        
+        # Same as history, the lookup runs without the server lock
+        position_hash = client_int(message.get('hash'))
+        limit = client_int(message.get('limit', 50))
+        if position_hash is None or not 0 <= position_hash < 1 << 64 or limit is None:
+            self.send_message(client_socket, {'type': 'error', 'message': 'Invalid position search'})
+            return
+        limit = max(1, min(limit, 500))
+        games = self.archive.find_position(position_hash, limit)
+        
+        with self.lock:
+            self.send_message(client_socket, {'type': 'position_games', 'hash': position_hash, 'games': games})
+    
+    def handle_explore(self, client_socket, message):
+        # Opening explorer, defaults to the position of the client's own game
+        position_hash = message.get('hash')
+        with self.lock:
+            if position_hash is None:
+                game_id = self.clients[client_socket]['game'] or self.clients[client_socket]['spectating']
+                if game_id not in self.games:
+                    self.send_message(client_socket, {'type': 'error', 'message': 'No position to explore'})
+                    return
+                position_hash = self.games[game_id]['game'].get_position_hash()
+            else:
+                position_hash = client_int(position_hash)
+                if position_hash is None or not 0 <= position_hash < 1 << 64:
+                    self.send_message(client_socket, {'type': 'error', 'message': 'Invalid position hash'})
+                    return
+        
+        moves = self.opening_tree.explore(position_hash)
+        with self.lock:
+            self.send_message(client_socket, {'type': 'explore', 'hash': position_hash, 'moves': moves})
+    
+    def stop_spectating(self, client_socket):
+        client = self.clients.get(client_socket)
+        if client is not None:
+            client['spectating'] = None
+            self.update_presence(client_socket)
+        self.spectators.unsubscribe(client_socket)
+    
+    def spectator_dropped(self, client_socket, game_id):
+        # The feed already let them go, only our side of it is left
+        with self.lock:
+            client = self.clients.get(client_socket)
+            if client is not None and client['spectating'] == game_id:
+                client['spectating'] = None
+                self.update_presence(client_socket)
+    
+    def recover_games(self):
+        # Runs before the server accepts anyone, so no locking needed
+        started = time.perf_counter()
+        recovered = recover_games(self.journal.path)
+        
+        for game_id, entry in recovered.items():
+            game = entry['game']
+            self.games[game_id] = {
+                'white': None,
+                'black': None,
+                'players': {'white': entry['white'], 'black': entry['black']},
+                'game': game,
+                'clock': None,  # Clocks aren't journaled, recovered games continue untimed
+                'flag_timer': None
+            }
+            for color, opponent_color in (('white', 'black'), ('black', 'white')):
+                self.recovered_players[entry[color]] = {
+                    'game': game_id,
+                    'color': color,
+                    'opponent': entry[opponent_color],
+                    'chat': entry['chat']
+                }
+            
+            self.spectators.game_started(game_id, {
+                'type': 'spectate_start',
+                'game_id': game_id,
+                'white': entry['white'],
+                'black': entry['black']
+            }, self.build_board_snapshot(game))
+            
+            # Seats nobody comes back for are given up eventually
+            self.timers.schedule(RECOVERY_GRACE_PERIOD, self.abandon_recovered_game, game_id)
+        
+        # Start the journal over with just the games that are still going
+        compact_journal(self.journal.path, recovered)
+        
+        game_numbers = [int(game_id) for game_id in recovered if game_id.isdigit()]
+        if game_numbers:
+            self.matchmaker.skip_game_ids(max(game_numbers))
+        
+        log.info("Recovered %s games from %s in %.2fs", len(recovered), self.journal.path, time.perf_counter() - started)
+    
+    def reattach_player(self, client_socket):
+        with self.lock:
+            client = self.clients[client_socket]
+            seat = self.recovered_players.pop(client['username'], None)
+            if seat is None or seat['game'] not in self.games:
+                return
+            
+            game_id = seat['game']
+            color = seat['color']
+            if self.games[game_id][color] is not None:
+                return
+            
+            # Back in the game it was playing before the restart
+            self.games[game_id][color] = client_socket
+            client['game'] = game_id
+            client['color'] = color
+            self.update_presence(client_socket)
+            
+            self.send_message(client_socket, {
+                'type': 'game_start',
+                'color': color,
+                'opponent': seat['opponent'],
+                'rating': client['rating'],
+                'opponent_rating': self.ratings.get(seat['opponent'], DEFAULT_RATING),
+                'resumed': True
+            })
+            self.send_message(client_socket, self.build_board_snapshot(self.games[game_id]['game']))
+            if seat['chat']:
+                self.send_message(client_socket, {
+                    'type': 'chat',
+                    'messages': [{'sender': sender, 'content': content} for sender, content in seat['chat']]
+                })
+            
+            log.info("Player %s rejoined recovered game %s as %s", client['username'], game_id, color)
+    
+    def abandon_recovered_game(self, game_id):
+        with self.lock:
+            if game_id not in self.games:
+                return
+            
+            entry = self.games[game_id]
+            if entry['white'] is not None and entry['black'] is not None:
+                return
+            
+            # Whoever made it back wins, otherwise there is no result
+            if entry['white'] is not None or entry['black'] is not None:
+                winner = 'white' if entry['white'] is not None else 'black'
+            else:
+                winner = None
+            
+            game_over_message = SharedMessage({
+                'type': 'game_over',
+                'result': 'opponent_abandoned',
+                'winner': winner,
+                'game_info': self.build_game_info(entry['game'])
+            })
+            self.broadcast([entry['white'], entry['black']], game_over_message)
+            
+            for username, seat in list(self.recovered_players.items()):
+                if seat['game'] == game_id:
+                    del self.recovered_players[username]
+            # Left out of ratings and the opening tree, nobody finished it over the board
+            self.cleanup_game(game_id, game_over_message)
+    
+    def build_game_info(self, game):
+        # Additional game information
+        return {
+            'move_count': game.get_move_count(),
+            'duration': game.get_formatted_duration(),
+            'points': {
+                'white': game.get_points('white'),
+                'black': game.get_points('black')
+            }
+        }
+    
+    def build_board_snapshot(self, game):
+        return {
+            'type': 'board_state',
+            'board': game.get_board_state(),
+            'turn': game.get_current_turn(),
+            'seq': game.get_move_count(),
+            'hash': game.get_position_hash(),
+            # Part of the hash, the client can't tell from the board alone
+            'en_passant': list(game.en_passant_target) if game.en_passant_target else None
+        }
+    
     def handle_resignation(self, client_socket):
         with self.lock:
             game_id = self.clients[client_socket]['game']
@@ -294,78 +1381,461 @@ class ChessServer:
             # Get opponent socket
             opponent = self.games[game_id]['white'] if player_color == 'black' else self.games[game_id]['black']
             
-            # Additional game information
-            game_info = {
-                'move_count': game.get_move_count(),
-                'duration': game.get_formatted_duration(),
-                'points': {
-                    'white': game.get_points('white'),
-                    'black': game.get_points('black')
-                }
-            }
-            
-            # Notify both players
-            self.send_message(client_socket, {
-                'type': 'game_over',
-                'result': 'resignation',
+            # Notify both players, only the result wording differs
+            game_over_message = SharedMessage({
                 'winner': winner_color,
-                'game_info': game_info
-            })
-            
-            self.send_message(opponent, {
-                'type': 'game_over',
-                'result': 'opponent_resigned',
-                'winner': winner_color,
-                'game_info': game_info
+                'game_info': self.build_game_info(game)
             })
+            self.send_shared(client_socket, game_over_message, type='game_over', result='resignation')
+            self.send_shared(opponent, game_over_message, type='game_over', result='opponent_resigned')
             
             # Clean up game
-            self.cleanup_game(game_id)
+            self.opening_tree.record_game(game.move_history, winner_color)
+            self.update_ratings(game_id, winner_color)
+            self.cleanup_game(game_id, game_over_message, type='game_over', result='resignation')
     
-    def handle_game_over(self, game_id, status, game_info):
-        white_client = self.games[game_id]['white']
-        black_client = self.games[game_id]['black']
+    def resume_session(self, client_socket, token, last_seq):
+        # A live connection still holding the session is a half-open leftover
+        # the heartbeat hasn't caught yet, retire it so its seat is free
+        with self.lock:
+            stale_socket = self.sessions.get(token)
+        if stale_socket is not None and stale_socket is not client_socket:
+            self.disconnect_client(stale_socket)
+            try:
+                stale_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        
+        with self.lock:
+            client = self.clients[client_socket]
+            seat = self.suspended_sessions.get(token)
+            if seat is None or seat['username'] != client['username']:
+                self.send_message(client_socket, {'type': 'resume_failed', 'message': 'Session expired'})
+                return
+            if seat['game'] not in self.games:
+                self.send_message(client_socket, {'type': 'resume_failed', 'message': 'The game ended while you were away'})
+                return
+            
+            del self.suspended_sessions[token]
+            self.timers.cancel(seat['timer'])
+            
+            # The new connection takes over the old session and seat
+            del self.sessions[client['session']]
+            client['session'] = token
+            self.sessions[token] = client_socket
+            
+            game_id = seat['game']
+            color = seat['color']
+            entry = self.games[game_id]
+            game = entry['game']
+            entry[color] = client_socket
+            client['game'] = game_id
+            client['color'] = color
+            client['rating'] = seat['rating']
+            self.update_presence(client_socket)
+            
+            opponent_color = 'black' if color == 'white' else 'white'
+            resumed = {
+                'type': 'session_resumed',
+                'session': token,
+                'game_id': game_id,
+                'color': color,
+                'opponent': entry['players'][opponent_color],
+                'seq': game.get_move_count(),
+                'hash': game.get_position_hash(),
+                'turn': game.get_current_turn(),
+                'game_info': self.build_game_info(game)
+            }
+            if entry['clock'] is not None:
+                resumed['clock'] = entry['clock'].to_dict()
+            
+            # Only the moves the client missed, in one message. A client that
+            # can't say where it left off gets the whole board instead.
+            if isinstance(last_seq, int) and 0 <= last_seq <= game.get_move_count():
+                resumed['moves'] = [game.get_move_delta(index) for index in range(last_seq, game.get_move_count())]
+                self.send_message(client_socket, resumed)
+            else:
+                self.send_message(client_socket, resumed)
+                self.send_message(client_socket, self.build_board_snapshot(game))
+            
+            self.send_message(entry[opponent_color], {'type': 'opponent_back'})
+            log.info("Player %s resumed game %s", client['username'], game_id)
+    
+    def expire_session(self, token):
+        # Called from the timer thread when a dropped player didn't come back
+        with self.lock:
+            seat = self.suspended_sessions.pop(token, None)
+            if seat is None or seat['game'] not in self.games:
+                return
+            if self.games[seat['game']][seat['color']] is not None:
+                return
+            
+            log.info("Player %s did not return to game %s", seat['username'], seat['game'])
+            self.lobby.remove(seat['username'], None)
+            self.forfeit_game(seat['game'], seat['color'])
+    
+    def forfeit_game(self, game_id, player_color):
+        winner_color = 'black' if player_color == 'white' else 'white'
+        opponent = self.games[game_id][winner_color]
         
-        self.send_message(white_client, {
+        # Notify opponent
+        self.send_message(opponent, {
             'type': 'game_over',
-            'result': status['result'],
-            'winner': status['winner'],
-            'game_info': game_info
+            'result': 'opponent_disconnected',
+            'winner': winner_color
+        })
+        
+        # Clean up game
+        self.opening_tree.record_game(self.games[game_id]['game'].move_history, winner_color)
+        self.update_ratings(game_id, winner_color)
+        self.cleanup_game(game_id, SharedMessage({
+            'type': 'game_over',
+            'result': 'player_disconnected',
+            'winner': winner_color
+        }))
+    
+    def check_heartbeats(self):
+        # Runs on the timer thread every heartbeat interval
+        now = time.monotonic()
+        dead = []
+        with self.lock:
+            for client_socket, client in self.clients.items():
+                idle = now - client['last_seen']
+                if idle >= self.idle_timeout:
+                    dead.append((client_socket, client['username']))
+                elif idle >= self.heartbeat_interval:
+                    self.send_shared(client_socket, self.ping_message)
+        
+        for client_socket, username in dead:
+            log.info("Client %s timed out", username)
+            self.disconnect_client(client_socket)
+            # Wakes the reader thread from recv() and the writer from a
+            # sendall() that a dead peer will never drain
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        
+        self.timers.schedule(self.heartbeat_interval, self.check_heartbeats)
+    
+    def handle_flag(self, game_id, clock):
+        # Called from the timer thread when the player to move runs out of time
+        with self.lock:
+            entry = self.games.get(game_id)
+            if entry is None or entry['clock'] is not clock:
+                return
+            self.flag_game(game_id)
+    
+    def flag_game(self, game_id):
+        entry = self.games[game_id]
+        clock = entry['clock']
+        clock.stop()
+        loser = clock.turn
+        winner = 'black' if loser == 'white' else 'white'
+        
+        game = entry['game']
+        game.end_time = time.time()
+        
+        game_over_message = SharedMessage({
+            'type': 'game_over',
+            'result': 'timeout',
+            'winner': winner,
+            'clock': clock.to_dict(),
+            'game_info': self.build_game_info(game)
         })
+        self.broadcast([entry['white'], entry['black']], game_over_message)
+        log.debug("Game %s: %s ran out of time", game_id, entry['players'][loser])
         
-        self.send_message(black_client, {
+        self.opening_tree.record_game(game.move_history, winner)
+        self.update_ratings(game_id, winner)
+        self.cleanup_game(game_id, game_over_message)
+    
+    def handle_game_over(self, game_id, status, game_info):
+        white_client = self.games[game_id]['white']
+        black_client = self.games[game_id]['black']
+        
+        # Both players and all spectators get the very same bytes
+        game_over_message = SharedMessage({
             'type': 'game_over',
             'result': status['result'],
             'winner': status['winner'],
             'game_info': game_info
         })
+        self.broadcast([white_client, black_client], game_over_message)
         
         # Clean up game
-        self.cleanup_game(game_id)
+        self.opening_tree.record_game(self.games[game_id]['game'].move_history, status['winner'])
+        self.update_ratings(game_id, status['winner'])
+        self.cleanup_game(game_id, game_over_message)
+    
+    def handle_tournament(self, client_socket, message_type, message):
+        start_round = None
+        with self.lock:
+            client = self.clients[client_socket]
+            username = client['username']
+            
+            if message_type == 'tournament_list':
+                self.send_message(client_socket, {
+                    'type': 'tournament_list',
+                    'tournaments': [tournament.summary() for tournament in self.tournaments.values()
+                                    if tournament.state != 'finished']
+                })
+                return
+            
+            if message_type == 'tournament_create':
+                system = message.get('system', SWISS)
+                rounds = message.get('rounds')
+                if system not in TOURNAMENT_SYSTEMS or not (rounds is None or (isinstance(rounds, int) and rounds > 0)):
+                    self.send_message(client_socket, {'type': 'error', 'message': 'Invalid tournament settings'})
+                    return
+                tournament_id = str(next(self.tournament_ids))
+                name = str(message.get('name') or f'Tournament {tournament_id}')[:60]
+                tournament = self.tournaments[tournament_id] = Tournament(tournament_id, name, system, rounds, username)
+                tournament.join(username, client['rating'])
+                self.send_message(client_socket, {'type': 'tournament', **tournament.summary()})
+                log.info("%s created tournament %s (%s)", username, tournament_id, system)
+                return
+            
+            tournament = self.tournaments.get(str(message.get('tournament')))
+            if tournament is None:
+                self.send_message(client_socket, {'type': 'error', 'message': 'Tournament not found'})
+                return
+            
+            if message_type == 'tournament_standings':
+                self.send_message(client_socket, self.build_standings(tournament))
+                return
+            
+            if message_type == 'tournament_join':
+                done = tournament.join(username, client['rating'])
+                failure = 'Tournament already started'
+            elif message_type == 'tournament_leave':
+                done = tournament.withdraw(username)
+                failure = 'Not playing in this tournament'
+            else:
+                done = tournament.creator == username and tournament.start()
+                failure = 'Only the creator can start a tournament, once two players have joined'
+                if done:
+                    start_round = tournament.tournament_id
+                    log.info("Tournament %s started with %d players", start_round, len(tournament.players))
+            
+            if not done:
+                self.send_message(client_socket, {'type': 'error', 'message': failure})
+                return
+            self.send_message(client_socket, {'type': 'tournament', **tournament.summary()})
+        
+        if start_round is not None:
+            self.start_tournament_round(start_round)
+    
+    def start_tournament_round(self, tournament_id):
+        # Called without the lock, when the tournament starts or from the timer
+        # thread once the previous round is over
+        with self.lock:
+            tournament = self.tournaments[tournament_id]
+            if self.draining:
+                # The next round is played on the server that takes over
+                return
+            
+            # Entrants who have left since the last round aren't paired again
+            online = {client['username']: client_socket for client_socket, client in self.clients.items()}
+            for name in tournament.players:
+                if name not in online:
+                    tournament.withdraw(name)
+            
+            paired = tournament.next_round(lambda round_number, board: f't{tournament_id}-{round_number}-{board}')
+            if paired is None:
+                if tournament.state == 'finished':
+                    self.broadcast(self.tournament_entrants(tournament), SharedMessage(self.build_standings(tournament)))
+                    log.info("Tournament %s finished", tournament_id)
+                return
+            pairings, bye = paired
+            
+            boards = []
+            forfeits = []
+            for white, black, game_id in pairings:
+                self.tournament_games[game_id] = tournament_id
+                # Players who are gone, withdrew or are busy in another game lose the board
+                present = [name in online and self.clients[online[name]]['game'] is None
+                           and not tournament.players[name]['withdrawn'] for name in (white, black)]
+                if all(present):
+                    for name in (white, black):
+                        self.matchmaker.remove(online[name])
+                    boards.append((online[white], online[black], game_id))
+                else:
+                    forfeits.append((game_id, present))
+            
+            self.broadcast(self.tournament_entrants(tournament), SharedMessage({
+                'type': 'tournament_round',
+                'tournament': tournament_id,
+                'round': tournament.round,
+                'pairings': [{'white': white, 'black': black, 'game_id': game_id} for white, black, game_id in pairings],
+                'bye': bye
+            }))
+            for game_id, present in forfeits:
+                self.score_tournament_game(game_id, float(present[0]), float(present[1]))
+        
+        # Each board is started like any other game, white first
+        for white_client, black_client, game_id in boards:
+            self.match_players(white_client, black_client, game_id, colors=['white', 'black'])
+    
+    def score_tournament_game(self, game_id, white_score, black_score):
+        # Caller holds the lock
+        tournament_id = self.tournament_games.pop(game_id, None)
+        tournament = self.tournaments.get(tournament_id)
+        if tournament is None or not tournament.record_result(game_id, white_score, black_score):
+            return
+        
+        # That was the round's last board, the next round starts right away
+        self.broadcast(self.tournament_entrants(tournament), SharedMessage(self.build_standings(tournament)))
+        self.timers.schedule(0, self.start_tournament_round, tournament_id)
+    
+    def tournament_entrants(self, tournament):
+        return [client_socket for client_socket, client in self.clients.items() if client['username'] in tournament.players]
+    
+    def build_standings(self, tournament):
+        return {
+            'type': 'tournament_standings',
+            **tournament.summary(),
+            'standings': tournament.standings()
+        }
     
     def handle_chat(self, client_socket, content):
+        client = self.clients.get(client_socket)
+        if client is None or not isinstance(content, str) or not content.strip():
+            return
+        
+        # Runs on the sender's own thread before the lock is taken, so
+        # dropping spam costs nobody else anything. The sender is told once
+        # per run of dropped messages.
+        if not client['chat_bucket'].take():
+            self.metrics.inc('chess_chat_dropped_total')
+            if not client['chat_throttled']:
+                client['chat_throttled'] = True
+                self.send_message(client_socket, {
+                    'type': 'error',
+                    'message': f"Sending chat too fast, wait {client['chat_bucket'].wait_time():.1f}s"
+                })
+            return
+        client['chat_throttled'] = False
+        content = content[:CHAT_MAX_LENGTH]
+        
         with self.lock:
-            game_id = self.clients[client_socket]['game']
+            game_id = client['game']
             
             if game_id is None:
                 return
             
-            username = self.clients[client_socket]['username']
+            username = client['username']
             
             # Get opponent socket
             opponent = self.games[game_id]['white'] if client_socket == self.games[game_id]['black'] else self.games[game_id]['black']
             
+            if self.journal is not None:
+                self.journal.record_chat(game_id, username, content)
+            
             # Forward chat message to opponent
-            self.send_message(opponent, {
-                'type': 'chat',
-                'sender': username,
-                'content': content
-            })
+            self.queue_chat(opponent, username, content)
     
-    def cleanup_game(self, game_id):
+    def queue_chat(self, recipient, sender, content):
+        # Caller holds the lock. The first message after a quiet spell goes
+        # out at once, any arriving within the batch window after it wait
+        # and share a single frame.
+        client = self.clients.get(recipient)
+        if client is None:
+            return
+        
+        client['chat_pending'].append({'sender': sender, 'content': content})
+        if client['chat_flush'] is not None:
+            return
+        
+        delay = client['chat_sent'] + CHAT_BATCH_WINDOW - time.monotonic()
+        if delay <= 0:
+            self.send_pending_chat(recipient)
+        else:
+            client['chat_flush'] = self.timers.schedule(delay, self.flush_chat, recipient)
+    
+    def flush_chat(self, recipient):
+        with self.lock:
+            self.send_pending_chat(recipient)
+    
+    def send_pending_chat(self, recipient):
+        client = self.clients.get(recipient)
+        if client is None:
+            return
+        
+        client['chat_flush'] = None
+        messages = client['chat_pending']
+        if not messages:
+            return
+        client['chat_pending'] = []
+        client['chat_sent'] = time.monotonic()
+        
+        # A lone message keeps the old shape, older clients understand it
+        if len(messages) == 1:
+            self.send_message(recipient, {'type': 'chat', **messages[0]})
+        else:
+            self.send_message(recipient, {'type': 'chat', 'messages': messages})
+        self.metrics.inc('chess_chat_frames_total')
+    
+    def update_ratings(self, game_id, winner):
+        # Looked up by name, a player may be away when their game ends
+        players = self.games[game_id]['players']
+        white_rating = self.ratings.get(players['white'], DEFAULT_RATING)
+        black_rating = self.ratings.get(players['black'], DEFAULT_RATING)
+        
+        # No winner means a draw
+        white_score = 0.5 if winner is None else (1 if winner == 'white' else 0)
+        self.ratings[players['white']] = elo_update(white_rating, black_rating, white_score)
+        self.ratings[players['black']] = elo_update(black_rating, white_rating, 1 - white_score)
+        
+        for color in ('white', 'black'):
+            client = self.clients.get(self.games[game_id][color])
+            if client is not None:
+                client['rating'] = self.ratings[players[color]]
+    
+    def build_archive_record(self, game_id, result, winner):
+        game = self.games[game_id]['game']
+        players = self.games[game_id]['players']
+        return {
+            'white': players['white'],
+            'black': players['black'],
+            'result': result,
+            'winner': winner,
+            'started_at': game.start_time,
+            'duration': game.get_game_duration(),
+            'move_count': game.get_move_count(),
+            'white_points': game.get_points('white'),
+            'black_points': game.get_points('black'),
+            'moves': pack_moves(game.move_history)
+        }
+    
+    def cleanup_game(self, game_id, final_message=None, **fields):
         if game_id not in self.games:
             return
         
+        # Spectators get the final message, if any, and are let go
+        spectators = [client_socket for client_socket, client in self.clients.items()
+                      if client['spectating'] == game_id]
+        self.spectators.game_ended(game_id, final_message, **fields)
+        for client_socket in spectators:
+            self.stop_spectating(client_socket)
+        
+        if self.games[game_id]['flag_timer'] is not None:
+            self.timers.cancel(self.games[game_id]['flag_timer'])
+        
+        body = final_message.body if final_message is not None else {}
+        result = fields.get('result', body.get('result'))
+        winner = body.get('winner')
+        
+        if self.journal is not None:
+            self.journal.record_end(game_id, result, winner)
+        
+        if result is not None:
+            self.metrics.inc('chess_games_finished_total', result)
+        
+        # Games that never got a result (failed to start) aren't worth keeping
+        if self.archive is not None and result is not None:
+            self.archive.archive_game(self.build_archive_record(game_id, result, winner))
+        
         white_client = self.games[game_id]['white']
         black_client = self.games[game_id]['black']
         
@@ -373,10 +1843,22 @@ class ChessServer:
         if white_client in self.clients:
             self.clients[white_client]['game'] = None
             self.clients[white_client]['color'] = None
+            self.update_presence(white_client)
         
         if black_client in self.clients:
             self.clients[black_client]['game'] = None
             self.clients[black_client]['color'] = None
+            self.update_presence(black_client)
+        
+        if game_id in self.tournament_games:
+            if result is None:
+                # Never got going, whoever is still here gets the point
+                scores = [float(self.games[game_id][color] in self.clients) for color in ('white', 'black')]
+            elif winner is None:
+                scores = [0.5, 0.5]
+            else:
+                scores = [1.0, 0.0] if winner == 'white' else [0.0, 1.0]
+            self.score_tournament_game(game_id, *scores)
         
         # Remove game
         del self.games[game_id]
@@ -384,52 +1866,233 @@ class ChessServer:
     def disconnect_client(self, client_socket):
         with self.lock:
             # Remove client from waiting queue if they're in it
-            if client_socket in self.waiting_queue:
-                self.waiting_queue.remove(client_socket)
+            self.matchmaker.remove(client_socket)
+            if self.broker is not None and client_socket in self.clients:
+                try:
+                    self.broker.send({'type': 'dequeue', 'player': self.clients[client_socket]['key']})
+                except OSError:
+                    pass
             
             # Check if client is in a game
             if client_socket in self.clients and self.clients[client_socket]['game'] is not None:
                 game_id = self.clients[client_socket]['game']
                 
-                # Handle as a resignation if game is still active
                 if game_id in self.games:
-                    player_color = self.clients[client_socket]['color']
-                    winner_color = 'black' if player_color == 'white' else 'white'
-                    
-                    # Get opponent socket
-                    opponent = self.games[game_id]['white'] if client_socket == self.games[game_id]['black'] else self.games[game_id]['black']
-                    
-                    # Notify opponent
-                    self.send_message(opponent, {
-                        'type': 'game_over',
-                        'result': 'opponent_disconnected',
-                        'winner': winner_color
-                    })
-                    
-                    # Clean up game
-                    self.cleanup_game(game_id)
+                    client = self.clients[client_socket]
+                    player_color = client['color']
+                    if self.resume_grace > 0:
+                        # Hold the seat, the game goes on (clock included)
+                        # until the player resumes or the grace period ends
+                        self.games[game_id][player_color] = None
+                        self.suspended_sessions[client['session']] = {
+                            'username': client['username'],
+                            'game': game_id,
+                            'color': player_color,
+                            'rating': client['rating'],
+                            'timer': self.timers.schedule(self.resume_grace, self.expire_session, client['session'])
+                        }
+                        opponent_color = 'black' if player_color == 'white' else 'white'
+                        self.send_message(self.games[game_id][opponent_color], {
+                            'type': 'opponent_away',
+                            'grace': self.resume_grace
+                        })
+                        # Still listed while the seat is held, owned by no connection
+                        self.lobby.update(client['username'], 'away', client['rating'], None)
+                    else:
+                        # Handle as a resignation if game is still active
+                        self.forfeit_game(game_id, player_color)
             
-            # Remove client from clients dict
-            if client_socket in self.clients:
-                del self.clients[client_socket]
+            self.spectators.unsubscribe(client_socket)
+            self.lobby.unsubscribe(client_socket)
             
-            # Close socket
-            try:
-                client_socket.close()
-            except:
-                pass
+            # Remove client from clients dict and let its writer thread
+            # close the socket once the outbox is drained
+            client = self.clients.pop(client_socket, None)
+            if client is not None:
+                self.lobby.remove(client['username'], client_socket)
+                self.players_by_key.pop(client['key'], None)
+                if self.sessions.get(client['session']) is client_socket:
+                    del self.sessions[client['session']]
+                client['outbox'].put(None)
+            else:
+                try:
+                    client_socket.close()
+                except:
+                    pass
+    
+    def update_presence(self, client_socket):
+        # Caller holds the lock. The lobby status follows from the client's state.
+        client = self.clients.get(client_socket)
+        if client is None:
+            return
+        
+        if client['game'] is not None:
+            status = 'playing'
+        elif client['spectating'] is not None:
+            status = 'spectating'
+        elif self.matchmaker.is_waiting(client_socket):
+            status = 'queued'
+        else:
+            status = 'idle'
+        self.lobby.update(client['username'], status, client['rating'], client_socket)
     
     def send_message(self, client_socket, message):
+        client = self.clients.get(client_socket)
+        if client is None:
+            return False
+        
+        frame = encode_message(message, client['format'])
+        if client['compress']:
+            frame = compress_frame(frame)
+        return self.send_frame(client_socket, frame)
+    
+    def send_shared(self, client_socket, shared_message, **fields):
+        client = self.clients.get(client_socket)
+        if client is None:
+            return False
+        
+        return self.send_frame(client_socket, shared_message.frame(client['format'], client['compress'], **fields))
+    
+    def send_frame(self, client_socket, frame):
+        client = self.clients.get(client_socket)
+        if client is None:
+            return False
+        
+        client['outbox'].put(frame)
+        return True
+    
+    def broadcast(self, recipients, shared_message, **fields):
+        # Encoded once per wire format, every recipient using that format gets
+        # the same bytes queued
+        for client_socket in recipients:
+            self.send_shared(client_socket, shared_message, **fields)
+    
+    def write_messages(self, client_socket, outbox, capture_id=None):
         try:
-            client_socket.send(json.dumps(message).encode('utf-8'))
-            return True
-        except:
+            while True:
+                frame = outbox.get()
+                if frame is None:
+                    break
+                client_socket.sendall(frame)
+                if capture_id is not None:
+                    self.capture.record(capture_id, TO_CLIENT, frame)
+                self.metrics.inc('chess_frames_sent_total')
+                self.metrics.inc('chess_bytes_sent_total', amount=len(frame))
+                if frame[:1] == COMPRESSED_MARKER:
+                    self.metrics.inc('chess_frames_compressed_total')
+        except Exception as e:
             # If sending fails, disconnect the client
+            log.debug("Error sending to client: %s", e)
             self.disconnect_client(client_socket)
-            return False
+        finally:
+            # Shutting down wakes up the reader thread if it is still in recv()
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+            try:
+                client_socket.close()
+            except:
+                pass
+
+
+def run_worker(host, port, broker_path, worker_id, options, log_level):
+    setup_logging(log_level)
+    if options.get('metrics_port'):
+        # Each worker has its own metrics, scraped separately
+        options = dict(options, metrics_port=options['metrics_port'] + worker_id)
+    if options.get('capture_path'):
+        # Workers can't share a file, each writes its own next to the others
+        options = dict(options, capture_path=f"{options['capture_path']}.{worker_id}")
+    server = ChessServer(host=host, port=port, reuse_port=True, broker_path=broker_path, worker_id=worker_id,
+                         **options)
+    server.start(announce=False)
+
+
+def run_supervisor(host, port, workers, options, log_level):
+    # One broker process pairs players for all workers, each worker accepts
+    # connections on the shared port and runs the games it owns
+    broker_path = os.path.join(tempfile.gettempdir(), f'chess-broker-{port}.sock')
+    if os.path.exists(broker_path):
+        os.unlink(broker_path)
+    
+    broker_process = multiprocessing.Process(target=run_broker, args=(broker_path, log_level))
+    broker_process.start()
+    
+    # Workers connect to the broker on startup
+    deadline = time.monotonic() + 5
+    while not os.path.exists(broker_path):
+        if time.monotonic() > deadline or not broker_process.is_alive():
+            log.error("Match broker failed to start")
+            broker_process.terminate()
+            return
+        time.sleep(0.05)
+    
+    worker_processes = []
+    for worker_id in range(workers):
+        worker_process = multiprocessing.Process(target=run_worker, args=(host, port, broker_path, worker_id, options, log_level))
+        worker_process.start()
+        worker_processes.append(worker_process)
+    
+    print("=" * 50)
+    print("  CHESS ONLINE SERVER")
+    print("=" * 50)
+    print(f"\nServer started on port {port} with {workers} worker processes")
+    print("\nPress Ctrl+C to stop the server")
+    print("=" * 50)
+    
+    # Being terminated must take the workers down too, not orphan them
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    try:
+        for worker_process in worker_processes:
+            worker_process.join()
+    except KeyboardInterrupt:
+        log.info("Server shutting down...")
+    finally:
+        for process in worker_processes + [broker_process]:
+            if process.is_alive():
+                process.terminate()
+            process.join()
 
 
 if __name__ == "__main__":
     args = parse_arguments()
-    server = ChessServer(host=args.host, port=args.port)
-    server.start() 
\ No newline at end of file
+    log_listener = setup_logging(args.log_level)
+    options = {
+        'time_control': args.time_control,
+        'heartbeat_interval': args.heartbeat_interval,
+        'idle_timeout': args.idle_timeout,
+        'resume_grace': args.resume_grace,
+        'metrics_port': args.metrics_port,
+        'capture_path': args.capture,
+        'chat_rate': args.chat_rate,
+        'chat_burst': args.chat_burst,
+        'control_path': args.control,
+        'takeover_path': args.takeover,
+        'backlog': args.backlog,
+        'max_connections': args.max_connections,
+        'max_per_ip': args.max_per_ip,
+        'accept_rate': args.accept_rate,
+        'accept_burst': args.accept_burst
+    }
+    if args.workers > 1:
+        # Each of these files has a single writer, workers would trample on each other
+        if args.journal:
+            log.warning("--journal is only supported with a single worker, ignoring it")
+        if args.archive:
+            log.warning("--archive is only supported with a single worker, ignoring it")
+        if args.opening_tree:
+            log.warning("--opening-tree is only supported with a single worker, ignoring it")
+        if args.control or args.takeover:
+            log.warning("--control and --takeover are only supported with a single worker, ignoring them")
+            options.update(control_path=None, takeover_path=None)
+        run_supervisor(args.host, args.port, args.workers, options, args.log_level)
+    else:
+        server = ChessServer(host=args.host, port=args.port, journal_path=args.journal,
+                             archive_path=args.archive, opening_tree_path=args.opening_tree,
+                             **options)
+        try:
+            server.start()
+        finally:
+            log_listener.stop() 
\ No newline at end of file
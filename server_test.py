@@ -1,417 +1,363 @@
-import socket
-import threading
+import argparse
 import json
+import logging
+import random
+import socket
 import time
-import traceback
-import queue
+from chess_logic import ChessGame
+from protocol import encode_message, MessageReader, FORMAT_JSON, WIRE_FORMATS
+from bot_client import random_legal_move
+from chess_logging import setup_logging, LOG_LEVELS
+
+log = logging.getLogger('server_test')
+
+MOCK_OPPONENT = 'mock'
+MOCK_SESSION = 'mock-session'
+SECONDS_PER_MOVE = 5  # Pretend thinking time, only shows up in game_info durations
+CHAT_LINES = ('gl hf', 'nice move', 'hmm', 'good game', 'oops', 'that was close')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Mock chess server that replays scripted message sequences')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5555,
+                        help='Port to listen on (default: 5555)')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='full_game',
+                        help='Built-in script to play (default: full_game)')
+    parser.add_argument('--script',
+                        help='Play the steps in this JSON lines file instead of a scenario')
+    parser.add_argument('--save', metavar='PATH',
+                        help='Write the scenario\'s steps to this JSON lines file for editing, instead of serving them')
+    parser.add_argument('--rate', type=float,
+                        help='Send at this many messages per second, ignoring the script\'s delays')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Play the script\'s delays this many times faster (default: 1)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the generated games and chat (default: 0)')
+    parser.add_argument('--plies', type=int, default=80,
+                        help='Length of generated games (default: 80)')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='Chat messages in the chat_flood scenario (default: 1000)')
+    parser.add_argument('--color', choices=('white', 'black'), default='white',
+                        help='Color the connecting client plays (default: white)')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO',
+                        help='Least severe log messages to show (default: INFO)')
+    return parser.parse_args()
 
-# Queue for players waiting for a match
-waiting_players = queue.Queue()
-# Lock for thread-safe operations
-player_lock = threading.Lock()
-# Connected clients
-clients = {}
 
-def handle_find_game_request(username, client_socket):
-    """Handle find_game request in a more reliable way"""
-    print(f"Received find_game request from {username}")
+def format_duration(seconds):
+    """Format seconds into minutes and seconds string"""
+    minutes = int(seconds // 60)
+    secs = int(seconds % 60)
+    return f"{minutes}m {secs}s"
+
+
+# Scripts are lists of steps, each one of
+#   {'send': message, 'delay': seconds}  send after waiting delay seconds
+#   {'expect': message_type}             wait for the client to send one
+#   {'disconnect': True}                 drop the client, the script carries
+#                                        on once it connects again
+
+def build_game_info(game):
+    # Same shape as the real server's, with a made up but repeatable duration
+    return {
+        'move_count': game.get_move_count(),
+        'duration': format_duration(game.get_move_count() * SECONDS_PER_MOVE),
+        'points': {
+            'white': game.get_points('white'),
+            'black': game.get_points('black')
+        }
+    }
+
+
+def game_start_steps(color, delay):
+    game = ChessGame()
+    return game, [
+        {'expect': 'find_game'},
+        {'send': {'type': 'queue', 'message': 'Looking for opponent...'}, 'delay': 0},
+        {'send': {'type': 'game_start', 'color': color, 'opponent': MOCK_OPPONENT,
+                  'rating': 1200, 'opponent_rating': 1200, 'clock': None}, 'delay': delay},
+        {'send': {'type': 'board_state', 'board': game.get_board_state(), 'turn': game.get_current_turn(),
+                  'seq': 0, 'hash': game.get_position_hash()}, 'delay': 0}
+    ]
+
+
+def play_move(game, rng, color):
+    """Play a random move on game and return the update the client would get, None if stuck."""
+    mover = game.get_current_turn()
+    choice = random_legal_move(game, mover, rng)
+    if choice is None:
+        return None
+    game.make_move(*choice)
     
-    # Send queue message
-    queue_msg = {'type': 'queue', 'message': 'Looking for opponent...'}
-    queue_data = json.dumps(queue_msg).encode('utf-8')
-    client_socket.send(queue_data)
-    print(f"Sent queue message to {username}")
+    update = {
+        'move': game.get_move_delta(),
+        'seq': game.get_move_count(),
+        'hash': game.get_position_hash(),
+        'turn': game.get_current_turn(),
+        'game_info': build_game_info(game)
+    }
+    status = game.get_game_status()
+    if status['game_over'] or any(status['check'].values()):
+        update['status'] = status
     
-    # Check if there's a waiting player
-    matched_player = None
-    matched_socket = None
+    # The client's own moves come back as move_result, as if it had made them
+    if mover == color:
+        return {'type': 'move_result', 'valid': True, **update}
+    return {'type': 'opponent_move', **update}
+
+
+def game_over_step(game, color, delay):
+    if game.game_over:
+        message = {'type': 'game_over', 'result': game.result, 'winner': game.winner}
+    else:
+        # Out of plies, the mock opponent gives up
+        message = {'type': 'game_over', 'result': 'opponent_resigned', 'winner': color}
+    message['game_info'] = build_game_info(game)
+    return {'send': message, 'delay': delay}
+
+
+def full_game_script(seed=0, plies=80, color='white', delay=0.5, **options):
+    """A whole game of random moves, finished by checkmate, a draw or the mock resigning."""
+    rng = random.Random(seed)
+    game, steps = game_start_steps(color, delay)
     
-    # Try to get a waiting player
-    if not waiting_players.empty():
-        with player_lock:
-            try:
-                matched_player = waiting_players.get_nowait()
-                # Verify this player is still connected and waiting
-                if matched_player in clients and not clients[matched_player]['in_game']:
-                    matched_socket = clients[matched_player]['socket']
-                else:
-                    matched_player = None
-            except queue.Empty:
-                matched_player = None
+    for _ in range(plies):
+        update = play_move(game, rng, color)
+        if update is None:
+            break
+        steps.append({'send': update, 'delay': delay})
+        if game.game_over:
+            break
     
-    if matched_player and matched_socket:
-        # We found a match!
-        print(f"Matched {username} with {matched_player}")
+    steps.append(game_over_step(game, color, delay))
+    return steps
+
+
+def chat_flood_script(seed=0, count=1000, color='white', delay=0.01, **options):
+    """Starts a game and then sends nothing but chat."""
+    rng = random.Random(seed)
+    game, steps = game_start_steps(color, delay)
+    for index in range(count):
+        content = f"{rng.choice(CHAT_LINES)} #{index}"
+        steps.append({'send': {'type': 'chat', 'sender': MOCK_OPPONENT, 'content': content}, 'delay': delay})
+    steps.append(game_over_step(game, color, delay))
+    return steps
+
+
+def reconnect_script(seed=0, plies=40, color='white', delay=0.5, drops=3, missed=2, **options):
+    """A game where the connection drops drops times, each time missing a few moves.
+    
+    The client is expected to resume its session, it is then sent the missed
+    moves in session_resumed just like the real server does.
+    """
+    rng = random.Random(seed)
+    game, steps = game_start_steps(color, delay)
+    drop_every = max(1, plies // (drops + 1))
+    
+    while game.get_move_count() < plies and not game.game_over:
+        update = play_move(game, rng, color)
+        if update is None:
+            break
+        steps.append({'send': update, 'delay': delay})
         
-        # Mark both players as in a game
-        with player_lock:
-            clients[username]['in_game'] = True
-            clients[matched_player]['in_game'] = True
-            clients[username]['opponent'] = matched_player
-            clients[matched_player]['opponent'] = username
-            
-            # Assign colors - matched player (who was waiting) is white
-            player_color = 'black'
-            opponent_color = 'white'
+        if drops and game.get_move_count() % drop_every == 0:
+            drops -= 1
+            last_seq = game.get_move_count()
+            steps.append({'disconnect': True})
             
-            # Store colors in client data
-            clients[username]['color'] = player_color
-            clients[matched_player]['color'] = opponent_color
-        
-        # Create initial board state
-        board_state = [[None for _ in range(8)] for _ in range(8)]
-        
-        # Add some test pieces
-        board_state[0][0] = {'color': 'black', 'type': 'rook', 'has_moved': False}
-        board_state[0][4] = {'color': 'black', 'type': 'king', 'has_moved': False}
-        board_state[7][0] = {'color': 'white', 'type': 'rook', 'has_moved': False}
-        board_state[7][4] = {'color': 'white', 'type': 'king', 'has_moved': False}
+            # Moves played while the client was away
+            for _ in range(missed):
+                if game.game_over or play_move(game, rng, color) is None:
+                    break
+            steps.append({'send': {
+                'type': 'session_resumed',
+                'session': MOCK_SESSION,
+                'game_id': '1',
+                'color': color,
+                'opponent': MOCK_OPPONENT,
+                'seq': game.get_move_count(),
+                'hash': game.get_position_hash(),
+                'turn': game.get_current_turn(),
+                'game_info': build_game_info(game),
+                'moves': [game.get_move_delta(index) for index in range(last_seq, game.get_move_count())]
+            }, 'delay': 0})
+    
+    steps.append(game_over_step(game, color, delay))
+    return steps
+
+
+SCENARIOS = {
+    'full_game': full_game_script,
+    'chat_flood': chat_flood_script,
+    'reconnect': reconnect_script
+}
+
+
+def load_script(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_script(steps, path):
+    with open(path, 'w') as f:
+        for step in steps:
+            f.write(json.dumps(step) + '\n')
+
+
+class MockServer:
+    """Stands in for server.py, playing a script to one client at a time.
+    
+    Everything sent is fixed by the script and the seed it was generated
+    with, so the same run can be repeated to measure how the client copes.
+    Frames are encoded before the script starts so pacing isn't disturbed.
+    """
+    
+    def __init__(self, steps, host='127.0.0.1', port=5555, rate=None, speed=1.0):
+        self.steps = steps
+        self.host = host
+        self.port = port
+        self.rate = rate  # Messages per second, overrides the steps' delays
+        self.speed = speed
+        self.server_socket = None
+        self.encoded = {}  # {wire_format: [frame or None for each step]}
+        self.sent = 0
+    
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(5)
+        log.info("Mock server listening on %s:%d with %d steps", self.host, self.port, len(self.steps))
         
-        # Send game_start messages first
         try:
-            # Send game_start to the current player (black)
-            game_start_msg = {
-                'type': 'game_start',
-                'color': player_color,
-                'opponent': matched_player
-            }
-            game_start_data = json.dumps(game_start_msg).encode('utf-8')
-            client_socket.send(game_start_data)
-            print(f"Sent game_start message to {username} (black)")
-            
-            # Send game_start to the opponent (white)
-            opponent_game_start_msg = {
-                'type': 'game_start',
-                'color': opponent_color,
-                'opponent': username
-            }
-            matched_socket.send(json.dumps(opponent_game_start_msg).encode('utf-8'))
-            print(f"Sent game_start message to {matched_player} (white)")
-            
-            # Small delay to ensure game_start messages are processed first
-            time.sleep(0.1)
-            
-            # Send board state to both players
-            board_msg = {
-                'type': 'board_state',
-                'board': board_state,
-                'turn': 'white'
-            }
-            board_data = json.dumps(board_msg).encode('utf-8')
-            
-            client_socket.send(board_data)
-            print(f"Sent board_state message to {username}")
-            
-            matched_socket.send(board_data)
-            print(f"Sent board_state message to {matched_player}")
-            
-            return True
-        except Exception as e:
-            print(f"Error during matchmaking: {e}")
-            # Reset game state if there was an error
-            with player_lock:
-                clients[username]['in_game'] = False
-                clients[username]['opponent'] = None
-                clients[matched_player]['in_game'] = False
-                clients[matched_player]['opponent'] = None
-            return False
-    else:
-        # No match found, add to waiting queue
-        print(f"Adding {username} to waiting queue")
-        waiting_players.put(username)
-        
-        # Send updated queue message
-        queue_update_msg = {'type': 'queue', 'message': 'Waiting for opponent...'}
-        client_socket.send(json.dumps(queue_update_msg).encode('utf-8'))
-        return False
-
-def handle_client(client_socket, addr):
-    username = "Unknown"
-    game_started = False
-    opponent_socket = None
-    player_color = None
+            while True:
+                self.play()
+        except KeyboardInterrupt:
+            log.info("Mock server shutting down...")
+        finally:
+            self.server_socket.close()
     
-    # Game state tracking
-    move_count = 0
-    start_time = time.time()
-    points = {'white': 0, 'black': 0}
-    piece_values = {
-        'pawn': 1,
-        'knight': 3,
-        'bishop': 3,
-        'rook': 5,
-        'queen': 9,
-        'king': 0  # King has no point value since it can't be captured
-    }
+    def frames(self, wire_format):
+        frames = self.encoded.get(wire_format)
+        if frames is None:
+            frames = self.encoded[wire_format] = [
+                encode_message(step['send'], wire_format) if 'send' in step else None
+                for step in self.steps
+            ]
+        return frames
     
-    try:
-        print(f"New connection from {addr}")
-        client_socket.settimeout(300)  # Set a longer timeout (5 minutes)
+    def accept(self):
+        """Wait for a client and do the handshake, returns (socket, reader)."""
+        client_socket, addr = self.server_socket.accept()
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = MessageReader()
         
-        # Receive username
-        data = client_socket.recv(1024).decode('utf-8')
-        if not data:
-            print(f"No data received from {addr}")
-            return
+        handshake = None
+        while handshake is None:
+            data = client_socket.recv(4096)
+            if not data:
+                client_socket.close()
+                return None, None
+            messages = reader.feed(data, limit=1)
+            if messages:
+                handshake = messages[0]
         
-        try:
-            username = json.loads(data).get('username', 'Unknown')
-            print(f"Client connected: {username} from {addr}")
-            
-            # Store client in connected clients dict
-            with player_lock:
-                clients[username] = {
-                    'socket': client_socket,
-                    'in_game': False,
-                    'opponent': None
-                }
-            
-        except json.JSONDecodeError:
-            print(f"Invalid JSON from {addr}: {data}")
+        wire_format = handshake.get('format', FORMAT_JSON)
+        if wire_format not in WIRE_FORMATS:
+            wire_format = FORMAT_JSON
+        client_socket.sendall(encode_message({
+            'type': 'connection_success',
+            'message': f"Welcome {handshake.get('username')}!",
+            'format': wire_format,
+            'session': MOCK_SESSION
+        }))
+        reader.set_format(wire_format)
+        log.info("Client %s connected from %s", handshake.get('username'), addr)
+        return client_socket, reader
+    
+    def play(self):
+        client_socket, reader = self.accept()
+        if client_socket is None:
             return
         
-        # Send welcome message
-        welcome_msg = {'type': 'connection_success', 'message': f'Welcome {username}!'}
-        client_socket.send(json.dumps(welcome_msg).encode('utf-8'))
-        print(f"Sent welcome message to {username}")
+        wire_format = reader.wire_format
+        frames = self.frames(wire_format)
+        pending = []  # Client messages read but not expected yet
+        started = time.perf_counter()
+        self.sent = 0
+        due = started
+        index = 0
         
-        # Wait for client to send messages
-        client_socket.settimeout(None)  # Remove timeout for receiving messages
-        while True:
-            try:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
-                    print(f"Client {username} disconnected (no data)")
-                    break
+        try:
+            while index < len(self.steps):
+                step = self.steps[index]
                 
-                print(f"Received from {username}: {data}")
-                try:
-                    message = json.loads(data)
-                    print(f"Parsed message: {message}")
-                    msg_type = message.get('type')
-                    print(f"Message type: {msg_type}")
-                    
-                    # Handle find_game request
-                    if msg_type == 'find_game' and not game_started:
-                        game_started = handle_find_game_request(username, client_socket)
-                    
-                    # Handle chat messages
-                    elif message.get('type') == 'chat' and game_started:
-                        # Forward chat to opponent
-                        with player_lock:
-                            opponent_name = clients[username]['opponent']
-                            if opponent_name in clients:
-                                opponent_socket = clients[opponent_name]['socket']
-                                
-                                chat_message = {
-                                    'type': 'chat',
-                                    'sender': username,
-                                    'content': message.get('content', '')
-                                }
-                                opponent_socket.send(json.dumps(chat_message).encode('utf-8'))
-                                print(f"Forwarded chat from {username} to {opponent_name}")
-                    
-                    # Handle move requests
-                    elif message.get('type') == 'move' and game_started:
-                        # Process move and update game state...
-                        from_pos = message.get('from')
-                        to_pos = message.get('to')
-                        
-                        # Increment move counter
-                        move_count += 1
-                        
-                        # Update points if capturing a piece
-                        # Simplified: In a real implementation, you'd check what piece is at to_pos
-                        # and if it's an opponent's piece, add its value to the player's points
-                        captured_piece_type = message.get('captured_piece')
-                        if captured_piece_type:
-                            points[player_color] += piece_values.get(captured_piece_type, 0)
-                        
-                        # Update board state (simplified)
-                        board_state = [[None for _ in range(8)] for _ in range(8)]
-                        board_state[0][0] = {'color': 'black', 'type': 'rook', 'has_moved': False, 'points': 5}
-                        board_state[0][4] = {'color': 'black', 'type': 'king', 'has_moved': False, 'points': 0}
-                        board_state[7][0] = {'color': 'white', 'type': 'rook', 'has_moved': False, 'points': 5}
-                        board_state[7][4] = {'color': 'white', 'type': 'king', 'has_moved': False, 'points': 0}
-                        
-                        # Determine next player's turn
-                        next_turn = 'black' if player_color == 'white' else 'white'
-                        
-                        # Calculate game duration
-                        current_duration = format_duration(time.time() - start_time)
-                        
-                        # Game information
-                        game_info = {
-                            'move_count': move_count,
-                            'duration': current_duration,
-                            'points': points
-                        }
-                        
-                        # Send move result to current player
-                        move_result = {
-                            'type': 'move_result',
-                            'valid': True,
-                            'board': board_state,
-                            'turn': next_turn,
-                            'status': {'game_over': False},
-                            'game_info': game_info
-                        }
-                        client_socket.send(json.dumps(move_result).encode('utf-8'))
-                        
-                        # Send opponent_move to opponent
-                        with player_lock:
-                            opponent_name = clients[username]['opponent']
-                            if opponent_name in clients:
-                                opponent_socket = clients[opponent_name]['socket']
-                                
-                                opponent_move = {
-                                    'type': 'opponent_move',
-                                    'from': from_pos,
-                                    'to': to_pos,
-                                    'board': board_state,
-                                    'turn': next_turn,
-                                    'status': {'game_over': False},
-                                    'game_info': game_info
-                                }
-                                opponent_socket.send(json.dumps(opponent_move).encode('utf-8'))
-                                print(f"Sent move from {username} to {opponent_name}")
-                    
-                    # Handle resignation
-                    elif message.get('type') == 'resign' and game_started:
-                        # Handle player resignation
-                        with player_lock:
-                            opponent_name = clients[username]['opponent']
-                            if opponent_name in clients:
-                                opponent_socket = clients[opponent_name]['socket']
-                                
-                                # Calculate game duration
-                                current_duration = format_duration(time.time() - start_time)
-                                
-                                # Game information
-                                game_info = {
-                                    'move_count': move_count,
-                                    'duration': current_duration,
-                                    'points': points
-                                }
-                                
-                                # Notify the resigning player
-                                resign_result = {
-                                    'type': 'game_over',
-                                    'result': 'resignation',
-                                    'winner': 'opponent',
-                                    'game_info': game_info
-                                }
-                                client_socket.send(json.dumps(resign_result).encode('utf-8'))
-                                
-                                # Notify the opponent
-                                opponent_win = {
-                                    'type': 'game_over',
-                                    'result': 'opponent_resigned',
-                                    'winner': clients[opponent_name]['color'],
-                                    'game_info': game_info
-                                }
-                                opponent_socket.send(json.dumps(opponent_win).encode('utf-8'))
-                                print(f"{username} resigned, {opponent_name} wins")
-                                
-                                # Reset game state
-                                clients[username]['in_game'] = False
-                                clients[username]['opponent'] = None
-                                clients[opponent_name]['in_game'] = False
-                                clients[opponent_name]['opponent'] = None
-                                game_started = False
-                    
-                    # Handle other message types if needed
-                    else:
-                        print(f"Unknown or inappropriate message type: {message.get('type')}")
+                if 'send' in step:
+                    # Deadlines add up from the start so slow sends don't make the
+                    # whole script drift later
+                    due += 1 / self.rate if self.rate else step.get('delay', 0) / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    client_socket.sendall(frames[index])
+                    self.sent += 1
                 
-                except json.JSONDecodeError as e:
-                    print(f"JSON decode error from {username}: {e}")
-                    continue
-                except Exception as e:
-                    print(f"Error processing message from {username}: {e}")
-                    traceback.print_exc()
-                    break
-            except Exception as e:
-                print(f"Error receiving from {username}: {e}")
-                traceback.print_exc()
-                break
-    except Exception as e:
-        print(f"Error handling client {username} from {addr}: {e}")
-        traceback.print_exc()
-    finally:
-        try:
-            client_socket.close()
-        except:
-            pass
-        
-        # Clean up client data
-        with player_lock:
-            if username in clients:
-                # Notify opponent if in a game
-                if clients[username]['in_game'] and clients[username]['opponent']:
-                    opponent_name = clients[username]['opponent']
-                    if opponent_name in clients:
-                        try:
-                            opponent_socket = clients[opponent_name]['socket']
-                            disconnect_msg = {
-                                'type': 'game_over',
-                                'result': 'opponent_disconnected',
-                                'winner': clients[opponent_name]['color']
-                            }
-                            opponent_socket.send(json.dumps(disconnect_msg).encode('utf-8'))
-                            clients[opponent_name]['in_game'] = False
-                            clients[opponent_name]['opponent'] = None
-                            print(f"Notified {opponent_name} that {username} disconnected")
-                        except:
-                            pass
+                elif 'expect' in step:
+                    message = self.expect(client_socket, reader, pending, step['expect'])
+                    if message is None:
+                        log.info("Client left while waiting for %s", step['expect'])
+                        return
+                    due = time.perf_counter()
                 
-                # Remove client from dictionary
-                del clients[username]
-        
-        print(f"Client {username} from {addr} disconnected")
-
-def start_test_server(host='0.0.0.0', port=5555):
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                elif step.get('disconnect'):
+                    client_socket.close()
+                    log.info("Dropped the client after %d messages, waiting for it to come back", self.sent)
+                    client_socket, reader = self.accept()
+                    if client_socket is None:
+                        return
+                    if reader.wire_format != wire_format:
+                        wire_format = reader.wire_format
+                        frames = self.frames(wire_format)
+                    pending = []
+                    due = time.perf_counter()
+                
+                index += 1
+            
+            elapsed = time.perf_counter() - started
+            log.info("Script done, sent %d messages in %.3fs (%.1f/s)",
+                     self.sent, elapsed, self.sent / elapsed if elapsed else 0)
+        except (ConnectionError, OSError) as e:
+            log.info("Client connection ended: %s", e)
+        finally:
+            client_socket.close()
     
-    try:
-        server.bind((host, port))
-        server.listen(5)
-        
-        # Print local IP address for clients to connect to
-        hostname = socket.gethostname()
-        local_ip = socket.gethostbyname(hostname)
-        print(f"Server started on port {port}")
-        print(f"Server is listening on all network interfaces (0.0.0.0)")
-        print(f"Connect to this server using:")
-        print(f"- From this computer: localhost or 127.0.0.1, Port: {port}")
-        print(f"- From local network: {local_ip}, Port: {port}")
-        print(f"- From outside network: [Your public IP], Port: {port} (requires port forwarding)")
-        print("Other clients can connect by using the appropriate IP address in their client.py")
-        
+    def expect(self, client_socket, reader, pending, message_type):
         while True:
-            try:
-                client_socket, addr = server.accept()
-                print(f"Connection from {addr}")
-                
-                client_thread = threading.Thread(target=handle_client, args=(client_socket, addr))
-                client_thread.daemon = True
-                client_thread.start()
-            except Exception as e:
-                print(f"Error accepting connection: {e}")
-                traceback.print_exc()
-    except KeyboardInterrupt:
-        print("Server shutting down...")
-    finally:
-        server.close()
+            while pending:
+                message = pending.pop(0)
+                if message.get('type') == message_type:
+                    return message
+            
+            data = client_socket.recv(4096)
+            if not data:
+                return None
+            pending.extend(reader.feed(data))
 
-def format_duration(seconds):
-    """Format seconds into minutes and seconds string"""
-    minutes = int(seconds // 60)
-    secs = int(seconds % 60)
-    return f"{minutes}m {secs}s"
 
 if __name__ == "__main__":
-    print("Starting chess server...")
-    print("Press Ctrl+C to stop the server")
-    start_test_server() 
\ No newline at end of file
+    args = parse_arguments()
+    log_listener = setup_logging(args.log_level)
+    if args.script:
+        steps = load_script(args.script)
+    else:
+        steps = SCENARIOS[args.scenario](seed=args.seed, plies=args.plies, count=args.count, color=args.color)
+    try:
+        if args.save:
+            save_script(steps, args.save)
+            log.info("Wrote %d steps to %s", len(steps), args.save)
+        else:
+            MockServer(steps, args.host, args.port, args.rate, args.speed).start()
+    finally:
+        log_listener.stop()
@@ -0,0 +1,308 @@
+import argparse
+import itertools
+import logging
+import queue
+import socket
+import struct
+import threading
+import time
+from protocol import MessageReader, WIRE_FORMATS
+from chess_logging import setup_logging, LOG_LEVELS
+
+log = logging.getLogger('session_capture')
+
+CAPTURE_MAGIC = b'CHESSCAP\x01'
+
+# Every record is a header followed by the bytes exactly as they went over the
+# socket: frames as they were written, chunks as recv() returned them
+RECORD_HEADER = struct.Struct('>QIBI')  # nanoseconds since capture start, connection, direction, length
+TO_SERVER = 0
+TO_CLIENT = 1
+CLOSED = 2  # The connection ended, no data
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Inspect and replay captured chess sessions')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO',
+                        help='Least severe log messages to show (default: INFO)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    info = commands.add_parser('info', help='Summarise a capture')
+    info.add_argument('capture')
+    
+    to_server = commands.add_parser('server', help='Replay the clients in a capture against a server')
+    to_server.add_argument('capture')
+    to_server.add_argument('--host', default='127.0.0.1',
+                           help='Server to connect to (default: 127.0.0.1)')
+    to_server.add_argument('--port', type=int, default=5555,
+                           help='Server port (default: 5555)')
+    to_server.add_argument('--speed', type=parse_speed, default=1.0,
+                           help='1 for original timing, N for N times faster, max for no waiting (default: 1)')
+    
+    to_client = commands.add_parser('client', help='Play a captured server side to a connecting client')
+    to_client.add_argument('capture')
+    to_client.add_argument('--connection', type=int,
+                           help='Connection to replay (default: the first one)')
+    to_client.add_argument('--host', default='127.0.0.1',
+                           help='Address to listen on (default: 127.0.0.1)')
+    to_client.add_argument('--port', type=int, default=5555,
+                           help='Port to listen on (default: 5555)')
+    to_client.add_argument('--speed', type=parse_speed, default=1.0,
+                           help='1 for original timing, N for N times faster, max for no waiting (default: 1)')
+    return parser.parse_args()
+
+
+def parse_speed(text):
+    if text == 'max':
+        return 0.0
+    speed = float(text)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+class SessionCapture:
+    """Writes every byte sent or received on the server's or client's
+    connections to a log, stamped with a monotonic clock.
+    
+    record() only queues, a background thread does the writing, so capturing
+    adds little to the paths it watches.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.records = queue.SimpleQueue()
+        self.connections = itertools.count(1)  # next() is atomic, no lock needed
+        self.started = time.monotonic_ns()
+        self.file = None
+        self.thread = None
+    
+    def open(self):
+        self.file = open(self.path, 'wb')
+        self.file.write(CAPTURE_MAGIC)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def close(self):
+        if self.thread is not None:
+            self.records.put(None)
+            self.thread.join()
+            self.thread = None
+    
+    def connection(self):
+        """A new id to record a connection's traffic under."""
+        return next(self.connections)
+    
+    def record(self, connection, direction, data=b''):
+        self.records.put((time.monotonic_ns() - self.started, connection, direction, bytes(data)))
+    
+    def run(self):
+        stopping = False
+        while not stopping:
+            # Write whatever has piled up in one go
+            batch = [self.records.get()]
+            while True:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+            
+            try:
+                self.file.write(b''.join(RECORD_HEADER.pack(offset, connection, direction, len(data)) + data
+                                         for offset, connection, direction, data in batch))
+                self.file.flush()
+            except OSError as e:
+                log.error("Error writing session capture: %s", e)
+        
+        self.file.close()
+
+
+def read_capture(path):
+    """Every record in a capture as (seconds, connection, direction, data), in time order."""
+    records = []
+    with open(path, 'rb') as capture_file:
+        if capture_file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a session capture")
+        
+        while True:
+            header = capture_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # End of file, or a record cut short by a crash
+                break
+            offset, connection, direction, length = RECORD_HEADER.unpack(header)
+            data = capture_file.read(length)
+            if len(data) < length:
+                break
+            records.append((offset / 1e9, connection, direction, data))
+    
+    # Threads queue records concurrently, so the file is only nearly in order
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def decode_connection(records, connection):
+    """The messages of one connection as (seconds, direction, message).
+    
+    Both directions start out as JSON and switch to the format the server
+    confirms in connection_success.
+    """
+    readers = {TO_SERVER: MessageReader(), TO_CLIENT: MessageReader(negotiate=True, inflate=True)}
+    negotiated = False
+    messages = []
+    
+    for offset, record_connection, direction, data in records:
+        if record_connection != connection or direction == CLOSED:
+            continue
+        # Until the format is settled only the handshake is read from the
+        # client, whatever follows it may already be in the new format
+        limit = 1 if direction == TO_SERVER and not negotiated else None
+        for message in readers[direction].feed(data, limit):
+            messages.append((offset, direction, message))
+            if (not negotiated and message.get('type') == 'connection_success'
+                    and message.get('format') in WIRE_FORMATS):
+                readers[TO_SERVER].set_format(message['format'])
+                negotiated = True
+    
+    return messages
+
+
+def summarize(records):
+    connections = {}
+    for offset, connection, direction, data in records:
+        entry = connections.setdefault(connection, {'first': offset, 'last': offset, 'bytes': [0, 0]})
+        entry['last'] = offset
+        if direction != CLOSED:
+            entry['bytes'][direction] += len(data)
+    
+    duration = records[-1][0] - records[0][0] if records else 0
+    print(f"{len(records)} records, {len(connections)} connections over {duration:.3f}s")
+    for connection, entry in sorted(connections.items()):
+        messages = decode_connection(records, connection)
+        print(f"  #{connection}: {entry['first']:.3f}s to {entry['last']:.3f}s, "
+              f"{entry['bytes'][TO_SERVER]} bytes in, {entry['bytes'][TO_CLIENT]} bytes out, "
+              f"{len(messages)} messages")
+
+
+def replay_to_server(records, host, port, speed=1.0):
+    """Act as every client in the capture, sending what they sent when they sent it.
+    
+    With speed 0 everything is sent as fast as possible. Replies are read and
+    counted but otherwise ignored. Returns (frames sent, replies received).
+    """
+    sockets = {}
+    replies = [0]
+    reply_lock = threading.Lock()
+    
+    def drain(client_socket):
+        reader = MessageReader(negotiate=True, inflate=True)
+        try:
+            while True:
+                data = client_socket.recv(65536)
+                if not data:
+                    return
+                count = len(reader.feed(data))
+                with reply_lock:
+                    replies[0] += count
+        except OSError:
+            pass
+    
+    sent = 0
+    drains = []
+    first = records[0][0] if records else 0
+    started = time.perf_counter()
+    
+    for offset, connection, direction, data in records:
+        if direction == TO_CLIENT:
+            continue
+        
+        if speed:
+            delay = started + (offset - first) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        
+        client_socket = sockets.get(connection)
+        if direction == CLOSED:
+            if client_socket is not None:
+                client_socket.close()
+                del sockets[connection]
+            continue
+        
+        if client_socket is None:
+            client_socket = sockets[connection] = socket.create_connection((host, port))
+            drainer = threading.Thread(target=drain, args=(client_socket,))
+            drainer.daemon = True
+            drainer.start()
+            drains.append(drainer)
+        
+        try:
+            client_socket.sendall(data)
+            sent += 1
+        except OSError as e:
+            log.warning("Connection %s: %s", connection, e)
+    
+    for client_socket in sockets.values():
+        client_socket.close()
+    for drainer in drains:
+        drainer.join(1.0)
+    
+    log.info("Replayed %d sends in %.3fs, %d replies", sent, time.perf_counter() - started, replies[0])
+    return sent, replies[0]
+
+
+def capture_to_script(records, connection=None):
+    """Turn one connection's server side into steps for server_test.MockServer.
+    
+    The mock does its own handshake, so connection_success is left out. The
+    client's find_game is waited for, the rest is sent on the captured timing.
+    """
+    if connection is None:
+        connection = next((record[1] for record in records if record[2] == TO_CLIENT), None)
+    
+    steps = []
+    previous = None
+    for offset, direction, message in decode_connection(records, connection):
+        if direction == TO_SERVER:
+            if message.get('type') == 'find_game':
+                steps.append({'expect': 'find_game'})
+                previous = offset
+            continue
+        if message.get('type') == 'connection_success':
+            previous = offset
+            continue
+        
+        steps.append({'send': message, 'delay': offset - previous if previous is not None else 0})
+        previous = offset
+    return steps
+
+
+def replay_to_client(records, host, port, speed=1.0, connection=None):
+    # Imported here, the mock server is only needed for this direction
+    from server_test import MockServer
+    
+    steps = capture_to_script(records, connection)
+    if not speed:
+        for step in steps:
+            if 'delay' in step:
+                step['delay'] = 0
+        speed = 1.0
+    MockServer(steps, host, port, speed=speed).start()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    log_listener = setup_logging(args.log_level)
+    try:
+        records = read_capture(args.capture)
+        if args.command == 'info':
+            summarize(records)
+        elif args.command == 'server':
+            replay_to_server(records, args.host, args.port, args.speed)
+        else:
+            replay_to_client(records, args.host, args.port, args.speed, args.connection)
+    finally:
+        log_listener.stop()
@@ -0,0 +1,105 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+# The client opens a window, the dummy driver keeps it off screen
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+from client import ChessClient
+from protocol import encode_message, MessageReader
+from server import ChessServer
+from session_capture import read_capture, decode_connection, replay_to_server, TO_SERVER
+
+
+def start_server():
+    # Grab a free port for a server that runs until the test process exits
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    
+    server = ChessServer('127.0.0.1', port)
+    thread = threading.Thread(target=server.start, kwargs={'announce': False})
+    thread.daemon = True
+    thread.start()
+    
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return port
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+class Opponent:
+    """A bare connection that queues for a game and collects replies."""
+    
+    def __init__(self, port, username):
+        self.socket = socket.create_connection(('127.0.0.1', port))
+        self.socket.settimeout(5)
+        self.reader = MessageReader(negotiate=True, inflate=True)
+        self.messages = []
+        self.socket.sendall(encode_message({'username': username}))
+        self.wait_for('connection_success')
+        self.socket.sendall(encode_message({'type': 'find_game'}, self.reader.wire_format))
+        self.wait_for('queue')
+    
+    def wait_for(self, message_type):
+        while True:
+            for message in self.messages:
+                if message.get('type') == message_type:
+                    return message
+            data = self.socket.recv(65536)
+            if not data:
+                raise EOFError(f"Connection closed before {message_type}")
+            self.messages.extend(self.reader.feed(data))
+    
+    def close(self):
+        self.socket.close()
+
+
+class CaptureRoundTripTest(unittest.TestCase):
+    def test_client_capture_replays_game(self):
+        with tempfile.TemporaryDirectory() as directory:
+            capture_path = os.path.join(directory, 'client.cap')
+            
+            # Play a short game from the real client with capturing on
+            port = start_server()
+            opponent = Opponent(port, 'bob')
+            client = ChessClient('127.0.0.1', port, capture_path=capture_path)
+            try:
+                self.assertTrue(client.connect_to_server('alice'))
+                self.assertTrue(client.find_game())
+                self.assertEqual(opponent.wait_for('game_start')['opponent'], 'alice')
+                client.resign_game()
+                opponent.wait_for('game_over')
+            finally:
+                client.disconnect()
+                client.capture.close()
+                opponent.close()
+            
+            records = read_capture(capture_path)
+            sent = [message.get('type') for offset, direction, message in decode_connection(records, 1)
+                    if direction == TO_SERVER]
+            self.assertIn('find_game', sent)
+            
+            # Replaying the capture on a fresh server plays the same game again
+            port = start_server()
+            opponent = Opponent(port, 'carol')
+            try:
+                # Captured timing, matching runs on another thread and a resign
+                # sent straight away would arrive before the game exists
+                replay_to_server(records, '127.0.0.1', port)
+                self.assertEqual(opponent.wait_for('game_start')['opponent'], 'alice')
+                opponent.wait_for('game_over')
+            finally:
+                opponent.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+from protocol import SharedMessage, compress_frames
+
+log = logging.getLogger(__name__)
+
+
+class SpectatorFeed:
+    def __init__(self, on_drop, snapshot_interval=20, max_backlog=256):
+        # on_drop(client, game_id) is called from the fan-out thread when a
+        # spectator is let go for falling behind
+        self.on_drop = on_drop
+        
+        # Late joiners get the latest snapshot plus the moves made since, a new
+        # snapshot is taken every snapshot_interval moves to keep that tail short
+        self.snapshot_interval = snapshot_interval
+        # Spectators with more frames than this waiting in their outbox are
+        # dropped rather than letting their queue grow without bound
+        self.max_backlog = max_backlog
+        
+        # Players only ever put events on this queue. Everything else, including
+        # the per-game subscriber sets, belongs to the fan-out thread, so a game
+        # with thousands of watchers costs its players one put() per move.
+        self.events = queue.SimpleQueue()
+        self.games = {}  # {game_id: {'info': SharedMessage, 'snapshot': SharedMessage, 'tail': [SharedMessage], 'subscribers': {client: (outbox, wire_format, compress)}}}
+        self.watching = {}  # {client: game_id}
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        self.events.put(None)
+    
+    def game_started(self, game_id, info, snapshot):
+        self.events.put(('start', game_id, SharedMessage(info), SharedMessage(snapshot)))
+    
+    def publish_move(self, game_id, move_message, snapshot=None):
+        """Fan out a move; pass a fresh board snapshot every snapshot_interval moves."""
+        self.events.put(('move', game_id, move_message, SharedMessage(snapshot) if snapshot else None))
+    
+    def game_ended(self, game_id, final_message=None, **fields):
+        self.events.put(('end', game_id, final_message, fields))
+    
+    def subscribe(self, client, game_id, outbox, wire_format, compress=False):
+        self.events.put(('subscribe', game_id, client, (outbox, wire_format, compress)))
+    
+    def unsubscribe(self, client):
+        self.events.put(('unsubscribe', None, client, None))
+    
+    def run(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            
+            try:
+                kind, game_id, first, second = event
+                if kind == 'start':
+                    self.games[game_id] = {'info': first, 'snapshot': second, 'tail': [], 'subscribers': {}}
+                elif kind == 'move':
+                    self.handle_move(game_id, first, second)
+                elif kind == 'end':
+                    self.handle_end(game_id, first, second)
+                elif kind == 'subscribe':
+                    self.handle_subscribe(game_id, first, second)
+                elif kind == 'unsubscribe':
+                    self.remove_subscriber(first)
+            except Exception as e:
+                log.error("Error in spectator feed: %s", e)
+    
+    def handle_move(self, game_id, move_message, snapshot):
+        game = self.games.get(game_id)
+        if game is None:
+            return
+        
+        if snapshot is not None:
+            game['snapshot'] = snapshot
+            game['tail'] = []
+        else:
+            game['tail'].append(move_message)
+        
+        # Encoded at most once per wire format for the whole audience
+        self.fan_out(game, move_message, type='spectate_move')
+    
+    def handle_end(self, game_id, final_message, fields):
+        game = self.games.pop(game_id, None)
+        if game is None:
+            return
+        
+        if final_message is not None:
+            self.fan_out(game, final_message, **fields)
+        
+        for client in game['subscribers']:
+            self.watching.pop(client, None)
+    
+    def handle_subscribe(self, game_id, client, subscriber):
+        self.remove_subscriber(client)
+        
+        outbox, wire_format, compress = subscriber
+        game = self.games.get(game_id)
+        if game is None:
+            outbox.put(SharedMessage({'type': 'spectate_end', 'reason': 'not_found'}).frame(wire_format))
+            return
+        
+        # Catch up from the latest snapshot, then follow the live feed. The
+        # moves repeat each other's text, so the catch-up is compressed as one.
+        frames = [game['info'].frame(wire_format), game['snapshot'].frame(wire_format)]
+        frames += [move_message.frame(wire_format, type='spectate_move') for move_message in game['tail']]
+        packed = compress_frames(frames) if compress else None
+        for frame in [packed] if packed else frames:
+            outbox.put(frame)
+        
+        game['subscribers'][client] = subscriber
+        self.watching[client] = game_id
+    
+    def remove_subscriber(self, client):
+        game_id = self.watching.pop(client, None)
+        if game_id in self.games:
+            self.games[game_id]['subscribers'].pop(client, None)
+    
+    def fan_out(self, game, shared_message, **fields):
+        slow = []
+        for client, (outbox, wire_format, compress) in game['subscribers'].items():
+            if outbox.qsize() > self.max_backlog:
+                slow.append(client)
+                continue
+            outbox.put(shared_message.frame(wire_format, compress, **fields))
+        
+        for client in slow:
+            # They can spectate again to start over from a snapshot
+            outbox, wire_format, compress = game['subscribers'].pop(client)
+            game_id = self.watching.pop(client, None)
+            outbox.put(SharedMessage({'type': 'spectate_end', 'reason': 'too_slow'}).frame(wire_format))
+            self.on_drop(client, game_id)
@@ -0,0 +1,313 @@
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+SWISS = 'swiss'
+ROUND_ROBIN = 'round_robin'
+SYSTEMS = (SWISS, ROUND_ROBIN)
+
+# Backtracking steps a Swiss pairing may take to avoid rematches before it
+# settles for the greedy pairing, which may repeat a few
+SWISS_SEARCH_BUDGET = 20000
+
+
+def round_robin_schedule(names):
+    """Every round of a round robin as [[(white, black)]], None stands for the bye.
+    
+    Berger tables: one seat stays put and meets the other seats in turn, the
+    rest pair off around it so everyone meets everyone exactly once. Colors
+    follow the Berger rule, every player ends up within one of as many whites
+    as blacks and never gets the same color three times running. Names are
+    seeded best first, the first two meet in the last round, then the next
+    two and so on.
+    """
+    players = list(names)
+    if len(players) % 2:
+        players.append(None)
+    count = len(players)
+    rotating = count - 1  # Seats 0 to rotating - 1 rotate, seat rotating is fixed
+    
+    # Seats as they are paired in the last round. An odd field's bye takes the
+    # fixed seat, the lowest seed sits out last.
+    last_round = [(rotating, rotating - 1)] + [(board - 1, rotating - 1 - board) for board in range(1, count // 2)]
+    if players[-1] is None:
+        last_round.append(last_round.pop(0)[::-1])
+    seats = [None] * count
+    for player, seat in zip(players, [seat for pair in last_round for seat in pair]):
+        seats[seat] = player
+    
+    rounds = []
+    for round_index in range(rotating):
+        # The fixed seat alternates colors, the other boards alternate down the table
+        opponent = seats[round_index]
+        pairs = [(seats[rotating], opponent) if round_index % 2 else (opponent, seats[rotating])]
+        for board in range(1, count // 2):
+            first = seats[(round_index + board) % rotating]
+            second = seats[(round_index - board) % rotating]
+            pairs.append((first, second) if board % 2 == 0 else (second, first))
+        rounds.append(pairs)
+    return rounds
+
+
+def swiss_pairs(ranked, scores, played, budget=SWISS_SEARCH_BUDGET):
+    """Pair players listed best first, avoiding rematches where possible.
+    
+    Within a score group the top half meets the bottom half, odd players out
+    float down to the next group. played(a, b) tells whether two players have
+    met. Returns [(a, b)] with a ranked above b.
+    """
+    remaining = [budget]
+    
+    def candidates(unpaired):
+        top = unpaired[0]
+        group = [name for name in unpaired[1:] if scores[name] == scores[top]]
+        # Top of the group against the middle of it, then the rest in order
+        middle = max(0, (len(group) + 1) // 2 - 1)
+        preferred = group[middle:] + group[:middle]
+        return preferred + unpaired[1 + len(group):]
+    
+    def search(unpaired, pairs):
+        if not unpaired:
+            return True
+        remaining[0] -= 1
+        if remaining[0] < 0:
+            return False
+        top = unpaired[0]
+        for opponent in candidates(unpaired):
+            if played(top, opponent):
+                continue
+            pairs.append((top, opponent))
+            if search([name for name in unpaired[1:] if name != opponent], pairs):
+                return True
+            pairs.pop()
+        return False
+    
+    pairs = []
+    if search(list(ranked), pairs):
+        return pairs
+    
+    # No rematch-free pairing found in budget, take the nearest opponent each time
+    log.info("Swiss pairing of %d players needed rematches", len(ranked))
+    pairs = []
+    unpaired = list(ranked)
+    while unpaired:
+        top = unpaired.pop(0)
+        fresh = [name for name in unpaired if not played(top, name)]
+        opponent = fresh[0] if fresh else unpaired[0]
+        unpaired.remove(opponent)
+        pairs.append((top, opponent))
+    return pairs
+
+
+class Tournament:
+    """Pairings, results and standings of one event, with no networking.
+    
+    Standings and the Buchholz and Sonneborn-Berger tiebreaks are kept up
+    to date as each result comes in, a round is paired as soon as the last
+    result of the one before is in.
+    """
+    
+    def __init__(self, tournament_id, name, system=SWISS, rounds=None, creator=None):
+        if system not in SYSTEMS:
+            raise ValueError(f"Unknown tournament system: {system}")
+        self.tournament_id = tournament_id
+        self.name = name
+        self.system = system
+        self.rounds = rounds  # Swiss only, a round robin has one round per opponent
+        self.creator = creator
+        self.state = 'open'  # 'open', then 'running', then 'finished'
+        
+        # {name: {'rating', 'score', 'wins', 'buchholz', 'sonneborn_berger',
+        #         'results': [(opponent or None, score, opponent_score)],
+        #         'colors': [color], 'byes', 'withdrawn'}}
+        self.players = {}
+        self.round = 0
+        self.schedule = None  # Round robin pairings for every round
+        self.boards = {}  # {board_id: (white, black)} still being played this round
+        self.ranking = None  # Standings as of the last result, None when out of date
+    
+    def join(self, name, rating):
+        if self.state != 'open' or name in self.players:
+            return False
+        self.players[name] = {
+            'rating': rating,
+            'score': 0.0,
+            'wins': 0,
+            'buchholz': 0.0,
+            'sonneborn_berger': 0.0,
+            'results': [],
+            'colors': [],
+            'byes': 0,
+            'withdrawn': False
+        }
+        self.ranking = None
+        return True
+    
+    def withdraw(self, name):
+        """Leave before the start, or stop being paired once it is running."""
+        player = self.players.get(name)
+        if player is None or self.state == 'finished':
+            return False
+        if self.state == 'open':
+            del self.players[name]
+        else:
+            player['withdrawn'] = True
+        self.ranking = None
+        return True
+    
+    def start(self):
+        if self.state != 'open' or len(self.players) < 2:
+            return False
+        self.state = 'running'
+        if self.system == ROUND_ROBIN:
+            # Seeded by rating so the strongest meet late
+            seeded = sorted(self.players, key=lambda name: (-self.players[name]['rating'], name))
+            self.schedule = round_robin_schedule(seeded)
+            self.rounds = len(self.schedule)
+        elif not self.rounds:
+            # Enough rounds for a single player to end up on top
+            self.rounds = max(1, math.ceil(math.log2(len(self.players))))
+        return True
+    
+    def next_round(self, board_id):
+        """Pair the next round, returns ([(white, black, board_id)], bye or None).
+        
+        board_id(round, board) names each board. Returns None once the last
+        round is over and marks the tournament finished.
+        """
+        if self.state != 'running' or self.boards:
+            return None
+        active = [name for name, player in self.players.items() if not player['withdrawn']]
+        if self.round >= self.rounds or (self.system == SWISS and len(active) < 2):
+            self.state = 'finished'
+            return None
+        self.round += 1
+        
+        bye = None
+        if self.system == ROUND_ROBIN:
+            pairs = []
+            for first, second in self.schedule[self.round - 1]:
+                if first is None or second is None:
+                    bye = first or second
+                else:
+                    pairs.append((first, second))
+        else:
+            ranked = self.ranked_names(active)
+            if len(ranked) % 2:
+                # Lowest ranked player who hasn't had one yet
+                bye = next((name for name in reversed(ranked) if not self.players[name]['byes']), ranked[-1])
+                ranked.remove(bye)
+            scores = {name: self.players[name]['score'] for name in ranked}
+            pairs = swiss_pairs(ranked, scores, self.have_played)
+            pairs = [self.assign_colors(first, second) for first, second in pairs]
+        
+        if bye is not None and not self.players[bye]['withdrawn']:
+            self.players[bye]['byes'] += 1
+            self.add_result(bye, None, 1.0, None)
+            self.add_points(bye, 1.0)
+        
+        pairings = []
+        for board, (white, black) in enumerate(pairs, 1):
+            current = board_id(self.round, board)
+            self.boards[current] = (white, black)
+            self.players[white]['colors'].append('white')
+            self.players[black]['colors'].append('black')
+            pairings.append((white, black, current))
+        return pairings, bye
+    
+    def record_result(self, board_id, white_score, black_score):
+        """Score a board, returns True once it was the last of its round."""
+        board = self.boards.pop(board_id, None)
+        if board is None:
+            return False
+        white, black = board
+        # Both games go on record before any points move, so neither side's
+        # new points reach the other twice
+        self.add_result(white, black, white_score, black_score)
+        self.add_result(black, white, black_score, white_score)
+        self.add_points(white, white_score)
+        self.add_points(black, black_score)
+        return not self.boards
+    
+    def have_played(self, first, second):
+        return any(opponent == second for opponent, score, opponent_score in self.players[first]['results'])
+    
+    def assign_colors(self, first, second):
+        # White to whoever has had it less, then to whoever had black last,
+        # then to the higher ranked player (first)
+        def balance(name):
+            colors = self.players[name]['colors']
+            return colors.count('white') - colors.count('black'), colors[-1:] == ['white']
+        if balance(second) < balance(first):
+            return second, first
+        return first, second
+    
+    def add_result(self, name, opponent, score, opponent_score):
+        player = self.players[name]
+        if opponent is not None:
+            # The opponent's points so far count towards the tiebreaks right
+            # away, any after that arrive through add_points
+            opponent_points = self.players[opponent]['score']
+            player['buchholz'] += opponent_points
+            player['sonneborn_berger'] += score * opponent_points
+            if score == 1:
+                player['wins'] += 1
+        player['results'].append((opponent, score, opponent_score))
+    
+    def add_points(self, name, points):
+        player = self.players[name]
+        player['score'] += points
+        # Everyone this player has met gains the same in Buchholz, and in
+        # Sonneborn-Berger as much as they scored against them
+        for opponent, score, opponent_score in player['results']:
+            if opponent is not None:
+                self.players[opponent]['buchholz'] += points
+                self.players[opponent]['sonneborn_berger'] += opponent_score * points
+        self.ranking = None
+    
+    def ranked_names(self, names=None):
+        names = self.players if names is None else names
+        return sorted(names, key=lambda name: (
+            -self.players[name]['score'],
+            -self.players[name]['buchholz'],
+            -self.players[name]['sonneborn_berger'],
+            -self.players[name]['wins'],
+            -self.players[name]['rating'],
+            name
+        ))
+    
+    def standings(self):
+        if self.ranking is None:
+            self.ranking = [{
+                'rank': rank,
+                'name': name,
+                'score': self.players[name]['score'],
+                'buchholz': self.players[name]['buchholz'],
+                'sonneborn_berger': self.players[name]['sonneborn_berger'],
+                'wins': self.players[name]['wins'],
+                'withdrawn': self.players[name]['withdrawn']
+            } for rank, name in enumerate(self.ranked_names(), 1)]
+        return self.ranking
+    
+    def to_dict(self):
+        """Everything needed to carry the tournament over to another process."""
+        return {key: value for key, value in vars(self).items() if key != 'ranking'}
+    
+    @classmethod
+    def from_dict(cls, state):
+        tournament = cls.__new__(cls)
+        vars(tournament).update(state)
+        tournament.ranking = None
+        return tournament
+    
+    def summary(self):
+        return {
+            'tournament': self.tournament_id,
+            'name': self.name,
+            'system': self.system,
+            'rounds': self.rounds,
+            'round': self.round,
+            'state': self.state,
+            'players': len(self.players)
+        }
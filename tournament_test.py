@@ -0,0 +1,45 @@
+import unittest
+from tournament import round_robin_schedule
+
+
+class RoundRobinScheduleTest(unittest.TestCase):
+    def play(self, size):
+        names = [f'player{index}' for index in range(size)]
+        colors = {name: '' for name in names}
+        byes = {name: 0 for name in names}
+        pairings = set()
+        for pairs in round_robin_schedule(names):
+            for white, black in pairs:
+                if white is None or black is None:
+                    byes[white or black] += 1
+                    continue
+                pairings.add(frozenset((white, black)))
+                colors[white] += 'W'
+                colors[black] += 'B'
+        return names, colors, byes, pairings
+    
+    def test_everyone_meets_everyone_once(self):
+        for size in range(2, 21):
+            names, colors, byes, pairings = self.play(size)
+            self.assertEqual(len(pairings), size * (size - 1) // 2)
+            for name in names:
+                self.assertEqual(len(colors[name]), size - 1)
+                self.assertEqual(byes[name], size % 2)
+    
+    def test_colors_balanced(self):
+        for size in range(2, 21):
+            names, colors, byes, pairings = self.play(size)
+            for name, played in colors.items():
+                with self.subTest(size=size, player=name, colors=played):
+                    self.assertLessEqual(abs(played.count('W') - played.count('B')), 1)
+                    self.assertNotIn('WWW', played)
+                    self.assertNotIn('BBB', played)
+    
+    def test_top_seeds_meet_last(self):
+        for size in range(2, 21):
+            last_round = round_robin_schedule([f'player{index}' for index in range(size)])[-1]
+            self.assertTrue({('player0', 'player1'), ('player1', 'player0')} & set(last_round))
+
+
+if __name__ == "__main__":
+    unittest.main()